@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class GameboardConfig(AppConfig):
     name = 'gameboard'
+
+    def ready(self):
+        # Connects the signals which keep the live standings, cached memberships, and cached results up to date
+        from gameboard.helpers import membership_helper, result_helper, standings_helper  # noqa: F401
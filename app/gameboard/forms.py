@@ -11,6 +11,10 @@ from gameboard.models import Round, Game
 class ImportScoresForm(forms.Form):
     # title = forms.CharField(max_length=50)
     scores = forms.FileField()
+    # Version of the csv format, see ScoreReader
+    version = forms.IntegerField(required=False, min_value=1, initial=2)
+    # Only import the rounds which aren't already in the group
+    skip_existing = forms.BooleanField(required=False)
 
 
 class AddRoundForm(forms.Form):
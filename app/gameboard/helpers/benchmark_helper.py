@@ -0,0 +1,270 @@
+import csv
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, date, timedelta
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from gameboard.helpers.import_helper import BulkImportScores
+from gameboard.helpers.synthetic_helper import SyntheticData
+from gameboard.models import Group, Player, Round, Team, Bracket, BracketMatch, BracketType, Tournament
+from gameboard.queries.find import find_statistic, find_player_monthly_log
+from gameboard.queries.generate import favorite_games
+
+# Dataset sizes to benchmark at, as arguments to SyntheticData
+BENCHMARK_SIZES = {
+    'small': {'groups': 1, 'players': 10, 'games': 20, 'years': 1, 'rounds_per_day': 2},
+    'medium': {'groups': 1, 'players': 20, 'games': 50, 'years': 3, 'rounds_per_day': 5},
+    'large': {'groups': 2, 'players': 40, 'games': 100, 'years': 5, 'rounds_per_day': 20},
+}
+
+# Number of rows in the score csv imported at each size
+IMPORT_ROWS = {
+    'small': 10000,
+    'medium': 100000,
+    'large': 100000,
+}
+
+# The statistics which are turned into trophies on the group page
+TROPHY_TYPES = ['wins', 'percentage', 'heavy', 'unique']
+
+
+def current_commit():
+    """
+    Get the commit the benchmarks are being run against, so results can be told apart.
+
+    :return: The commit hash, or None if this isn't a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(function, repeat=3):
+    """
+    Measure how long a function takes, how many queries it runs, and how much memory it needs at its peak. The time is
+    the median of several runs, and memory is measured on a separate run, as tracing memory slows everything down.
+
+    :param function: A function taking no arguments.
+    :param repeat: How many times to time the function.
+    :return: A dictionary of the measurements.
+    """
+    times = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        queries = len(context.captured_queries)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_time_ms': round(statistics.median(times) * 1000, 3),
+        'queries': queries,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+class Benchmark:
+    """
+    Seeds a database with synthetic data at several sizes, and measures the query layer and api endpoints against it.
+
+    This wipes the database it is run against, so it should only ever be pointed at a throwaway database (the
+    benchmark command creates a test database for this).
+    """
+    def __init__(self, sizes=('small', 'medium'), repeat=3, seed=1, log=None):
+        """
+        :param sizes: The names of the BENCHMARK_SIZES to run at.
+        :param repeat: How many times each case is timed.
+        :param seed: The seed for the synthetic data, so every run measures the same dataset.
+        :param log: A function to call with progress messages.
+        """
+        self.sizes = sizes
+        self.repeat = repeat
+        self.seed = seed
+        self.log = log if log else (lambda message: None)
+
+    def run(self):
+        """
+        Run every benchmark case at every size.
+
+        :return: A dictionary of the results, ready to be written as json.
+        """
+        results = []
+        for size in self.sizes:
+            self.log("Seeding {} dataset".format(size))
+            call_command('flush', interactive=False, verbosity=0)
+            counts = SyntheticData(seed=self.seed, prefix='benchmark', **BENCHMARK_SIZES[size]).generate()
+
+            for case, function in self.cases().items():
+                self.log("Running {} [{}]".format(case, size))
+                try:
+                    result = measure(function, self.repeat)
+                except Exception as e:
+                    result = {'error': repr(e)}
+                results.append(dict(size=size, case=case, rounds=counts['rounds'], **result))
+
+            self.log("Running import_scores [{}]".format(size))
+            results.append(dict(size=size, case='import_scores', rounds=counts['rounds'], **self.measure_import(size)))
+
+        return {
+            'commit': current_commit(),
+            'created': datetime.now().isoformat(),
+            'vendor': connection.vendor,
+            'results': results,
+        }
+
+    def cases(self):
+        """
+        Build the benchmark cases for the data currently in the database.
+
+        :return: A dictionary of case name to a function taking no arguments.
+        """
+        group = Group.objects.order_by('pk').first()
+        player = Player.objects.filter(primary_group=group).annotate(
+            played=Count('game_player')
+        ).order_by('-played').first()
+        tournament = self.create_tournament(group)
+
+        client = Client()
+        client.force_login(player)
+
+        cases = {
+            'trophies': lambda: [find_statistic(group, trophy_type) for trophy_type in TROPHY_TYPES],
+            'favorite_games': lambda: favorite_games(player),
+            'find_player_monthly_log': lambda: find_player_monthly_log(player),
+            'tournament_info': lambda: client.get('/tournament_info/{}/'.format(tournament.pk)),
+            'tournament_stats': lambda: client.get('/tournament_stats/{}/'.format(tournament.pk)),
+        }
+        for trophy_type in TROPHY_TYPES:
+            cases['find_statistic[{}]'.format(trophy_type)] = \
+                lambda trophy_type=trophy_type: find_statistic(group, trophy_type)
+        return cases
+
+    def measure_import(self, size):
+        """
+        Measure importing a score csv into a new group. Imports write a lot of data, so this is only run once.
+
+        :param size: The name of the size being run, which sets the number of rows in the csv (see IMPORT_ROWS).
+        :return: A dictionary of the measurements, including the rows imported a second.
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'scores.csv')
+        write_score_csv(path, IMPORT_ROWS[size], seed=self.seed)
+        try:
+            group = Group.objects.create(name='Import Benchmark')
+            importer = BulkImportScores(group, claim_players=True)
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                stats = importer.import_file(path)
+                duration = time.perf_counter() - start
+        except Exception as e:
+            return {'error': repr(e)}
+        finally:
+            os.remove(path)
+            os.rmdir(directory)
+        return {
+            'wall_time_ms': round(duration * 1000, 3),
+            'queries': len(context.captured_queries),
+            'rows': stats['rows'],
+            'rows_per_second': round(stats['rows'] / duration, 1),
+            'loader': 'copy' if importer.use_copy else 'bulk_create',
+        }
+
+    @staticmethod
+    def create_tournament(group, team_count=4, match_count=16):
+        """
+        Create a tournament out of a group's players and their most recent rounds.
+
+        :param group: The group to hold the tournament in.
+        :param team_count: How many teams to split the players into.
+        :param match_count: How many of the recent rounds to use as matches.
+        :return: The tournament.
+        """
+        bracket = Bracket.objects.create(type=BracketType.ROUND_ROBIN)
+        players = list(group.players.order_by('pk'))
+        for number in range(team_count):
+            team = Team.objects.create(name='Team {}'.format(number + 1), color='000000')
+            team.players.add(*players[number::team_count])
+            bracket.teams.add(team)
+        for number, game_round in enumerate(Round.objects.filter(group=group).order_by('-date')[:match_count]):
+            bracket.matches.add(BracketMatch.objects.create(match=number + 1, round=game_round))
+        return Tournament.objects.create(name='Benchmark Tournament', bracket=bracket, group=group)
+
+
+def write_score_csv(path, rows, players=20, games=50, seed=None):
+    """
+    Write a score csv (in the version 2 format, see ScoreReader) full of random rounds.
+
+    :param path: Where to write the csv.
+    :param rows: How many rounds to write.
+    :param players: How many player columns the csv has.
+    :param games: How many different games are played.
+    :param seed: A seed for the random generator.
+    :return: None
+    """
+    generator = random.Random(seed)
+    names = ['importer{}'.format(number) for number in range(1, players + 1)]
+    first_day = date.today() - timedelta(days=365 * 5)
+    with open(path, mode='w', newline='') as f:
+        writer = csv.writer(f)
+        header = ['Date', 'Game', 'Coop']
+        for name in names:
+            header += [name, name + ' score']
+        writer.writerow(header)
+
+        for _ in range(rows):
+            line = [(first_day + timedelta(days=generator.randrange(365 * 5))).strftime("%m/%d/%y"),
+                    'Import Game {}'.format(generator.randrange(games)), '']
+            line += [''] * (players * 2)
+            playing = generator.sample(range(players), generator.randint(2, min(6, players)))
+            for rank, player in enumerate(playing, start=1):
+                line[3 + player * 2] = rank
+                line[4 + player * 2] = generator.randint(0, 100)
+            writer.writerow(line)
+
+
+def compare(old, new):
+    """
+    Compare two sets of benchmark results, matching up cases by their size and name.
+
+    :param old: The results of an earlier run (as returned by Benchmark.run())
+    :param new: The results of a newer run.
+    :return: A list of rows, each containing the size, case, and old and new value of every measurement.
+    """
+    old_results = {(result['size'], result['case']): result for result in old['results']}
+    rows = []
+    for result in new['results']:
+        previous = old_results.get((result['size'], result['case']))
+        if previous is None:
+            continue
+        row = {'size': result['size'], 'case': result['case']}
+        for key in ['wall_time_ms', 'queries', 'peak_memory_kb', 'rows_per_second']:
+            row[key] = (previous.get(key), result.get(key))
+        rows.append(row)
+    return rows
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,575 @@
+import math
+
+from django.db import transaction
+
+from gameboard.models import Bracket, BracketMatch, BracketType, Round, Team, TournamentResult
+
+# Bumped whenever the layout of a bracket changes, so older layouts are rebuilt
+LAYOUT_VERSION = 3
+
+# Fills a slot which no team will ever play in, so that the team in the other slot goes straight through
+BYE = 'bye'
+
+ROUND_ROBIN_STAGE = 'round robin'
+SWISS_STAGE = 'swiss'
+# Stages where teams play a set of matches rather than being knocked out, and the most wins takes the bracket
+LEAGUE_STAGES = (ROUND_ROBIN_STAGE, SWISS_STAGE)
+
+
+class BracketError(Exception):
+    """
+    Raised when a bracket can't be laid out, a result doesn't fit into it, or its tournament has been finalized.
+    """
+    pass
+
+
+def is_finalized(bracket):
+    """
+    Check whether a bracket's tournament has been finalized, after which the bracket must never change, or it would no
+    longer match the frozen results (see result_helper). Callers changing the bracket should hold its lock, which
+    finalizing takes too.
+
+    :param bracket: The bracket.
+    :return: True if the bracket's tournament has been finalized.
+    """
+    return TournamentResult.objects.filter(tournament__bracket=bracket.pk).exists()
+
+
+def bracket_type(bracket):
+    """
+    Get the type of a bracket. Depending on what created it, the type is saved as the name, value, or str() of the
+    BracketType.
+
+    :param bracket: The bracket.
+    :return: The BracketType.
+    """
+    if isinstance(bracket.type, BracketType):
+        return bracket.type
+    for member in BracketType:
+        if bracket.type in (member.name, member.value, str(member)):
+            return member
+    raise BracketError("Unknown bracket type '{}'".format(bracket.type))
+
+
+def seed_order(size):
+    """
+    Get the seeds in the order they are placed into the first round, so that the best seeds meet as late as possible.
+
+    :param size: The number of slots in the first round, a power of two.
+    :return: A list of seeds, counting from 1. Neighbouring pairs play each other.
+    """
+    order = [1]
+    while len(order) < size:
+        total = len(order) * 2 + 1
+        order = [seed for first in order for seed in (first, total - first)]
+    return order
+
+
+def build_layout(bracket, seeds=None):
+    """
+    Work out every match a bracket will have, and replay the results it already has.
+
+    The layout is a dictionary which can be stored as json:
+        matches: every match, in play order, where match number n is matches[n - 1]. Each holds its stage and round (for
+                 drawing it), its two team slots, the matches feeding each slot, the slots its winner and loser move on
+                 to, and its result once played.
+        next: team id (as a string) to the number of the next match the team plays, or None once they are out.
+        wins: team id (as a string) to how many matches the team has won.
+        champion: the winning team's id, once there is one.
+        errors: (match number, message) of any results which could not be placed.
+        scheduled: whether the bracket has placeholders for its unplayed matches (see schedule_bracket).
+        reset: the number of a double elimination bracket's second final (see add_elimination_matches), or None. When
+               it isn't needed it is settled without a result.
+        revision: counts every change to the layout, so anything worked out from it can be cached.
+
+    Teams which are still waiting for an opponent have None in the slot, and byes are filled with BYE.
+
+    :param bracket: The bracket.
+    :param seeds: The team ids in seeded order, best first. Defaults to the bracket's saved seeds (see
+                  team_helper.seed_bracket), followed by any teams added since in the order they were created.
+    :return: The layout.
+    """
+    if seeds is None:
+        team_ids = list(bracket.teams.order_by('pk').values_list('pk', flat=True))
+        current = set(team_ids)
+        seeded = [team for team in bracket.seeds or [] if team in current]
+        unseeded = current - set(seeded)
+        seeds = seeded + [team for team in team_ids if team in unseeded]
+    teams = list(seeds)
+    if len(teams) < 2:
+        raise BracketError("A bracket needs at least two teams")
+    kind = bracket_type(bracket)
+    layout = {
+        'version': LAYOUT_VERSION,
+        'type': kind.value,
+        'revision': 0,
+        'teams': teams,
+        'matches': [],
+        'next': {str(team): None for team in teams},
+        'wins': {str(team): 0 for team in teams},
+        'champion': None,
+        'errors': [],
+        'reset': None,
+    }
+    if kind is BracketType.ROUND_ROBIN:
+        add_round_robin_matches(layout)
+    elif kind is BracketType.SWISS:
+        layout['swiss_rounds'] = math.ceil(math.log2(len(teams)))
+        layout['opponents'] = {str(team): [] for team in teams}
+        add_swiss_round(layout)
+    else:
+        add_elimination_matches(layout, double=kind is BracketType.DOUBLE_ELIMINATION)
+
+    bracket_matches = list(bracket.matches.order_by('match', 'pk'))
+    # Placeholders (see schedule_bracket) haven't been played yet
+    layout['scheduled'] = any(bracket_match.round_id is None for bracket_match in bracket_matches)
+    bracket_matches = [bracket_match for bracket_match in bracket_matches if bracket_match.round_id is not None]
+    ranks = round_ranks([bracket_match.round_id for bracket_match in bracket_matches])
+    team_players = find_team_players(teams)
+    for bracket_match in bracket_matches:
+        try:
+            match = find_match(layout, bracket_match.match)
+            winner = match_winner(match, ranks.get(bracket_match.round_id, []), team_players)
+            record_result(layout, match, winner, bracket_match.pk)
+        except BracketError as e:
+            layout['errors'].append([bracket_match.match, str(e)])
+    return layout
+
+
+def get_layout(bracket):
+    """
+    Get the layout of a bracket, building and saving it if it was never built or has been reset.
+
+    :param bracket: The bracket.
+    :return: The layout (see build_layout).
+    """
+    if bracket.layout is None or bracket.layout.get('version') != LAYOUT_VERSION:
+        bracket.layout = build_layout(bracket)
+        bracket.save(update_fields=['layout'])
+    return bracket.layout
+
+
+def new_match(layout, stage, round_number):
+    match = {
+        'match': len(layout['matches']) + 1,
+        'stage': stage,
+        'round': round_number,
+        'teams': [None, None],
+        'feeders': [None, None],
+        'winner_to': None,
+        'loser_to': None,
+        'winner': None,
+        'loser': None,
+        'result': None,
+    }
+    layout['matches'].append(match)
+    return match
+
+
+def link(source, outcome, target, slot):
+    """
+    Send the winner (or loser) of one match on to a slot of another.
+
+    :param source: The match played first.
+    :param outcome: 'winner' or 'loser'.
+    :param target: The match they move on to.
+    :param slot: The slot of the target match, 0 or 1.
+    :return: None
+    """
+    source[outcome + '_to'] = [target['match'], slot]
+    target['feeders'][slot] = [source['match'], outcome]
+
+
+def add_elimination_matches(layout, double=False):
+    """
+    Add the matches of a single or double elimination bracket. The field is padded out to a power of two with byes,
+    which go to the best seeds.
+
+    A double elimination bracket has a losers bracket, where the losers of the first round play each other, then every
+    following losers round alternates between taking in the losers of the next winners round (in reverse order, so
+    teams don't meet again straight away) and halving the field. The grand final is the winner of each bracket. If the
+    losers bracket's team wins it, both teams have lost once, so they play a second final (the bracket reset).
+
+    :param layout: The layout being built.
+    :param double: Whether teams must lose twice to be knocked out.
+    :return: None
+    """
+    teams = layout['teams']
+    size = 2 ** math.ceil(math.log2(len(teams)))
+    slots = [teams[seed - 1] if seed <= len(teams) else BYE for seed in seed_order(size)]
+
+    # Every match is created before any team is placed, as placing a team can settle matches with byes
+    winners = [[new_match(layout, 'winners', 1) for _ in range(size // 2)]]
+    while len(winners[-1]) > 1:
+        following = [new_match(layout, 'winners', len(winners) + 1) for _ in range(len(winners[-1]) // 2)]
+        for index, match in enumerate(winners[-1]):
+            link(match, 'winner', following[index // 2], index % 2)
+        winners.append(following)
+
+    if double:
+        losers = []
+        if len(winners) > 1:
+            losers.append([new_match(layout, 'losers', 1) for _ in range(size // 4)])
+            for index, match in enumerate(winners[0]):
+                link(match, 'loser', losers[-1][index // 2], index % 2)
+        for winners_round in winners[1:]:
+            dropping = [new_match(layout, 'losers', len(losers) + 1) for _ in winners_round]
+            for index, match in enumerate(losers[-1]):
+                link(match, 'winner', dropping[index], 0)
+            for index, match in enumerate(reversed(winners_round)):
+                link(match, 'loser', dropping[index], 1)
+            losers.append(dropping)
+            if len(dropping) > 1:
+                halving = [new_match(layout, 'losers', len(losers) + 1) for _ in range(len(dropping) // 2)]
+                for index, match in enumerate(dropping):
+                    link(match, 'winner', halving[index // 2], index % 2)
+                losers.append(halving)
+
+        final = new_match(layout, 'final', 1)
+        link(winners[-1][0], 'winner', final, 0)
+        if losers:
+            link(losers[-1][0], 'winner', final, 1)
+        else:
+            # With only two teams, the loser of the only winners match goes straight to the final
+            link(winners[-1][0], 'loser', final, 1)
+        reset = new_match(layout, 'final', 2)
+        link(final, 'winner', reset, 0)
+        link(final, 'loser', reset, 1)
+        layout['reset'] = reset['match']
+
+    for index, match in enumerate(winners[0]):
+        place(layout, match, 0, slots[index * 2])
+        place(layout, match, 1, slots[index * 2 + 1])
+
+
+def add_round_robin_matches(layout):
+    """
+    Add the matches of a round robin, where every team plays every other team once. Rounds are scheduled with the
+    circle method, so that every team plays once a round (or sits out, with an odd number of teams).
+
+    :param layout: The layout being built.
+    :return: None
+    """
+    entrants = list(layout['teams']) + ([BYE] if len(layout['teams']) % 2 else [])
+    layout['schedule'] = {str(team): [] for team in layout['teams']}
+    for round_number in range(1, len(entrants)):
+        for index in range(len(entrants) // 2):
+            home, away = entrants[index], entrants[-1 - index]
+            if BYE not in (home, away):
+                match = new_match(layout, ROUND_ROBIN_STAGE, round_number)
+                match['teams'] = [home, away]
+                layout['schedule'][str(home)].append(match['match'])
+                layout['schedule'][str(away)].append(match['match'])
+        entrants = [entrants[0], entrants[-1]] + entrants[1:-1]
+    for team, schedule in layout['schedule'].items():
+        layout['next'][team] = schedule[0] if schedule else None
+
+
+def find_match(layout, number):
+    """
+    Get a match of a layout by its number.
+
+    :param layout: The layout.
+    :param number: The match number, counting from 1.
+    :return: The match.
+    """
+    if not 1 <= number <= len(layout['matches']):
+        raise BracketError("Match {} is not part of this bracket".format(number))
+    return layout['matches'][number - 1]
+
+
+def next_match(layout, team):
+    """
+    Get the next match a team plays.
+
+    :param layout: The layout.
+    :param team: The team's id.
+    :return: The match, or None if the team has no more matches (or isn't in the bracket).
+    """
+    number = layout['next'].get(str(team))
+    return layout['matches'][number - 1] if number else None
+
+
+def place(layout, match, slot, team):
+    """
+    Put a team into a slot of a match, settling the match if its other team is a bye.
+    """
+    match['teams'][slot] = team
+    if team is not None and team != BYE:
+        layout['next'][str(team)] = match['match']
+    first, second = match['teams']
+    if first is not None and second is not None and match['winner'] is None and BYE in match['teams']:
+        finish(layout, match, second if first == BYE else first, BYE)
+
+
+def finish(layout, match, winner, loser):
+    """
+    Settle a match, and move its teams on to their next matches.
+    """
+    match['winner'] = winner
+    match['loser'] = loser
+    for team, destination in ((winner, match['winner_to']), (loser, match['loser_to'])):
+        if destination:
+            place(layout, layout['matches'][destination[0] - 1], destination[1], team)
+        elif team != BYE and match['stage'] not in LEAGUE_STAGES:
+            layout['next'][str(team)] = None
+    if match['winner_to'] is None and match['stage'] not in LEAGUE_STAGES:
+        layout['champion'] = winner
+    if layout.get('reset') and match['winner_to'] == [layout['reset'], 0] and winner == match['teams'][0]:
+        reset = layout['matches'][layout['reset'] - 1]
+        if reset['winner'] is None:
+            # The winners bracket's team hasn't lost, so takes the bracket without a reset
+            finish(layout, reset, winner, loser)
+
+
+def record_result(layout, match, winner, result=None):
+    """
+    Record the winner of a match, and move the teams on. Only the matches the teams move on to are touched, so this
+    takes the same time however large the bracket is.
+
+    :param layout: The layout.
+    :param match: The match which was played.
+    :param winner: The winning team's id.
+    :param result: The id of the BracketMatch holding the result.
+    :return: None
+    """
+    if match['winner'] is not None:
+        raise BracketError("Match {} already has a result".format(match['match']))
+    if None in match['teams']:
+        raise BracketError("Match {} is still waiting for its teams".format(match['match']))
+    if winner not in match['teams']:
+        raise BracketError("Team {} is not playing in match {}".format(winner, match['match']))
+
+    match['result'] = result
+    layout['wins'][str(winner)] += 1
+    finish(layout, match, winner, match['teams'][1] if winner == match['teams'][0] else match['teams'][0])
+    layout['revision'] += 1
+
+    if match['stage'] == ROUND_ROBIN_STAGE:
+        # Results can come in any order, so skip past any later matches which were already played
+        for team in match['teams']:
+            number = layout['next'][str(team)]
+            while number is not None and layout['matches'][number - 1]['winner'] is not None:
+                schedule = layout['schedule'][str(team)]
+                position = schedule.index(number) + 1
+                number = schedule[position] if position < len(schedule) else None
+            layout['next'][str(team)] = number
+    elif match['stage'] == SWISS_STAGE:
+        for team in match['teams']:
+            layout['next'][str(team)] = None
+        # The next round can only be paired once every result of this one is in
+        if all(played['winner'] is not None for played in layout['matches'] if played['round'] == match['round']) \
+                and match['round'] < layout['swiss_rounds']:
+            add_swiss_round(layout)
+
+    if match['stage'] in LEAGUE_STAGES and all(played['winner'] is not None for played in layout['matches']):
+        # Ties go to the better seed
+        layout['champion'] = max(layout['teams'], key=lambda team: layout['wins'][str(team)])
+
+
+def add_swiss_round(layout):
+    """
+    Pair the teams for the next round of a Swiss bracket. The first round pairs the top half of the seeds with the
+    bottom half. After that teams are ordered by wins (then seed), and each is paired with the best placed team below
+    it which it hasn't played yet (see swiss_pairings). With an odd number of teams, the lowest placed team which
+    hasn't had a bye sits the round out, and is given the win.
+
+    :param layout: The layout.
+    :return: None
+    """
+    round_number = layout['matches'][-1]['round'] + 1 if layout['matches'] else 1
+    seeds = {team: index for index, team in enumerate(layout['teams'])}
+    order = sorted(layout['teams'], key=lambda team: (-layout['wins'][str(team)], seeds[team]))
+    opponents = {team: set(layout['opponents'][str(team)]) for team in layout['teams']}
+
+    if len(order) % 2:
+        sitting_out = next((team for team in reversed(order) if BYE not in opponents[team]), order[-1])
+        order.remove(sitting_out)
+        match = new_match(layout, SWISS_STAGE, round_number)
+        layout['opponents'][str(sitting_out)].append(BYE)
+        layout['wins'][str(sitting_out)] += 1
+        place(layout, match, 0, sitting_out)
+        place(layout, match, 1, BYE)
+        layout['next'][str(sitting_out)] = None
+
+    if round_number == 1:
+        half = len(order) // 2
+        pairs = [[first, second] for first, second in zip(order[:half], order[half:])]
+    else:
+        pairs = swiss_pairings(order, opponents)
+    for first, second in pairs:
+        match = new_match(layout, SWISS_STAGE, round_number)
+        place(layout, match, 0, first)
+        place(layout, match, 1, second)
+        layout['opponents'][str(first)].append(second)
+        layout['opponents'][str(second)].append(first)
+
+
+def swiss_pairings(order, opponents):
+    """
+    Pair up teams, keeping teams with the same standing together while avoiding rematches. Each team is paired with the
+    next unpaired team it hasn't played, then any rematches left at the bottom are swapped with the nearest pair above
+    which gives two new pairings. Looking up who has played who is a set lookup, so this stays quick for large fields.
+
+    :param order: The teams, best placed first. There must be an even number of them.
+    :param opponents: A dictionary of team to the set of teams it has already played.
+    :return: A list of [team, team] pairs.
+    """
+    paired = set()
+    pairs = []
+    for index, team in enumerate(order):
+        if team in paired:
+            continue
+        partner = None
+        for other_index in range(index + 1, len(order)):
+            other = order[other_index]
+            if other in paired:
+                continue
+            if partner is None:
+                # A rematch, unless someone better comes along
+                partner = other
+            if other not in opponents[team]:
+                partner = other
+                break
+        paired.update((team, partner))
+        pairs.append([team, partner])
+
+    for index, (first, second) in enumerate(pairs):
+        if second not in opponents[first]:
+            continue
+        for other_index in range(index - 1, -1, -1):
+            third, fourth = pairs[other_index]
+            if fourth not in opponents[first] and second not in opponents[third]:
+                pairs[other_index], pairs[index] = [third, second], [first, fourth]
+                break
+            if third not in opponents[first] and second not in opponents[fourth]:
+                pairs[other_index], pairs[index] = [fourth, second], [first, third]
+                break
+    return pairs
+
+
+def round_ranks(round_ids):
+    """
+    Get the ranks of the players in some rounds.
+
+    :param round_ids: A list of round ids.
+    :return: A dictionary of round id to a list of (player id, rank) tuples.
+    """
+    ranks = {}
+    for round_id, player_id, rank in Round.players.through.objects.filter(round_id__in=round_ids).values_list(
+            'round_id', 'playerrank__player_id', 'playerrank__rank'):
+        ranks.setdefault(round_id, []).append((player_id, rank))
+    return ranks
+
+
+def find_team_players(teams):
+    """
+    :param teams: A list of team ids.
+    :return: A dictionary of player id to their team's id.
+    """
+    return dict(Team.players.through.objects.filter(team_id__in=teams).values_list('player_id', 'team_id'))
+
+
+def match_winner(match, ranks, team_players):
+    """
+    Work out which team won a match, from the round it was played in. The team with the best placed player wins.
+
+    :param match: The match.
+    :param ranks: A list of (player id, rank) tuples of the round.
+    :param team_players: A dictionary of player id to their team's id.
+    :return: The winning team's id.
+    """
+    best = {}
+    for player_id, rank in ranks:
+        team = team_players.get(player_id)
+        if team in match['teams'] and rank is not None:
+            best[team] = min(rank, best.get(team, rank))
+    if not best:
+        raise BracketError("Nobody from match {}'s teams placed in its round".format(match['match']))
+    ordered = sorted(best.items(), key=lambda team_rank: team_rank[1])
+    if len(ordered) > 1 and ordered[0][1] == ordered[1][1]:
+        raise BracketError("Match {} is a draw".format(match['match']))
+    return ordered[0][0]
+
+
+def add_result(bracket, number, game_round):
+    """
+    Add the round a match was played in to a bracket, and move the teams on. A scheduled match's placeholder is filled
+    in, otherwise a new BracketMatch is added.
+
+    :param bracket: The bracket.
+    :param number: The match number.
+    :param game_round: The round the match was played in.
+    :return: The BracketMatch, and the match from the layout.
+    """
+    with transaction.atomic():
+        # Results coming in together would otherwise overwrite each other's layout
+        bracket = Bracket.objects.select_for_update().get(pk=bracket.pk)
+        if is_finalized(bracket):
+            raise BracketError("Results can't be added once the tournament has been finalized")
+        layout = get_layout(bracket)
+        match = find_match(layout, number)
+        winner = match_winner(match, round_ranks([game_round.pk]).get(game_round.pk, []),
+                              find_team_players([team for team in match['teams'] if team not in (None, BYE)]))
+        match_count = len(layout['matches'])
+
+        bracket_match = bracket.matches.filter(match=number, round__isnull=True).first()
+        if bracket_match is not None:
+            bracket_match.round = game_round
+            bracket_match.save(update_fields=['round'])
+            record_result(layout, match, winner, bracket_match.pk)
+        else:
+            bracket_match = BracketMatch.objects.create(match=number, round=game_round)
+            record_result(layout, match, winner, bracket_match.pk)
+            bracket.matches.add(bracket_match)
+        if layout['scheduled'] and len(layout['matches']) > match_count:
+            # A new Swiss round was paired
+            add_placeholders(bracket, layout['matches'][match_count:])
+        reset = find_match(layout, layout['reset']) if layout.get('reset') else None
+        if reset is not None and reset['winner'] is not None and reset['result'] is None:
+            # The reset wasn't needed, so will never be played
+            bracket.matches.filter(match=reset['match'], round__isnull=True).delete()
+        # Adding matches resets the layout, so it is saved afterwards. Filling in a placeholder doesn't change the
+        # bracket's matches, so it must be marked as changed here for delta exports and live standings to see it
+        bracket.layout = layout
+        bracket.save(update_fields=['layout', 'updated_at'])
+    return bracket_match, match
+
+
+def add_placeholders(bracket, matches):
+    """
+    Add an unplayed BracketMatch to a bracket for each match which will be played, all in one insert.
+
+    :param bracket: The bracket.
+    :param matches: Matches from the bracket's layout. Matches settled by a bye are skipped.
+    :return: The number of placeholders added.
+    """
+    placeholders = BracketMatch.objects.bulk_create([
+        BracketMatch(match=match['match'], round=None) for match in matches if BYE not in match['teams']
+    ], batch_size=1000)
+    bracket.matches.add(*placeholders)
+    return len(placeholders)
+
+
+def schedule_bracket(bracket):
+    """
+    Schedule every match of a bracket that isn't known about yet, adding a placeholder BracketMatch for each, in a
+    single transaction. Swiss brackets only have their current round scheduled, and each following round is scheduled
+    as soon as it is paired.
+
+    :param bracket: The bracket.
+    :return: The number of placeholders added, and the layout.
+    """
+    with transaction.atomic():
+        bracket = Bracket.objects.select_for_update().get(pk=bracket.pk)
+        if is_finalized(bracket):
+            raise BracketError("Matches can't be scheduled once the tournament has been finalized")
+        layout = get_layout(bracket)
+        known = set(bracket.matches.values_list('match', flat=True))
+        added = add_placeholders(bracket, [
+            match for match in layout['matches'] if match['match'] not in known and match['winner'] is None
+        ])
+        layout['scheduled'] = True
+        bracket.layout = layout
+        bracket.save(update_fields=['layout'])
+    return added, layout
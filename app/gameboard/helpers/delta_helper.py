@@ -0,0 +1,252 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from gameboard.helpers.import_helper import BulkImportScores, delete_rounds, delete_player_ranks
+from gameboard.models import Round, PlayerRank, Team, Bracket, BracketMatch, Tournament, Tombstone
+
+# Bumped whenever the layout of a delta changes
+DELTA_VERSION = 2
+
+
+class DeltaError(Exception):
+    """
+    Raised when a delta can't be replayed into a group, because it refers to objects which belong to another group.
+    """
+    pass
+
+
+def delta_watermark():
+    """
+    Get the watermark for a delta being exported now. Timestamps are set when an object is saved, not when its
+    transaction commits, so the watermark is held back by DELTA_WATERMARK_LAG seconds to catch changes which were still
+    being committed. Anything in that window is exported again next time, which is harmless as replaying is idempotent.
+
+    :return: A datetime.
+    """
+    return timezone.now() - timedelta(seconds=getattr(settings, 'DELTA_WATERMARK_LAG', 60))
+
+
+def export_delta(group, since=None):
+    """
+    Export everything in a group which changed since a watermark: rounds (with all of their player ranks), and the
+    tournaments, brackets, and teams the group plays with, plus the ids of any of those which were deleted.
+
+    :param group: The group to export.
+    :param since: The watermark of the previous delta, or None to export everything.
+    :return: A dictionary of the changes, which can be dumped as json and replayed with apply_delta. Its watermark is
+             the since to give the next export.
+    """
+    watermark = delta_watermark()
+
+    def changed(queryset):
+        return queryset.filter(updated_at__gte=since) if since else queryset
+
+    rounds = Round.objects.filter(group=group)
+    if since:
+        # A changed rank means its whole round is sent again
+        rounds = rounds.filter(Q(updated_at__gte=since) | Q(pk__in=Round.players.through.objects.filter(
+            playerrank__updated_at__gte=since
+        ).values('round_id')))
+    rounds = rounds.select_related('game').prefetch_related(
+        Prefetch('players', queryset=PlayerRank.objects.select_related('player'))
+    ).order_by('pk')
+
+    tournaments = Tournament.objects.filter(group=group)
+    brackets = Bracket.objects.filter(pk__in=tournaments.values('bracket_id'))
+    teams = Team.objects.filter(pk__in=Bracket.teams.through.objects.filter(
+        bracket_id__in=brackets.values('pk')
+    ).values('team_id'))
+
+    deleted = defaultdict(list)
+    if since:
+        for model, object_id in Tombstone.objects.filter(group=group, deleted_at__gte=since).values_list(
+                'model', 'object_id').order_by('pk'):
+            deleted[model].append(object_id)
+
+    return {
+        'version': DELTA_VERSION,
+        'group': group.pk,
+        'since': since.isoformat() if since else None,
+        'watermark': watermark.isoformat(),
+        'rounds': [{
+            'pk': game_round.pk,
+            'date': game_round.date.isoformat(),
+            'game': game_round.game.name,
+            'ranks': [{
+                'player': player_rank.player.username,
+                'rank': player_rank.rank,
+                'score': player_rank.score,
+            } for player_rank in game_round.players.all()],
+        } for game_round in rounds],
+        'teams': [{
+            'pk': team.pk,
+            'name': team.name,
+            'color': team.color,
+            'players': [player.username for player in team.players.all()],
+        } for team in changed(teams).prefetch_related('players').order_by('pk')],
+        'brackets': [{
+            'pk': bracket.pk,
+            'type': bracket.type,
+            'seeds': bracket.seeds,
+            'teams': [team.pk for team in bracket.teams.all()],
+            'matches': [{
+                'pk': match.pk,
+                'match': match.match,
+                'round': match.round_id,
+            } for match in bracket.matches.all()],
+        } for bracket in changed(brackets).prefetch_related('teams', 'matches').order_by('pk')],
+        'tournaments': [{
+            'pk': tournament.pk,
+            'name': tournament.name,
+            'bracket': tournament.bracket_id,
+        } for tournament in changed(tournaments).order_by('pk')],
+        'deleted': dict(deleted),
+    }
+
+
+def find_conflicts(group, delta):
+    """
+    Find the objects a delta would write or delete which belong to a group other than the one it is replayed into.
+    Brackets, their teams, and their matches belong to the group of their tournament, and brackets which no tournament
+    uses (such as one whose tournament was just deleted) belong to nobody.
+
+    :param group: The group the delta is being replayed into.
+    :param delta: The delta, as returned by export_delta.
+    :return: A dictionary of model name to the sorted ids which belong to other groups, empty if there are none.
+    """
+    other_rounds = Round.objects.exclude(group=group)
+    other_brackets = Bracket.objects.exclude(tournament=None).exclude(tournament__group=group)
+    other_matches = BracketMatch.objects.filter(Q(matches__in=other_brackets) | Q(round__in=other_rounds))
+    others = {
+        'round': other_rounds,
+        'team': Team.objects.filter(teams__in=other_brackets),
+        'bracket': other_brackets,
+        'match': other_matches,
+        'tournament': Tournament.objects.exclude(group=group),
+    }
+
+    deleted = delta['deleted']
+    ids = {
+        'round': {game_round['pk'] for game_round in delta['rounds']} | set(deleted.get('round', [])),
+        'team': {team['pk'] for team in delta['teams']} | set(deleted.get('team', [])),
+        'bracket': {bracket['pk'] for bracket in delta['brackets']} | set(deleted.get('bracket', [])),
+        'match': set(),
+        'tournament': {tournament['pk'] for tournament in delta['tournaments']} | set(deleted.get('tournament', [])),
+    }
+    for bracket in delta['brackets']:
+        ids['team'].update(bracket['teams'])
+        ids['match'].update(match['pk'] for match in bracket['matches'])
+        ids['round'].update(match['round'] for match in bracket['matches'] if match['round'] is not None)
+    ids['bracket'].update(tournament['bracket'] for tournament in delta['tournaments'])
+
+    conflicts = {}
+    for model, object_ids in ids.items():
+        if object_ids:
+            found = sorted(set(others[model].filter(pk__in=object_ids).values_list('pk', flat=True)))
+            if found:
+                conflicts[model] = found
+    return conflicts
+
+
+def apply_delta(group, delta, claim_players=False):
+    """
+    Replay a delta (from export_delta) into a group, in a single transaction. Objects keep the ids they were exported
+    with, so replaying a delta twice (or replaying deltas which overlap) leaves the group the same as replaying it once.
+
+    Rounds are written in bulk, the same way the score importer writes them. Changed rounds have all their player ranks
+    replaced. Tournaments, brackets, and teams change rarely, so are simply saved one at a time.
+
+    Nothing is written if the delta refers to objects of another group (see find_conflicts), as replaying it would
+    move them into this group.
+
+    :param group: The group to replay the delta into.
+    :param delta: The delta, as returned by export_delta.
+    :param claim_players: Let the delta name players from outside the group (see BulkImportScores).
+    :return: A dictionary of the number of objects written and deleted.
+    """
+    importer = BulkImportScores(group, claim_players=claim_players)
+    using = router.db_for_write(Round)
+    stats = {'rounds': 0, 'player_ranks': 0, 'teams': 0, 'brackets': 0, 'tournaments': 0, 'deleted': 0}
+    with transaction.atomic(using=using):
+        conflicts = find_conflicts(group, delta)
+        if conflicts:
+            raise DeltaError("The delta refers to objects of other groups: {}".format('; '.join(
+                "{} {}".format(model, ', '.join(str(object_id) for object_id in object_ids))
+                for model, object_ids in conflicts.items()
+            )))
+
+        usernames = {rank['player'] for game_round in delta['rounds'] for rank in game_round['ranks']}
+        usernames.update(username for team in delta['teams'] for username in team['players'])
+        importer.add_players(sorted(usernames))
+        importer.add_games({game_round['game'] for game_round in delta['rounds']})
+
+        # Hashes are left to be recomputed from the replayed ranks (see hash_rounds)
+        now = timezone.now()
+        rounds = [
+            Round(pk=game_round['pk'], game_id=importer.games[game_round['game']], date=parse_date(game_round['date']),
+                  group=group, content_hash=None, updated_at=now)
+            for game_round in delta['rounds']
+        ]
+        existing = set(Round.objects.filter(
+            group=group, pk__in=[game_round.pk for game_round in rounds]
+        ).values_list('pk', flat=True))
+        Round.objects.bulk_update([game_round for game_round in rounds if game_round.pk in existing],
+                                  ['game', 'date', 'group', 'content_hash', 'updated_at'], batch_size=1000)
+        Round.objects.bulk_create([game_round for game_round in rounds if game_round.pk not in existing])
+        delete_player_ranks(Round.objects.filter(pk__in=existing))
+        importer.add_player_ranks([
+            (game_round['pk'], [(rank['player'], rank['rank'], rank['score']) for rank in game_round['ranks']])
+            for game_round in delta['rounds']
+        ])
+        stats['rounds'] = len(rounds)
+        stats['player_ranks'] = importer.stats['player_ranks']
+
+        for data in delta['teams']:
+            team, created = Team.objects.update_or_create(pk=data['pk'], defaults={
+                'name': data['name'], 'color': data['color'],
+            })
+            team.players.set([importer.players[username] for username in data['players']])
+            stats['teams'] += 1
+
+        for data in delta['brackets']:
+            bracket, created = Bracket.objects.update_or_create(pk=data['pk'], defaults={
+                # Version 1 deltas had no seeds
+                'type': data['type'], 'seeds': data.get('seeds'),
+            })
+            for match in data['matches']:
+                BracketMatch.objects.update_or_create(pk=match['pk'], defaults={
+                    'match': match['match'], 'round_id': match['round'],
+                })
+            bracket.matches.set([match['pk'] for match in data['matches']])
+            bracket.teams.set(data['teams'])
+            stats['brackets'] += 1
+
+        for data in delta['tournaments']:
+            Tournament.objects.update_or_create(pk=data['pk'], defaults={
+                'name': data['name'], 'bracket_id': data['bracket'], 'group': group,
+            })
+            stats['tournaments'] += 1
+
+        deleted = delta['deleted']
+        if deleted.get('tournament'):
+            stats['deleted'] += Tournament.objects.filter(group=group, pk__in=deleted['tournament']).delete()[0]
+        if deleted.get('bracket'):
+            stats['deleted'] += Bracket.objects.filter(pk__in=deleted['bracket']).delete()[0]
+        if deleted.get('team'):
+            stats['deleted'] += Team.objects.filter(pk__in=deleted['team']).delete()[0]
+        if deleted.get('round'):
+            stats['deleted'] += delete_rounds(Round.objects.filter(group=group, pk__in=deleted['round']))['rounds']
+
+        # Rows were inserted with their ids, which doesn't move the id sequences along on some databases
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Round, Team, Bracket, BracketMatch, Tournament]):
+                cursor.execute(sql)
+    return stats
@@ -1,13 +1,23 @@
 import csv
-import math
+import hashlib
+import io
+import itertools
 import os
+import time
+from collections import namedtuple, Counter
 
-from django.db.models import QuerySet
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, transaction, router
+from django.db.models import Prefetch, Count, prefetch_related_objects
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
 
 from gameboardapp.settings import STATIC_ROOT, PROJECT_ROOT, BASE_DIR, APP_ROOT, MEDIA_ROOT
 from datetime import datetime
-from django.db import IntegrityError
-from gameboard.models import Game, Round, Player, Group, PlayerRank
+from gameboard.helpers.membership_helper import forget_memberships
+from gameboard.models import Game, Round, Player, Group, PlayerRank, Bracket, BracketMatch, \
+    Tombstone
 
 
 class ImportScores:
@@ -21,250 +31,619 @@ class ImportScores:
 
     version = int(dataset_name[-1])
 
+    def __init__(self):
+        """
+        Adds the dataset's players, games, and any rounds the group doesn't already have, so running this again after
+        the dataset has grown only adds the new rounds. Assumes the dataset contains all games played by a single group.
+        """
+        if self.dataset_name[0:7] == 'dataset':
+            group = Group.objects.filter(name="Dogpatch Games").first()
+            if group is None:
+                group = Group(name="Dogpatch Games")
+                group.save()
+
+            # Add all players, games, and new games played from the dataset in a single pass
+            BulkImportScores(group, version=self.version, skip_existing=True, claim_players=True).import_file(
+                self.dataset
+            )
+            Player.objects.filter(username="keegan").update(is_staff=True, is_superuser=True)
+        else:
+            # Only converts the file, so nothing in the database needs clearing out first
+            self.import_special()
+
+    def import_special(self):
+        """
+        Converts the dataset from its wide format (a line per player) into the score csv format (a line per round), and
+        writes it to backup.csv.
+
+        :return: The stats of the conversion.
+        """
+        # Imported here, as the pivot reads the score csv format from this module
+        from gameboard.helpers.pivot_helper import PivotScores
+        return PivotScores().pivot_file(self.dataset, os.path.join(STATIC_ROOT, 'backup.csv'))
+
+
+def wipe_group(group):
+    """
+    Deletes all of a group's rounds, their player ranks, and any bracket matches played with them, in a single
+    transaction. Every other group is left untouched.
+
+    :param group: The group to wipe.
+    :return: A dictionary of the number of rows deleted from each table.
+    """
+    return delete_rounds(Round.objects.filter(group=group))
+
+
+def delete_rounds(rounds):
+    """
+    Deletes rounds, their player ranks, and any bracket matches played with them, in a single transaction. A tombstone
+    is left for every round, so that delta exports pass the deletion on.
+
+    Each table is cleared with one set based DELETE, rather than loading every object and deleting it (which would
+    collect cascades and send signals one object at a time). The link tables are cleared first, so no foreign key is
+    left pointing at a deleted row.
+
+    :param rounds: A queryset of the rounds to delete.
+    :return: A dictionary of the number of rows deleted from each table.
+    """
+    using = router.db_for_write(Round)
+    deleted = {}
+    with transaction.atomic(using=using):
+        tombstones = (
+            Tombstone(model=Round._meta.model_name, object_id=pk, group_id=group_id)
+            for pk, group_id in rounds.values_list('pk', 'group_id').iterator()
+        )
+        # Written in batches, so wiping a large group never holds every tombstone in memory
+        while Tombstone.objects.bulk_create(list(itertools.islice(tombstones, 2000))):
+            pass
+        # Brackets losing matches have changed, even though the brackets themselves are not deleted. delete_rows skips
+        # the signal which would reset their layouts
+        Bracket.objects.filter(matches__round__in=rounds).update(updated_at=timezone.now(), layout=None)
+
+        deleted['bracket_match_links'] = Bracket.matches.through.objects.filter(
+            bracketmatch__round__in=rounds
+        ).delete()[0]
+        deleted['bracket_matches'] = delete_rows(BracketMatch.objects.filter(round__in=rounds), using)
+        deleted.update(delete_player_ranks(rounds))
+        deleted['rounds'] = delete_rows(rounds, using)
+    return deleted
+
+
+def delete_player_ranks(rounds):
+    """
+    Deletes all the player ranks of some rounds (but not the rounds themselves), with set based DELETEs.
+
+    :param rounds: A queryset of the rounds to remove the player ranks from.
+    :return: A dictionary of the number of rows deleted from each table.
+    """
+    using = router.db_for_write(PlayerRank)
+    rank_links = Round.players.through.objects.filter(round__in=rounds)
+    deleted = {}
+    with transaction.atomic(using=using):
+        # Ranks are only found through their links to the rounds, so must go before the links do
+        deleted['player_ranks'] = delete_rows(
+            PlayerRank.objects.filter(pk__in=rank_links.values('playerrank_id')), using,
+        )
+        deleted['player_rank_links'] = rank_links.delete()[0]
+    return deleted
+
+
+def delete_rows(queryset, using):
+    """
+    Delete the rows of a queryset with a single DELETE statement, without loading them. QuerySet.delete() would load
+    every object, to cascade to (and send delete signals for) each of them, which is far too slow for a whole group's
+    rounds. Nothing cascades here and no signals are sent, so the caller must delete whatever refers to the rows first,
+    and do anything the signals would have done.
+
+    :param queryset: The rows to delete.
+    :param using: The alias of the database.
+    :return: The number of rows deleted.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    meta = queryset.model._meta
+    try:
+        sql, params = queryset.order_by().values('pk').query.get_compiler(using).as_sql()
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {} WHERE {} IN ({})".format(
+            quote(meta.db_table), quote(meta.pk.column), sql,
+        ), params)
+        return cursor.rowcount
+
+
+def round_hash(date, game, ranks):
+    """
+    Get a stable hash of what happened in a round, which is the same no matter what order the players are listed in.
+
+    :param date: The date the round was played.
+    :param game: The name of the game.
+    :param ranks: The (username, rank) tuples of everyone who played.
+    :return: The hash, as a hex string.
+    """
+    placements = sorted('{}={}'.format(username, '' if rank is None else rank) for username, rank in ranks)
+    return hashlib.sha256('\x1f'.join([date.isoformat(), game] + placements).encode()).hexdigest()
+
+
+def hash_rounds(rounds, chunk_size=2000):
+    """
+    Store the content hash of any rounds which don't have one yet, such as rounds entered through the site, or imported
+    before rounds were hashed.
+
+    :param rounds: A queryset of the rounds to hash.
+    :param chunk_size: How many rounds to hash at once.
+    :return: The number of rounds hashed.
+    """
+    rounds = rounds.filter(content_hash__isnull=True).select_related('game').only('date', 'game__name').order_by('pk')
+    ranks = Prefetch('players', queryset=PlayerRank.objects.select_related('player').only('rank', 'player__username'))
+    hashed = 0
+    last_pk = 0
+    while True:
+        # Walk through by id, rather than a cursor, as the rows being read are also being written to
+        chunk = list(rounds.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return hashed
+        prefetch_related_objects(chunk, ranks)
+        for game_round in chunk:
+            game_round.content_hash = round_hash(game_round.date, game_round.game.name, [
+                (player_rank.player.username, player_rank.rank) for player_rank in game_round.players.all()
+            ])
+        Round.objects.bulk_update(chunk, ['content_hash'])
+        hashed += len(chunk)
+        last_pk = chunk[-1].pk
+
+
+# A single round read from a score csv, where ranks is a list of (player name, rank, score) tuples
+ParsedRound = namedtuple('ParsedRound', ['line', 'date', 'game', 'ranks'])
+
+
+class ScoreReader:
+    """
+    Reads a custom formatted score csv one line at a time. The header holds the players, and every other line is a
+    round that was played. For version 1 files every player has a single column with their rank, later versions follow
+    each player's rank column with a column for their score.
+
+    An empty rank means that the player didn't play, and a rank of 0 means they played but were not placed.
+    """
     # Specific locations of columns within the csv
     date_loc = 0
     game_loc = 1
     coop = 2
     first_player_loc = 3
 
-    # Storing the player information
-    players = {}
+    date_format = "%m/%d/%y"
 
-    def __init__(self):
+    def __init__(self, f, version=2):
+        """
+        :param f: An open file (or any iterable of csv lines).
+        :param version: The version of the csv format.
         """
-        Wipes all past data (be careful to only use this in a testing environment!) and then adds data. Adding starts
-        with players, then games, then individual games by the date they were played. Assumes the dataset contains all
-        games played by a single group, which hasn't been created yet.
+        self.reader = csv.reader(f)
+        self.step = 2 if version > 1 else 1
+        header = next(self.reader, [])
+        self.players = header[self.first_player_loc::self.step]
+        # Lines that could not be read, as (line number, message) tuples
+        self.errors = []
+        self.rows = 0
+
+    def __iter__(self):
+        for line in self.reader:
+            self.rows += 1
+            # Get the game (if it is not there, ignore this line)
+            if len(line) <= self.game_loc or len(line[self.game_loc]) == 0:
+                continue
+
+            try:
+                date = datetime.strptime(line[self.date_loc], self.date_format).date()
+            except ValueError:
+                self.errors.append((self.reader.line_num, "Invalid date '{}'".format(line[self.date_loc])))
+                continue
+
+            yield ParsedRound(self.reader.line_num, date, line[self.game_loc], self.parse_ranks(line))
+
+    def parse_ranks(self, line):
         """
-        # Wipe the db
-        self.wipe_db()
+        Get the placements (and scores) of the players that played in a round.
 
-        if self.dataset_name[0:7] == 'dataset':
-            # Add all players from dataset
-            group = self.add_players()
+        :param line: A line of the csv.
+        :return: A list of (player name, rank, score) tuples.
+        """
+        ranks = []
+        for column, player_name in zip(range(self.first_player_loc, len(line), self.step), self.players):
+            player_stat = line[column]
+            # Check whether this player played. "" = didn't, anything else = did
+            if player_stat == "":
+                continue
+
+            try:
+                player_placement = None if player_stat == "0" else int(player_stat)
+            except ValueError:
+                player_placement = None
+
+            player_score = None
+            if self.step == 2 and column + 1 < len(line):
+                try:
+                    player_score = int(line[column + 1])
+                except ValueError:
+                    player_score = None
+            ranks.append((player_name, player_placement, player_score))
+        return ranks
+
+
+class ScoreImportError(Exception):
+    """
+    Raised when a score csv can't be imported into a group, because it names players who belong to other accounts.
+    """
+    pass
 
-            # Add all games from the dataset
-            self.add_games()
 
-            # Create the games played for this group
-            self.add_game_played(group)
-        else:
-            self.import_special()
+class BulkImportScores:
+    """
+    Imports a score csv into a group in a single pass over the file. Players and games are looked up once and kept in
+    memory, and rounds are written in chunks, where each chunk is a single transaction of bulk inserts for its rounds,
+    player ranks, and the rows linking the two together.
 
-    def wipe_db(self):
-        """
-        WARNING: This function wipes all data in the database. Be careful with its use!
+    Every imported round stores a hash of its content (see round_hash). With skip_existing, rounds whose hash the group
+    already has are skipped, with one indexed lookup per chunk, so re-importing a file that has only grown since it was
+    last imported just adds the new rounds.
 
-        :return: None
-        """
-        self.delete_helper(Player.objects.all())
-        self.delete_helper(Game.objects.all())
-        self.delete_helper(Round.objects.all())
-        self.delete_helper(PlayerRank.objects.all())
-        self.delete_helper(Group.objects.all())
+    On PostgreSQL rows are streamed in with COPY (see copy_rows) rather than bulk_create, which is several times
+    faster for large imports. Every other database, or turning IMPORT_USE_COPY off, falls back to bulk_create.
 
-    @staticmethod
-    def delete_helper(objects: QuerySet):
-        for obj in objects:
-            obj.delete()
+    Names in the csv are matched against the group's own players, so an import can never put ranks on the history of
+    someone outside the group (see add_players).
+    """
+    def __init__(self, group, version=2, chunk_size=2000, skip_existing=False, use_copy=None, progress=None,
+                 claim_players=False):
+        """
+        :param group: The group the scores are imported into.
+        :param version: The version of the csv format (see ScoreReader).
+        :param chunk_size: How many rounds are written per transaction.
+        :param skip_existing: Skip rounds which the group already has.
+        :param use_copy: Load rows with COPY, when the database supports it (see copy_enabled).
+        :param progress: A function called with the import stats after every chunk.
+        :param claim_players: Let the csv name existing players from outside the group, who are then added to it. Only
+                              for imports run by the server's operators (such as the management commands), never for
+                              files uploaded by users.
+        """
+        self.group = group
+        self.claim_players = claim_players
+        self.version = version
+        self.chunk_size = chunk_size
+        self.skip_existing = skip_existing
+        self.using = router.db_for_write(Round)
+        self.use_copy = copy_enabled(self.using) if use_copy is None else use_copy and supports_copy(self.using)
+        self.progress = progress
+
+        # Name (as in the csv) to id and username lookups
+        self.players = {}
+        self.usernames = {}
+        self.games = {}
+        # Content hash to the number of rounds the group had with that hash before the import, and the number of times
+        # the hash has been read from the csv so far
+        self.existing = {}
+        self.seen = Counter()
+
+        self.stats = {
+            'rows': 0,
+            'rounds': 0,
+            'player_ranks': 0,
+            'skipped': 0,
+            'errors': [],
+            'seconds': 0.0,
+            'rows_per_second': 0.0,
+        }
+        self.start = None
+
+    def import_file(self, path):
+        """
+        Import a score csv from disk.
 
+        :param path: The location of the csv.
+        :return: The import stats.
+        """
+        with open(path, newline='') as f:
+            return self.import_reader(ScoreReader(f, self.version))
 
-    def import_special(self):
-        all_data = []
-        with open(self.dataset, newline='') as f:
-            # Get the first line
-            reader = csv.reader(f)
-            for line in reader:
-                all_data.append(line)
-
-        export_location = os.path.join(STATIC_ROOT, 'backup.csv')
-        players = []
-        with open(export_location, mode='w') as f:
-            f_write = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            headers = ['Date', 'Game', 'Coop']
-            for line in all_data:
-                # Remove blank players
-                if line[0] != '':
-                    headers.append(line[0])
-                    headers.append(line[0] + '_scores')
-            players = headers[3:]
-            f_write.writerow(headers)
-
-        # calculate games and scores
-        games = {}
-        for line in all_data:
-            player = line.pop(0)
-            # remove real name
-            line.pop(0)
-
-            # Now in sets of 4, we want to continue to pop for game, place, score, date
-            while len(line) > 0:
-                date = line.pop()
-                score = line.pop()
-                rank = line.pop()
-                game = line.pop()
-                if game != '' and rank != 'No Show':
-                    game_id = game + '|:|' + date
-                    # Now add it to our games dictionary
-                    try:
-                        games[game_id].append([player, rank, score])
-                    except KeyError:
-                        games[game_id] = [[player, rank, score]]
-
-        with open(export_location, mode='a+') as f:
-            f_write = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            for game_id, ranks in games.items():
-                game, date = game_id.split('|:|')
-                line = [''] * (len(players) + 1)  # +1 for the coop slot
-                line.insert(0, game)
-                line.insert(0, date)
-                for [player, rank, score] in ranks:
-                    line_index = players.index(player) + 3
-                    line[line_index] = int(math.floor(float(rank)))
-                    line[line_index + 1] = score
-                f_write.writerow(line)
-
-    def add_players(self):
+    def import_reader(self, reader):
         """
-        Adds all the players within the csv to the Player database table.
+        Import everything a ScoreReader reads.
 
-        Gets the first line of the csv. Loops over all the players in that line (marked by location marks). Adds those
-        players as users, with a temporary password (password) and usernames/first names corresponding
-        to the player name.
+        :param reader: The ScoreReader to import from.
+        :return: The import stats, containing the rows read, rounds and player ranks created, errors found, and speed.
+        """
+        self.start = time.perf_counter()
+        self.add_players(reader.players)
+        if self.skip_existing:
+            hash_rounds(Round.objects.filter(group=self.group))
+
+        chunk = []
+        for parsed_round in reader:
+            chunk.append(parsed_round)
+            if len(chunk) >= self.chunk_size:
+                self.add_rounds(chunk)
+                chunk = []
+                self.update_stats(reader)
+        if chunk:
+            self.add_rounds(chunk)
+        self.update_stats(reader)
+        return self.stats
+
+    def update_stats(self, reader):
+        self.stats['rows'] = reader.rows
+        self.stats['errors'] = reader.errors
+        self.stats['seconds'] = time.perf_counter() - self.start
+        self.stats['rows_per_second'] = self.stats['rows'] / self.stats['seconds'] if self.stats['seconds'] else 0.0
+        if self.progress:
+            self.progress(self.stats)
+
+    def add_players(self, names):
+        """
+        Find the group's players with the given names, and create accounts for the names nobody has yet. New accounts
+        have no usable password, so they can only be logged into once a password is set for them. Every player is
+        added to the group as a player (never as an admin).
 
+        :param names: The player names from the csv header.
         :return: None
         """
-        with open(self.dataset, newline='') as f:
-            # Get the first line
-            reader = csv.reader(f)
-            people = next(reader)
-            new_players = people[self.first_player_loc:]
-            if self.version > 1:
-                # Remove odd indexes (scores)
-                new_players = [v for i, v in enumerate(new_players) if i % 2 == 0]
-            group = Group(name="Dogpatch Games")
-            group.save()
-
-            # Loop over those players
-            for player in new_players:
-                print(f"Adding player: {player}")
-                # Set the user object
-                username = player.replace(" ", "")
-                p = Player.objects.create_user(first_name=player, last_name="", username=username, date_of_birth=datetime.now(), primary_group=group, password="password")
-                if player == "keegan":
-                    p.is_staff = True
-                    p.is_superuser = True
-                    p.is_admin = True
-                p.save()
-
-                self.players[player] = p
-
-                group.players.add(p)
-                group.admins.add(p)
-            return group
-
-    def add_games(self):
+        usernames = {name: name.replace(" ", "") for name in names}
+        players = self.group.players if not self.claim_players else Player.objects
+        existing = dict(players.filter(username__in=usernames.values()).values_list('username', 'pk'))
+        taken = sorted(Player.objects.filter(username__in=set(usernames.values()) - set(existing)).values_list(
+            'username', flat=True
+        ))
+        if taken:
+            raise ScoreImportError("{} already belong to players outside of {}, add them to the group first".format(
+                ', '.join(taken), self.group.name,
+            ))
+
+        new_players = {}
+        for name, username in usernames.items():
+            if username not in existing and username not in new_players:
+                player = Player(first_name=name, last_name="", username=username, date_of_birth=datetime.now(),
+                                primary_group=self.group)
+                player.set_unusable_password()
+                new_players[username] = player
+        new_players = Player.objects.bulk_create(new_players.values())
+        # bulk_create skips the post_save signal which would normally make these
+        Token.objects.bulk_create([Token(user=player, key=Token.generate_key()) for player in new_players])
+        existing.update({player.username: player.pk for player in new_players})
+
+        self.players = {name: existing[username] for name, username in usernames.items()}
+        self.usernames.update(usernames)
+        Group.players.through.objects.bulk_create([
+            Group.players.through(group_id=self.group.pk, player_id=player_id)
+            for player_id in set(self.players.values())
+        ], ignore_conflicts=True)
+        # bulk_create skips the m2m_changed signal which would normally clear these
+        forget_memberships(set(self.players.values()))
+
+    def add_games(self, names):
         """
-        Adds all the games within the csv for later relation with the Round object.
-
-        Loops through all lines in the sheet, looking at a specific column and pulling all the unique names it finds
-        in that column.
+        Make sure that every game name has an id, creating the games which don't exist yet.
 
+        :param names: A set of game names.
         :return: None
         """
-        with open(self.dataset, newline='') as f:
-            # Open the csv
-            reader = csv.reader(f)
-            for line in reader:
-                # Get the game data
-                game = line[self.game_loc]
-                if len(game) > 0:
-                    try:
-                        # Add it if it is unique
-                        g = Game(name=game)
-                        g.save()
-                    except IntegrityError:
-                        pass
-
-    def add_game_played(self, group):
+        missing = names.difference(self.games)
+        if not missing:
+            return
+        self.games.update(Game.objects.filter(name__in=missing).values_list('name', 'pk'))
+        missing = missing.difference(self.games)
+        if missing:
+            Game.objects.bulk_create([Game(name=name) for name in missing], ignore_conflicts=True)
+            self.games.update(Game.objects.filter(name__in=missing).values_list('name', 'pk'))
+
+    def add_rounds(self, chunk):
         """
-        Adds all games that were played which were recorded, as long as they are properly formatted.
+        Write a chunk of rounds, and their player ranks, in a single transaction.
 
+        :param chunk: A list of ParsedRounds.
         :return: None
         """
-        with open(self.dataset, newline='') as f:
-            # Open the csv, and read through every line (but the header)
-            reader = csv.reader(f)
-            people = next(reader)
-            new_players = people[self.first_player_loc:]
-
-            for line in reader:
-                # Get the game (if it is not there, ignore this line)
-                game = line[self.game_loc]
-                if len(game) > 0:
-                    # Set local variables
-                    player_ranks = list()
-
-                    # Get the date the game was played on
-                    date = datetime.strptime(line[self.date_loc], "%m/%d/%y")
-
-                    # Get the players placements (and their scores) that played in that round
-                    player_stats = line[self.first_player_loc:]
-
-                    # Loop through all the players who played
-                    for player_index in range(len(player_stats)):
-                        # We only want to process the names of the players
-                        if player_index % 2 == 0:
-                            # Get their names, and the wins they had
-                            player_stat = player_stats[player_index]
-
-                            # Check whether this player played. "" = didn't, anything else = did
-                            if player_stat != "":
-                                player_name = new_players[player_index]
-                                player = self.players[player_name]
-
-                                # Create a rank object, and get it setup to add
-                                try:
-                                    player_placement = None if player_stat == "0" else int(player_stat)
-                                except ValueError:
-                                    player_placement = None
-
-                                # TODO add in self.version check for scores
-                                try:
-                                    player_score = int(player_stats[player_index + 1])
-                                except ValueError:
-                                    player_score = None
-                                rank = PlayerRank(player=player, rank=player_placement, score=player_score)
-                                player_ranks.append(rank)
-
-                    self.enter_game_played(player_ranks, game, date, group)
-
-    @staticmethod
-    def enter_game_played(player_ranks, game, date, group):
+        hashes = [
+            round_hash(parsed_round.date, parsed_round.game, [
+                (self.usernames[player_name], rank) for player_name, rank, score in parsed_round.ranks
+            ]) for parsed_round in chunk
+        ]
+        if self.skip_existing:
+            chunk, hashes = self.remove_existing(chunk, hashes)
+            if not chunk:
+                return
+
+        with transaction.atomic(using=self.using):
+            self.add_games({parsed_round.game for parsed_round in chunk})
+            if self.use_copy:
+                round_ids = reserve_ids(Round, len(chunk), self.using)
+                now = timezone.now()
+                copy_rows(Round, ['id', 'game', 'date', 'group', 'content_hash', 'created_at', 'updated_at'], [
+                    (round_id, self.games[parsed_round.game], parsed_round.date, self.group.pk, content_hash, now, now)
+                    for round_id, parsed_round, content_hash in zip(round_ids, chunk, hashes)
+                ], self.using)
+            else:
+                round_ids = [game_round.pk for game_round in Round.objects.bulk_create([
+                    Round(game_id=self.games[parsed_round.game], date=parsed_round.date, group=self.group,
+                          content_hash=content_hash)
+                    for parsed_round, content_hash in zip(chunk, hashes)
+                ])]
+            self.add_player_ranks([
+                (round_id, parsed_round.ranks) for round_id, parsed_round in zip(round_ids, chunk)
+            ])
+
+        self.stats['rounds'] += len(round_ids)
+
+    def remove_existing(self, chunk, hashes):
+        """
+        Remove the rounds the group already has from a chunk. A round in the csv more than once is only skipped as many
+        times as the group already has it, so identical rounds which really were played twice aren't lost.
+
+        :param chunk: A list of ParsedRounds.
+        :param hashes: The content hash of each round in the chunk.
+        :return: The ParsedRounds, and their hashes, which are new to the group.
+        """
+        unknown = set(hashes).difference(self.existing)
+        if unknown:
+            self.existing.update(dict.fromkeys(unknown, 0))
+            self.existing.update(
+                Round.objects.filter(group=self.group, content_hash__in=unknown).values('content_hash').annotate(
+                    count=Count('pk')
+                ).values_list('content_hash', 'count')
+            )
+
+        new_rounds = []
+        for parsed_round, content_hash in zip(chunk, hashes):
+            self.seen[content_hash] += 1
+            if self.seen[content_hash] > self.existing[content_hash]:
+                new_rounds.append((parsed_round, content_hash))
+        self.stats['skipped'] += len(chunk) - len(new_rounds)
+        return [parsed_round for parsed_round, content_hash in new_rounds], \
+            [content_hash for parsed_round, content_hash in new_rounds]
+
+    def add_player_ranks(self, round_ranks):
         """
-        Actually adds the game played to the database, linking to Player objects and Game objects.
+        Write the player ranks of rounds which have already been saved, along with the rows linking them together.
 
-        :param players: The names of the players
-        :param game: The game that was played (string)
-        :param date: A date object to use for when the game was played
-        :param group: Which group this game was played with
+        :param round_ranks: A list of (round id, ranks) tuples, where ranks is a list of (player name, rank, score)
+                            tuples.
         :return: None
         """
-        try:
-            game_played = Round()
-            game_played.game = Game.objects.get(name__exact=game)
-            game_played.date = date
-            game_played.group = group
-            game_played.save()
-
-            for player_rank in player_ranks:
-                player_rank.save()
-                game_played.players.add(player_rank)
-        except Exception as e:
-            # TODO remove any created objects
-            print("Error entering game", game)
-            print(e)
-            pass
+        player_ranks = []
+        for round_id, ranks in round_ranks:
+            for player_name, rank, score in ranks:
+                player_ranks.append((round_id, PlayerRank(player_id=self.players[player_name], rank=rank, score=score)))
+
+        if self.use_copy:
+            now = timezone.now()
+            rank_ids = reserve_ids(PlayerRank, len(player_ranks), self.using)
+            for rank_id, (round_id, player_rank) in zip(rank_ids, player_ranks):
+                player_rank.pk = rank_id
+            copy_rows(PlayerRank, ['id', 'player', 'rank', 'score', 'created_at', 'updated_at'], [
+                (player_rank.pk, player_rank.player_id, player_rank.rank, player_rank.score, now, now)
+                for round_id, player_rank in player_ranks
+            ], self.using)
+            copy_rows(Round.players.through, ['round', 'playerrank'], [
+                (round_id, player_rank.pk) for round_id, player_rank in player_ranks
+            ], self.using)
+        else:
+            PlayerRank.objects.bulk_create([player_rank for round_id, player_rank in player_ranks])
+            Round.players.through.objects.bulk_create([
+                Round.players.through(round_id=round_id, playerrank_id=player_rank.pk)
+                for round_id, player_rank in player_ranks
+            ])
+        self.stats['player_ranks'] += len(player_ranks)
+
+
+def supports_copy(using):
+    """
+    Check whether a database can load rows with COPY FROM STDIN, which only PostgreSQL (through psycopg2) can.
+
+    :param using: The alias of the database.
+    :return: True if copy_rows can be used.
+    """
+    return connections[using].vendor == 'postgresql'
+
+
+def copy_enabled(using):
+    """
+    Check whether rows should be loaded into a database with COPY, which is whenever it can be, unless IMPORT_USE_COPY
+    has been turned off.
+
+    :param using: The alias of the database.
+    :return: True if copy_rows should be used.
+    """
+    return getattr(settings, 'IMPORT_USE_COPY', True) and supports_copy(using)
+
+
+def reserve_ids(model, count, using):
+    """
+    Take ids from a model's id sequence, so rows can be loaded with their ids already known (which COPY needs, as it
+    can't return the ids it generated). PostgreSQL only.
+
+    :param model: The model to take ids for.
+    :param count: How many ids to take.
+    :param using: The alias of the database.
+    :return: A list of the ids.
+    """
+    if not count:
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+            [model._meta.db_table, model._meta.pk.column, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def copy_value(value):
+    """
+    Write a value in the text format COPY reads, where columns are split by tabs and \\N is NULL. Binary values are
+    written in bytea's hex format.
+
+    :param value: A value ready to be sent to the database.
+    :return: The value as COPY text.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(getattr(value, 'adapted', None), (bytes, bytearray, memoryview)):
+        # Binary fields prepare their values wrapped up for psycopg2, whose str() is an SQL literal rather than the data
+        value = value.adapted
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # COPY reads the backslash as an escape, so it is doubled to reach bytea as \x
+        return '\\\\x' + bytes(value).hex()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(model, fields, rows, using):
+    """
+    Load rows into a model's table with COPY FROM STDIN. PostgreSQL only, and must be run inside a transaction.
+
+    The rows are copied into a temporary staging table, which has no constraints or indexes to slow COPY down, and then
+    merged into the real table with a single INSERT ... SELECT, which is where constraints are checked. The staging
+    table is kept (empty) until the transaction ends, so the chunks of an import all reuse it. It has every column of
+    the real table, as it is reused by any copy into that table, whichever fields are copied.
+
+    :param model: The model to load rows into.
+    :param fields: The names of the fields in each row.
+    :param rows: A list of rows, each a tuple of values in the same order as fields.
+    :param using: The alias of the database.
+    :return: The number of rows loaded.
+    """
+    if not rows:
+        return 0
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    copy_text(model, fields, buffer, using)
+    return len(rows)
+
+
+def copy_text(model, fields, f, using):
+    """
+    Load rows already written in COPY's text format (see copy_value) into a model's table, as copy_rows does.
+
+    :param model: The model to load rows into.
+    :param fields: The names of the fields in each row.
+    :param f: A file of the rows, a line each.
+    :param using: The alias of the database.
+    :return: None
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    staging = quote('staging_' + model._meta.db_table)
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS {} ON COMMIT DROP AS SELECT * FROM {} WITH NO DATA".format(
+                staging, table,
+            )
+        )
+        cursor.copy_expert("COPY {} ({}) FROM STDIN".format(staging, columns), f)
+        cursor.execute("INSERT INTO {} ({}) SELECT {} FROM {}".format(table, columns, columns, staging))
+        cursor.execute("TRUNCATE {}".format(staging))
 
 
 class ExportScores:
@@ -272,44 +651,76 @@ class ExportScores:
     This class is used to export the database into a re-importable format
     """
     export_location = os.path.join(STATIC_ROOT, 'backup.csv')
-    players = []
 
-    def __init__(self):
-        group = Group.objects.all().first()
-        # Put the header at the top of the file
-        self.add_header(group)
-
-        # Add all thr game data
-        self.add_all_rounds(group)
-
-        pass
+    def __init__(self, group=None):
+        """
+        Exports every round of a group to the backup file.
 
-    def add_header(self, group):
-        with open(self.export_location, mode='w') as f:
-            f_write = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            line = ['Date', 'Game', 'Coop']
-            for player in group.players.all():
-                print(player)
-                line.append(player.user.username)
-                self.players.append(player.user.username)
-            f_write.writerow(line)
-
-    def add_all_rounds(self, group):
-        with open(self.export_location, mode='a+') as f:
+        :param group: The group to export, defaults to the first group.
+        """
+        group = group if group else Group.objects.all().first()
+        with open(self.export_location, mode='w', newline='') as f:
             f_write = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            f_write.writerows(export_rows(group))
 
-            for round in Round.objects.filter(group_id=group.id).order_by('-date'):
-                # Add first part of line
-                line = [round.date.strftime("%m/%d/%y"), round.game.name, '']
 
-                # Add player information
-                for player in self.players:
-                    line.append("")
+def export_rows(group, chunk_size=2000):
+    """
+    Generates every line of a group's score csv (in the format ScoreReader reads), header first, newest rounds first.
 
-                for player in round.players.all():
-                    line[self.players.index(player.user.username) + 3] = 0
+    Rounds are read through a server side cursor, and their player ranks are fetched a chunk at a time, so exporting any
+    number of rounds uses a constant amount of memory and only a couple of queries per chunk. Player columns are worked
+    out once up front, so placing a rank in its line is a dictionary lookup.
 
-                for player in round.winners.all():
-                    line[self.players.index(player.user.username) + 3] = 1
+    :param group: The group to export.
+    :param chunk_size: How many rounds to fetch the ranks of at once.
+    :return: A generator of lines, each a list of values.
+    """
+    # Group members, plus anyone who played in a group round without being a member
+    players = group.players.values_list('pk', 'username').union(
+        Player.objects.filter(
+            pk__in=PlayerRank.objects.filter(game_players__group=group).values('player_id')
+        ).values_list('pk', 'username')
+    ).order_by('pk')
+
+    header = ['Date', 'Game', 'Coop']
+    player_columns = {}
+    for player_id, username in players:
+        player_columns[player_id] = len(header)
+        header += [username, username + ' score']
+    yield header
+
+    rounds = Round.objects.filter(group=group).select_related('game').only('date', 'game__name').order_by(
+        '-date', '-pk'
+    )
+    ranks = Prefetch('players', queryset=PlayerRank.objects.only('player_id', 'rank', 'score'))
+    chunk = []
+    for game_round in rounds.iterator(chunk_size=chunk_size):
+        chunk.append(game_round)
+        if len(chunk) >= chunk_size:
+            yield from export_chunk(chunk, ranks, player_columns, len(header))
+            chunk = []
+    yield from export_chunk(chunk, ranks, player_columns, len(header))
+
+
+def export_chunk(chunk, ranks, player_columns, width):
+    """
+    Turn a chunk of rounds into lines of the score csv.
 
-                f_write.writerow(line)
+    :param chunk: A list of Rounds.
+    :param ranks: The Prefetch used to get the rounds' player ranks.
+    :param player_columns: A dictionary of player id to the column of their rank.
+    :param width: The number of columns in a line.
+    :return: A generator of lines.
+    """
+    prefetch_related_objects(chunk, ranks)
+    for game_round in chunk:
+        line = [''] * width
+        line[ScoreReader.date_loc] = game_round.date.strftime(ScoreReader.date_format)
+        line[ScoreReader.game_loc] = game_round.game.name
+        for player_rank in game_round.players.all():
+            column = player_columns[player_rank.player_id]
+            # A rank of 0 is read back in as played, but not placed
+            line[column] = player_rank.rank if player_rank.rank is not None else 0
+            line[column + 1] = player_rank.score if player_rank.score is not None else ''
+        yield line
@@ -0,0 +1,111 @@
+"""
+Import jobs
+
+Uploaded score csvs are imported by a pool of IMPORT_WORKERS threads inside the web process which received the upload,
+so a job only runs while that process lives. A job whose process exits (a restart, deploy, or crash) is never picked
+up again, and would otherwise stay queued or running forever. Any job still running IMPORT_JOB_TIMEOUT seconds after
+it started, or still queued IMPORT_QUEUE_TIMEOUT seconds after it was uploaded, is taken to have been lost, and is
+marked as failed the next time it is checked on (see fail_stale_jobs), so the uploader knows to upload it again. The
+timeouts must be longer than the biggest import takes, and than the queue takes to drain. A job only moves on from the
+status it was last seen in, so a job marked as failed is never run or finished afterwards.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from gameboard.helpers.import_helper import BulkImportScores, ScoreReader
+from gameboard.models import ImportJob
+
+STALE_JOB_ERROR = "The import was interrupted, or took too long, please upload the file again"
+
+# The background workers, created the first time a job is queued
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'IMPORT_WORKERS', 2), thread_name_prefix='gameboard-import',
+        )
+    return executor
+
+
+def fail_stale_jobs(jobs=None):
+    """
+    Mark jobs which have been running for longer than IMPORT_JOB_TIMEOUT, or queued for longer than
+    IMPORT_QUEUE_TIMEOUT, as failed, as the process running them has most likely exited.
+
+    :param jobs: A queryset of the ImportJobs to check, defaults to every job.
+    :return: The number of jobs marked as failed.
+    """
+    jobs = jobs if jobs is not None else ImportJob.objects.all()
+    now = timezone.now()
+    return jobs.filter(
+        Q(status=ImportJob.QUEUED,
+          created_at__lt=now - timedelta(seconds=getattr(settings, 'IMPORT_QUEUE_TIMEOUT', 86400))) |
+        Q(status=ImportJob.RUNNING,
+          started_at__lt=now - timedelta(seconds=getattr(settings, 'IMPORT_JOB_TIMEOUT', 3600)))
+    ).update(status=ImportJob.FAILED, finished_at=now, errors=[[None, STALE_JOB_ERROR]])
+
+
+def queue_import(job):
+    """
+    Queue an import job to be run by a background worker, once the transaction that created it has been committed.
+    When IMPORT_WORKERS is 0 the job is run straight away instead (which the tests rely on).
+
+    :param job: The ImportJob to run.
+    :return: None
+    """
+    if getattr(settings, 'IMPORT_WORKERS', 2) == 0:
+        run_import(job.pk)
+    else:
+        transaction.on_commit(lambda: get_executor().submit(run_import, job.pk))
+
+
+def run_import(job_id):
+    """
+    Run an import job, writing its progress to the database after every chunk. A job which is no longer queued (it
+    was marked as failed while waiting for a worker) is skipped.
+
+    :param job_id: The id of the ImportJob to run.
+    :return: None
+    """
+    job = ImportJob.objects.select_related('group').get(pk=job_id)
+    # Every update is conditional on the status, so that a job marked as failed meanwhile stays failed
+    running = ImportJob.objects.filter(pk=job.pk, status=ImportJob.RUNNING)
+    try:
+        if not ImportJob.objects.filter(pk=job.pk, status=ImportJob.QUEUED).update(
+            status=ImportJob.RUNNING, started_at=timezone.now(),
+        ):
+            return
+        with job.scores.open('r') as f:
+            # Counting lines is far quicker than importing them, and lets the job give an ETA
+            running.update(total_rows=max(0, sum(1 for _ in f) - 1))
+
+        def progress(stats):
+            running.update(
+                rows_processed=stats['rows'], rounds_created=stats['rounds'], rounds_skipped=stats['skipped'],
+            )
+
+        with job.scores.open('r') as f:
+            stats = BulkImportScores(
+                job.group, version=job.version, skip_existing=job.skip_existing, progress=progress,
+            ).import_reader(ScoreReader(f, job.version))
+        running.update(
+            status=ImportJob.FINISHED, finished_at=timezone.now(), rows_processed=stats['rows'],
+            rounds_created=stats['rounds'], rounds_skipped=stats['skipped'],
+            errors=[list(error) for error in stats['errors']],
+        )
+    except Exception as e:
+        running.update(
+            status=ImportJob.FAILED, finished_at=timezone.now(), errors=[[None, repr(e)]],
+        )
+    finally:
+        # Worker threads each hold their own connection, which would otherwise stay open forever
+        if getattr(settings, 'IMPORT_WORKERS', 2) != 0:
+            connection.close()
@@ -0,0 +1,103 @@
+"""
+Memberships
+
+The ids of the groups a user plays in, and the groups they administer, so that permission checks are set lookups
+instead of queries. They are loaded at most once per request (kept on the user object, which lives as long as the
+request), and cached for MEMBERSHIP_CACHE_SECONDS between requests.
+
+The cache is cleared for a user whenever their groups' players or admins change. Signals only fire in the process
+making the change, and the default cache is per process, so other workers can see a stale membership for at most
+MEMBERSHIP_CACHE_SECONDS.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from gameboard.models import Group
+
+MEMBERSHIP_ATTRIBUTE = '_gameboard_memberships'
+
+
+def cache_key(user_id):
+    return 'membership:{}'.format(user_id)
+
+
+def find_memberships(user):
+    """
+    Get the groups a user plays in and administers.
+
+    :param user: The user (a Player), which can be anonymous.
+    :return: A tuple of the frozensets of group ids the user is a player of, and is an admin of.
+    """
+    if user is None or not user.is_authenticated:
+        return frozenset(), frozenset()
+    memberships = getattr(user, MEMBERSHIP_ATTRIBUTE, None)
+    if memberships is not None:
+        return memberships
+
+    cached = cache.get(cache_key(user.pk))
+    if cached is None:
+        cached = (
+            list(Group.players.through.objects.filter(player_id=user.pk).values_list('group_id', flat=True)),
+            list(Group.admins.through.objects.filter(player_id=user.pk).values_list('group_id', flat=True)),
+        )
+        cache.set(cache_key(user.pk), cached, getattr(settings, 'MEMBERSHIP_CACHE_SECONDS', 60))
+    memberships = (frozenset(cached[0]), frozenset(cached[1]))
+    setattr(user, MEMBERSHIP_ATTRIBUTE, memberships)
+    return memberships
+
+
+def is_member(user, group_id):
+    """
+    :param user: The user (a Player).
+    :param group_id: The id of the group.
+    :return: Whether the user is a player of the group.
+    """
+    return group_id in find_memberships(user)[0]
+
+
+def is_admin(user, group_id):
+    """
+    :param user: The user (a Player).
+    :param group_id: The id of the group.
+    :return: Whether the user is an admin of the group.
+    """
+    return group_id in find_memberships(user)[1]
+
+
+def forget_memberships(user_ids):
+    """
+    Clear the cached memberships of some users, so their next request loads them again.
+
+    :param user_ids: The ids of the users.
+    :return: None
+    """
+    cache.delete_many([cache_key(user_id) for user_id in user_ids])
+
+
+@receiver(m2m_changed, sender=Group.players.through)
+@receiver(m2m_changed, sender=Group.admins.through)
+def clear_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Clear the memberships of the users whose groups changed.
+    """
+    if reverse:
+        # The instance is the user
+        if action in ['post_add', 'post_remove', 'post_clear']:
+            forget_memberships([instance.pk])
+    elif action == 'pre_clear':
+        # The users being cleared can't be found afterwards
+        forget_memberships(sender.objects.filter(group_id=instance.pk).values_list('player_id', flat=True))
+    elif action in ['post_add', 'post_remove'] and pk_set:
+        forget_memberships(pk_set)
+
+
+@receiver(pre_delete, sender=Group)
+def clear_group_delete(sender, instance, **kwargs):
+    """
+    Clear the memberships of everyone in a group being deleted, as its link rows are removed without signals.
+    """
+    forget_memberships(set(Group.players.through.objects.filter(group_id=instance.pk).values_list(
+        'player_id', flat=True
+    )) | set(Group.admins.through.objects.filter(group_id=instance.pk).values_list('player_id', flat=True)))
@@ -0,0 +1,173 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.db import connection, connections
+
+from gameboard.helpers.import_helper import BulkImportScores, ScoreImportError, ScoreReader
+from gameboard.models import Game
+
+
+class ParsedScores:
+    """
+    Everything read from a score csv, in a form that can be sent back from another process. It can be imported just
+    like the ScoreReader it was read with.
+    """
+    def __init__(self, path, players, rounds, errors, rows):
+        self.path = path
+        self.players = players
+        self.rounds = rounds
+        self.errors = errors
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rounds)
+
+
+def parse_scores(path, version=2):
+    """
+    Read and validate a whole score csv, dropping any rounds which could not be imported. This is run in a separate
+    process, so must only do work that doesn't need the database.
+
+    :param path: The location of the csv.
+    :param version: The version of the csv format (see ScoreReader).
+    :return: The ParsedScores.
+    """
+    rounds = []
+    with open(path, newline='') as f:
+        reader = ScoreReader(f, version)
+        for parsed_round in reader:
+            if len(parsed_round.game) > Game._meta.get_field('name').max_length:
+                reader.errors.append((parsed_round.line, "Game name '{}' is too long".format(parsed_round.game)))
+            elif not parsed_round.ranks:
+                reader.errors.append((parsed_round.line, "Nobody played {}".format(parsed_round.game)))
+            else:
+                rounds.append(parsed_round)
+    if not reader.players:
+        reader.errors.append((1, "There are no players in the header"))
+    return ParsedScores(path, reader.players, rounds, reader.errors, reader.rows)
+
+
+class ParallelImportScores:
+    """
+    Imports many score csvs, each into its own group. Files are read and validated in a pool of processes (which is
+    where most of the time goes for large files), then loaded by a small pool of threads, so that no more than
+    `writers` imports are writing to the database at once.
+
+    Players and games shared between files are created up front, one file at a time, so that the writers only ever
+    insert rows which belong to their own group, and never race each other to create the same player.
+
+    Setting workers (or writers) to 0 parses (or loads) the files one at a time in this thread instead, which the tests
+    rely on.
+    """
+    def __init__(self, imports, version=2, chunk_size=2000, skip_existing=False, workers=None, writers=2, log=None,
+                 claim_players=False):
+        """
+        :param imports: A list of (path, group) tuples.
+        :param version: The version of the csv format (see ScoreReader).
+        :param chunk_size: How many rounds are written per transaction.
+        :param skip_existing: Skip rounds which the group already has.
+        :param workers: How many processes parse files, defaults to the number of cores.
+        :param writers: How many files are loaded into the database at once.
+        :param log: A function to call with progress messages.
+        :param claim_players: Let the files name players from outside their group (see BulkImportScores).
+        """
+        self.imports = imports
+        self.version = version
+        self.chunk_size = chunk_size
+        self.skip_existing = skip_existing
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.writers = writers
+        self.log = log if log else (lambda message: None)
+        self.claim_players = claim_players
+
+    def run(self):
+        """
+        Parse and import every file. Files which could not be read at all are skipped.
+
+        :return: A list of the stats of each file, in the order they were given, with the path, group, and any error
+                 that stopped the file from being imported.
+        """
+        start = time.perf_counter()
+        groups = dict(self.imports)
+        parsed = self.parse_all()
+        self.log("Parsed {} files in {:.1f}s".format(len(parsed), time.perf_counter() - start))
+
+        # Shared rows are created serially, see the class docstring
+        loadable = [scores for scores in parsed.values() if isinstance(scores, ParsedScores)]
+        # Games don't belong to a group, so any importer can add them
+        BulkImportScores(None).add_games({parsed_round.game for scores in loadable for parsed_round in scores})
+        for scores in list(loadable):
+            try:
+                BulkImportScores(groups[scores.path], claim_players=self.claim_players).add_players(scores.players)
+            except ScoreImportError as e:
+                parsed[scores.path] = repr(e)
+                loadable.remove(scores)
+
+        work = [(groups[scores.path], scores) for scores in loadable]
+        if self.writers == 0:
+            loaded = [self.load(group_scores) for group_scores in work]
+        else:
+            with ThreadPoolExecutor(max_workers=self.writers, thread_name_prefix='gameboard-import') as executor:
+                loaded = list(executor.map(self.load_and_close, work))
+        loaded = dict(zip([scores.path for scores in loadable], loaded))
+
+        results = []
+        for path, group in self.imports:
+            stats = loaded.get(path, {'error': parsed[path]})
+            results.append(dict(stats, path=path, group=group.name))
+        return results
+
+    def parse_all(self):
+        """
+        Parse every file in the process pool.
+
+        :return: A dictionary of path to its ParsedScores, or the error message if it could not be read.
+        """
+        parsed = {}
+        if self.workers == 0:
+            for path, group in self.imports:
+                try:
+                    parsed[path] = parse_scores(path, self.version)
+                except (OSError, UnicodeDecodeError) as e:
+                    parsed[path] = repr(e)
+            return parsed
+
+        # Forked processes must not share the database connections, or closing them in a child closes them for us
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(self.imports)), initializer=django.setup) as pool:
+            futures = {path: pool.submit(parse_scores, path, self.version) for path, group in self.imports}
+            for path, future in futures.items():
+                try:
+                    parsed[path] = future.result()
+                except (OSError, UnicodeDecodeError) as e:
+                    parsed[path] = repr(e)
+        return parsed
+
+    def load(self, group_scores):
+        """
+        Load a parsed file into its group.
+
+        :param group_scores: A (group, ParsedScores) tuple.
+        :return: The import stats, or a dictionary containing the error which stopped the import.
+        """
+        group, scores = group_scores
+        try:
+            stats = BulkImportScores(
+                group, version=self.version, chunk_size=self.chunk_size, skip_existing=self.skip_existing,
+            ).import_reader(scores)
+        except Exception as e:
+            return {'error': repr(e)}
+        self.log("Loaded {} into {}: {} rounds".format(scores.path, group.name, stats['rounds']))
+        return stats
+
+    def load_and_close(self, group_scores):
+        """
+        Load a parsed file on a writer thread.
+        """
+        try:
+            return self.load(group_scores)
+        finally:
+            # Each writer thread has its own connection, which would otherwise stay open
+            connection.close()
@@ -0,0 +1,168 @@
+import csv
+import heapq
+import itertools
+import math
+import tempfile
+import time
+from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+
+from gameboard.helpers.import_helper import ScoreReader
+
+# Cells are sorted by their round, which is the date they were played, then the game
+round_key = itemgetter(0, 1)
+
+
+@lru_cache(maxsize=4096)
+def date_sort_key(date):
+    """
+    Get a key which sorts dates in the order they were played. Dates which can't be read are sorted as they were
+    written, after every date that could be.
+
+    :param date: A date as written in the csv.
+    :return: A string to sort by.
+    """
+    try:
+        return datetime.strptime(date, ScoreReader.date_format).date().isoformat()
+    except ValueError:
+        return '~' + date
+
+
+class PivotScores:
+    """
+    Turns a wide score csv, where every line is a player followed by all of the games they played, into the score csv
+    format (one line per round) that ScoreReader reads.
+
+    A round is made up of cells spread across every player's line, so the file is read once, and every cell is written
+    to temporary files as sorted runs of at most run_size cells. The runs are then merged, which brings each round's
+    cells together, so memory stays bounded no matter how large the file is. The column of every player is worked out
+    while reading, so placing a cell in its line is a dictionary lookup. Rounds are written oldest first.
+
+    Each line of the wide csv is: player name, real name, then a (game, rank, score, date) group for every game played.
+    """
+    # Number of columns before the game groups start, and in each game group
+    first_game_loc = 2
+    game_width = 4
+
+    def __init__(self, run_size=100000, progress=None):
+        """
+        :param run_size: The most cells held in memory at once, before they are sorted and written out as a run.
+        :param progress: A function called with the stats after every run.
+        """
+        self.run_size = run_size
+        self.progress = progress
+        # Player name to the column of their rank in the long format
+        self.player_columns = {}
+        self.stats = {
+            'players': 0,
+            'cells': 0,
+            'rounds': 0,
+            'runs': 0,
+            'errors': [],
+            'seconds': 0.0,
+            'cells_per_second': 0.0,
+        }
+        self.start = None
+
+    def pivot_file(self, source, destination):
+        """
+        Pivot a wide score csv on disk.
+
+        :param source: The location of the wide csv.
+        :param destination: Where to write the long csv.
+        :return: The stats, containing the players and cells read, rounds written, errors found, and speed.
+        """
+        self.start = time.perf_counter()
+        runs = []
+        try:
+            with open(source, newline='') as f:
+                for run in self.read_runs(csv.reader(f)):
+                    runs.append(self.write_run(run))
+            with open(destination, mode='w', newline='') as f:
+                self.write_rounds(csv.writer(f), runs)
+        finally:
+            for run in runs:
+                run.close()
+        self.update_stats()
+        return self.stats
+
+    def update_stats(self):
+        self.stats['players'] = len(self.player_columns)
+        self.stats['seconds'] = time.perf_counter() - self.start
+        self.stats['cells_per_second'] = self.stats['cells'] / self.stats['seconds'] if self.stats['seconds'] else 0.0
+        if self.progress:
+            self.progress(self.stats)
+
+    def read_runs(self, reader):
+        """
+        Read every cell of the wide csv, giving them back in sorted runs.
+
+        :param reader: A csv reader of the wide csv.
+        :return: A generator of lists of (date key, game, date, column, rank, score) tuples, sorted by round.
+        """
+        run = []
+        for line in reader:
+            # Blank players are spacer lines
+            if not line or line[0] == '':
+                continue
+            column = self.player_columns.setdefault(
+                line[0], ScoreReader.first_player_loc + 2 * len(self.player_columns)
+            )
+
+            for start in range(self.first_game_loc, len(line) - self.game_width + 1, self.game_width):
+                game, rank, score, date = line[start:start + self.game_width]
+                if game == '' or rank == 'No Show':
+                    continue
+                try:
+                    rank = int(math.floor(float(rank)))
+                except ValueError:
+                    self.stats['errors'].append((reader.line_num, "Invalid rank '{}' for {}".format(rank, game)))
+                    continue
+                run.append((date_sort_key(date), game, date, column, rank, score))
+
+                if len(run) >= self.run_size:
+                    self.stats['cells'] += len(run)
+                    yield sorted(run, key=round_key)
+                    run = []
+        if run:
+            self.stats['cells'] += len(run)
+            yield sorted(run, key=round_key)
+
+    def write_run(self, run):
+        """
+        Write a sorted run of cells to a temporary file.
+
+        :param run: A sorted list of cells.
+        :return: The temporary file, rewound to its start.
+        """
+        f = tempfile.TemporaryFile(mode='w+', newline='')
+        csv.writer(f).writerows(run)
+        f.seek(0)
+        self.stats['runs'] += 1
+        self.update_stats()
+        return f
+
+    def write_rounds(self, writer, runs):
+        """
+        Merge the sorted runs, and write a line for every round.
+
+        :param writer: A csv writer for the long csv.
+        :param runs: The temporary files of every run.
+        :return: None
+        """
+        header = ['Date', 'Game', 'Coop']
+        for player in self.player_columns:
+            header += [player, player + '_scores']
+        writer.writerow(header)
+
+        cells = heapq.merge(*[csv.reader(run) for run in runs], key=round_key)
+        for key, round_cells in itertools.groupby(cells, key=round_key):
+            line = [''] * len(header)
+            for date_key, game, date, column, rank, score in round_cells:
+                line[ScoreReader.date_loc] = date
+                line[ScoreReader.game_loc] = game
+                line[int(column)] = rank
+                line[int(column) + 1] = score
+            writer.writerow(line)
+            self.stats['rounds'] += 1
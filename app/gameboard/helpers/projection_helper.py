@@ -0,0 +1,186 @@
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from gameboard.helpers.bracket_helper import BYE, LEAGUE_STAGES, get_layout
+from gameboard.models import BracketType, Round, Team
+
+# Ranks worse than this are counted as this rank, and a player who didn't finish comes after it
+MAX_RANK = 10
+DNF_RANK = MAX_RANK + 1
+# How much a player's placings across every game count towards their placings in a game they've rarely played
+OVERALL_WEIGHT = 2.0
+# Spread over every placing, so players with no history can still finish anywhere
+UNIFORM_WEIGHT = 0.5
+
+
+def find_rank_counts(player_ids):
+    """
+    Count how often each player finished in each place of each game they've played.
+
+    :param player_ids: A list of player ids.
+    :return: A list of (player id, game id, rank, count) tuples.
+    """
+    return list(Round.players.through.objects.filter(playerrank__player_id__in=player_ids).values_list(
+        'playerrank__player_id', 'round__game_id', 'playerrank__rank'
+    ).annotate(count=Count('pk')).order_by())
+
+
+def team_best_rank_cdf(team_players, player_ids, game_ids, rank_counts):
+    """
+    Work out, for every team and game, the distribution of the best place any of the team's players finishes in. A
+    team's players are treated as independent, so the chance of the team's best being worse than a place is the product
+    of the chance of each player being worse than it.
+
+    :param team_players: A list, for each team, of the indexes of its players.
+    :param player_ids: The player ids, in index order.
+    :param game_ids: The game ids, in index order.
+    :param rank_counts: A list of (player id, game id, rank, count) tuples.
+    :return: An array of shape (teams + 1, games, DNF_RANK) holding the chance of the best rank being at most each rank.
+             The extra last team is a bye, which always finishes last.
+    """
+    players = {player_id: index for index, player_id in enumerate(player_ids)}
+    games = {game_id: index for index, game_id in enumerate(game_ids)}
+    counts = np.zeros((len(player_ids), len(game_ids), DNF_RANK))
+    for player_id, game_id, rank, count in rank_counts:
+        rank = DNF_RANK if rank is None else min(rank, MAX_RANK)
+        counts[players[player_id], games[game_id], rank - 1] += count
+
+    # Smooth each player's placings in a game towards their placings overall, then towards anything at all
+    overall = counts.sum(axis=1, keepdims=True)
+    overall = overall / np.maximum(overall.sum(axis=2, keepdims=True), 1)
+    smoothed = counts + OVERALL_WEIGHT * overall + UNIFORM_WEIGHT / DNF_RANK
+    player_cdf = np.cumsum(smoothed / smoothed.sum(axis=2, keepdims=True), axis=2)
+
+    cdf = np.zeros((len(team_players) + 1, len(game_ids), DNF_RANK))
+    for team, indexes in enumerate(team_players):
+        if indexes:
+            # Chance that every player finishes worse than each rank
+            worse = np.prod(1 - player_cdf[indexes], axis=0)
+            cdf[team] = np.clip(1 - worse, 0, 1)
+            # Rounding mustn't leave any chance of finishing past the last place
+            cdf[team, :, -1] = 1
+    # Teams without players (and byes) always finish past the last place
+    return cdf
+
+
+def simulate(layout, team_cdf, game_weights, simulations, rng):
+    """
+    Play out the rest of a bracket many times over. Every simulation is played at once, a match at a time: each picks
+    a game for the match (as often as the teams' players play it), then the best placing of each team. Swiss rounds
+    which haven't been paired yet aren't played out, and a double elimination reset is only played in the simulations
+    where the losers bracket's team won the first final.
+
+    :param layout: The bracket's layout (see bracket_helper).
+    :param team_cdf: The teams' best rank distributions, from team_best_rank_cdf.
+    :param game_weights: How likely each game is to be played.
+    :param simulations: How many times to play the bracket out.
+    :param rng: A numpy random Generator.
+    :return: An array of how many simulations each team won.
+    """
+    teams = {team: index for index, team in enumerate(layout['teams'])}
+    bye = len(layout['teams'])
+    unknown = -1
+
+    def team_index(team):
+        if team is None:
+            return unknown
+        return bye if team == BYE else teams[team]
+
+    matches = layout['matches']
+    slots = np.full((simulations, len(matches), 2), unknown, dtype=np.int64)
+    for number, match in enumerate(matches):
+        slots[:, number] = [team_index(team) for team in match['teams']]
+    wins = np.tile(np.array([layout['wins'][str(team)] for team in layout['teams']] + [0]), (simulations, 1))
+    champions = np.full(simulations, unknown, dtype=np.int64)
+    every = np.arange(simulations)
+    game_cdf = np.cumsum(game_weights / game_weights.sum())
+
+    for number, match in enumerate(matches):
+        if match['winner'] is not None:
+            winner = np.full(simulations, team_index(match['winner']))
+            loser = np.full(simulations, team_index(match['loser']))
+        else:
+            first, second = slots[:, number, 0], slots[:, number, 1]
+            games = np.minimum(np.searchsorted(game_cdf, rng.random(simulations), side='right'), len(game_cdf) - 1)
+            # A rank is sampled from each cdf by counting the buckets a uniform number is past
+            first_rank = (rng.random((simulations, 1)) > team_cdf[first, games]).sum(axis=1)
+            second_rank = (rng.random((simulations, 1)) > team_cdf[second, games]).sum(axis=1)
+            # Draws are settled by a coin flip, which can't hand a match to a bye as a bye always finishes last
+            first_wins = (first_rank < second_rank) | ((first_rank == second_rank) & (rng.random(simulations) < 0.5))
+            winner = np.where(first_wins, first, second)
+            loser = np.where(first_wins, second, first)
+            played = every
+            if number + 1 == layout.get('reset'):
+                # Only played when the first final's winner isn't the winners bracket's team (its first slot)
+                played = first != slots[:, match['feeders'][0][0] - 1, 0]
+                winner = np.where(played, winner, first)
+                loser = np.where(played, loser, second)
+                played = every[played]
+            np.add.at(wins, (played, winner[played]), 1)
+
+        for team, destination in ((winner, match['winner_to']), (loser, match['loser_to'])):
+            if destination:
+                slots[:, destination[0] - 1, destination[1]] = team
+        if match['winner_to'] is None and match['stage'] not in LEAGUE_STAGES:
+            champions = winner
+
+    if layout['type'] in (BracketType.ROUND_ROBIN.value, BracketType.SWISS.value):
+        # The most wins takes it, with ties going to the better seed (argmax picks the first)
+        champions = np.argmax(wins[:, :bye], axis=1)
+    return np.bincount(champions[(champions >= 0) & (champions < bye)], minlength=bye)
+
+
+def project_tournament(tournament, simulations=None, seed=None):
+    """
+    Work out how likely each team is to win a tournament, by playing out its remaining matches many times from each
+    player's history. Projections are cached until the bracket next changes.
+
+    :param tournament: The tournament.
+    :param simulations: How many times to play the bracket out, defaults to PROJECTION_SIMULATIONS.
+    :param seed: A seed for the random numbers, so projections can be repeated.
+    :return: A dictionary of the layout revision projected, the number of simulations, and for each team its
+             chance of winning the tournament.
+    """
+    simulations = simulations or getattr(settings, 'PROJECTION_SIMULATIONS', 20000)
+    bracket = tournament.bracket
+    layout = get_layout(bracket)
+    key = 'projection:{}:{}:{}:{}:{}'.format(
+        tournament.pk, bracket.updated_at.timestamp(), layout['revision'], simulations, seed,
+    )
+    projection = cache.get(key)
+    if projection is not None:
+        return projection
+
+    names = dict(Team.objects.filter(pk__in=layout['teams']).values_list('pk', 'name'))
+    memberships = list(Team.players.through.objects.filter(team_id__in=layout['teams']).values_list(
+        'team_id', 'player_id'
+    ))
+    player_ids = sorted({player_id for team_id, player_id in memberships})
+    rank_counts = find_rank_counts(player_ids)
+    game_ids = sorted({game_id for player_id, game_id, rank, count in rank_counts}) or [None]
+
+    players = {player_id: index for index, player_id in enumerate(player_ids)}
+    team_players = [[players[player_id] for team_id, player_id in memberships if team_id == team]
+                    for team in layout['teams']]
+    game_weights = np.zeros(len(game_ids))
+    games = {game_id: index for index, game_id in enumerate(game_ids)}
+    for player_id, game_id, rank, count in rank_counts:
+        game_weights[games[game_id]] += count
+    if not game_weights.any():
+        game_weights[:] = 1
+
+    won = simulate(layout, team_best_rank_cdf(team_players, player_ids, game_ids, rank_counts), game_weights,
+                   simulations, np.random.default_rng(seed))
+    projection = {
+        'revision': layout['revision'],
+        'simulations': simulations,
+        'teams': [{
+            'pk': team,
+            'name': names.get(team),
+            'winProbability': round(float(count) / simulations, 4),
+        } for team, count in zip(layout['teams'], won)],
+    }
+    cache.set(key, projection, getattr(settings, 'PROJECTION_CACHE_SECONDS', 600))
+    return projection
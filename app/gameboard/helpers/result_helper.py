@@ -0,0 +1,171 @@
+"""
+Tournament results
+
+Once a tournament has a champion it can be finalized, which freezes its bracket, matches, and standings into a single
+TournamentResult. The document is json compressed with zlib, and never changes, so reading a finished tournament is one
+row fetch, and the decoded document is cached with no expiry.
+"""
+import json
+import zlib
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from gameboard.helpers.bracket_helper import get_layout
+from gameboard.helpers.standings_helper import find_standings
+from gameboard.models import Tournament, TournamentResult
+
+
+class ResultError(Exception):
+    """
+    Raised when a tournament can't be finalized, because it hasn't finished or was already finalized.
+    """
+    pass
+
+
+def tournament_data(tournament):
+    """
+    Gather a tournament's teams, and the matches of its bracket with the ranks of the round each was played in.
+
+    :param tournament: The tournament.
+    :return: A dictionary of the tournament, which can be stored as json.
+    """
+    bracket = tournament.bracket
+    # For every team, get their information, along with their seed if the bracket has been seeded
+    seeds = {team: seed for seed, team in enumerate(bracket.seeds or [], start=1)}
+    bracket_teams = []
+    for team in bracket.teams.prefetch_related('players'):
+        bracket_teams.append({
+            'pk': team.pk,
+            'name': team.name,
+            'color': team.color,
+            'seed': seeds.get(team.pk),
+            'players': [{
+                'pk': team_player.pk,
+                'username': team_player.username,
+            } for team_player in team.players.all()],
+        })
+
+    # For every match, gather information
+    bracket_matches = []
+    for match in bracket.matches.select_related('round__game').prefetch_related('round__players__player'):
+        game_round = match.round
+        if game_round is None:
+            # Scheduled, but not played yet
+            bracket_matches.append({
+                'pk': match.pk,
+                'match': match.match,
+                'round': None,
+            })
+            continue
+
+        bracket_matches.append({
+            'pk': match.pk,
+            'match': match.match,
+            'round': {
+                'pk': game_round.pk,
+                'game': {
+                    'pk': game_round.game.pk,
+                    'name': game_round.game.name,
+                },
+                'date': game_round.date,
+                'players': [{
+                    'pk': player_rank.pk,
+                    'player': {
+                        'pk': player_rank.player.pk,
+                        'username': player_rank.player.username,
+                    },
+                    'rank': player_rank.rank,
+                    'score': player_rank.score,
+                } for player_rank in game_round.players.all()],
+            }
+        })
+
+    return {
+        'pk': tournament.pk,
+        'name': tournament.name,
+        'group': tournament.group_id,
+        'bracket': {
+            'pk': bracket.pk,
+            'type': bracket.type,
+            'teams': bracket_teams,
+            'matches': bracket_matches,
+        }
+    }
+
+
+def encode_document(document):
+    return zlib.compress(json.dumps(document, cls=DjangoJSONEncoder, separators=(',', ':')).encode(), 9)
+
+
+def decode_document(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def cache_key(tournament_pk):
+    return 'tournament_result:{}'.format(tournament_pk)
+
+
+def finalize_tournament(tournament):
+    """
+    Freeze a finished tournament's bracket, matches, and standings.
+
+    :param tournament: The tournament, which must have a champion.
+    :return: The document stored (see find_result).
+    """
+    with transaction.atomic():
+        # Locking the tournament stops two finalizations racing each other, and locking its bracket (which changes to
+        # the bracket take too, see bracket_helper.is_finalized) stops the bracket changing as it is frozen
+        tournament = Tournament.objects.select_for_update().select_related('bracket').get(pk=tournament.pk)
+        if TournamentResult.objects.filter(tournament=tournament).exists():
+            raise ResultError("The tournament has already been finalized")
+        layout = get_layout(tournament.bracket)
+        if layout['champion'] is None:
+            raise ResultError("The tournament can't be finalized until it has a champion")
+        document = {
+            'tournament': tournament_data(tournament),
+            'scoring': find_standings(tournament),
+            'layout': layout,
+            'champion': layout['champion'],
+            'finalizedAt': timezone.now(),
+        }
+        try:
+            TournamentResult.objects.create(tournament=tournament, document=encode_document(document))
+        except IntegrityError:
+            raise ResultError("The tournament has already been finalized")
+    return find_result(tournament.pk)
+
+
+def find_result(tournament_pk):
+    """
+    Get the frozen results of a finalized tournament.
+
+    :param tournament_pk: The id of the tournament.
+    :return: The document, a dictionary of the tournament (as tournament_data gives it), its final scoring, bracket
+             layout, champion, and when it was finalized. None if the tournament hasn't been finalized.
+    """
+    try:
+        # Ids from urls are strings, which must match the key the result is forgotten by
+        tournament_pk = int(tournament_pk)
+    except (TypeError, ValueError):
+        return None
+    document = cache.get(cache_key(tournament_pk))
+    if document is None:
+        data = TournamentResult.objects.filter(tournament_id=tournament_pk).values_list('document', flat=True).first()
+        if data is None:
+            return None
+        document = decode_document(data)
+        cache.set(cache_key(tournament_pk), document, None)
+    return document
+
+
+@receiver(post_delete, sender=TournamentResult)
+def forget_result(sender, instance, **kwargs):
+    """
+    Results never change, but are deleted along with their tournament, which can leave its id to be used again.
+    """
+    cache.delete(cache_key(instance.tournament_id))
@@ -0,0 +1,400 @@
+"""
+Snapshots
+
+A compact binary copy of every gameboard table, for backups, which can be written and restored far quicker than
+the score csvs. The format (version 1), with all numbers little endian, is:
+
+    magic (b'GBSNAP'), version (uint16)
+    for every table:
+        header length (uint32), header (json: the table's label and its columns' names, kinds, and nullability)
+        for every block of up to BLOCK_SIZE rows:
+            row count (uint32)
+            for every column: length (uint32), zlib compressed column
+        0 (uint32), ending the table's blocks
+    0 (uint32), ending the tables
+
+A column is a list of length prefixed (uint32) parts. Nullable columns start with a part holding a byte per row (1 for
+null), followed by the non null values in a layout depending on the column's kind:
+
+    i: integers, as int64 differences from the previous value (sorted ids and dates become runs of small numbers)
+    d: dates, as integers of their proleptic ordinal
+    t: datetimes, as integers of microseconds since 1970 UTC
+    b: booleans, a byte each
+    s: strings (and anything else, such as decimals), a part of uint32 utf-8 lengths, then a part of the utf-8 bytes
+    j: json, stored as strings
+    x: binary, like strings but with the bytes as they are
+
+Snapshots are a few times quicker than the score csvs, not the order of magnitude they were meant to be. On PostgreSQL,
+with 22k rounds (170k rows in all), a dump takes about 1s against 2.8s for the csv export, and a restore about 2.9s
+against 5.2s for the csv import (which loads with COPY too). Most of a restore is now the database itself, inserting
+into the indexes and checking the foreign keys as the transaction commits.
+"""
+import io
+import json
+import struct
+import sys
+import zlib
+from array import array
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, router, transaction
+from django.db.models import BinaryField, BooleanField, DateField, DateTimeField, JSONField
+from rest_framework.authtoken.models import Token
+
+from gameboard.helpers.import_helper import copy_enabled, copy_text, copy_value
+from gameboard.models import Player
+
+SNAPSHOT_MAGIC = b'GBSNAP'
+SNAPSHOT_VERSION = 1
+BLOCK_SIZE = 10000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+NAIVE_EPOCH = datetime(1970, 1, 1)
+INTEGER_TYPES = ['AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField', 'BigIntegerField',
+                 'SmallIntegerField', 'PositiveIntegerField', 'PositiveBigIntegerField', 'PositiveSmallIntegerField']
+
+UINT32 = struct.Struct('<I')
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot can't be restored, because it is damaged, from an unknown version, or the database isn't
+    empty.
+    """
+    pass
+
+
+def snapshot_models():
+    """
+    Get every table a snapshot holds, in the order they are written: each gameboard model, followed by the link tables
+    of its many to many fields. Links to models outside of gameboard (such as a player's permissions) are left out, as
+    their ids depend on the database.
+
+    :return: A list of models.
+    """
+    models = []
+    for model in apps.get_app_config('gameboard').get_models():
+        models.append(model)
+        for field in model._meta.local_many_to_many:
+            through = field.remote_field.through
+            if through._meta.auto_created and field.related_model._meta.app_label == 'gameboard':
+                models.append(through)
+    return models
+
+
+def column_kind(field):
+    """
+    Get the kind of column (see the format description at the top of this file) a field is stored as.
+
+    :param field: A concrete model field.
+    :return: The kind, as a single letter.
+    """
+    target = field.target_field if field.is_relation else field
+    if isinstance(target, BooleanField):
+        return 'b'
+    if isinstance(target, DateTimeField):
+        return 't'
+    if isinstance(target, DateField):
+        return 'd'
+    if isinstance(target, JSONField):
+        return 'j'
+    if isinstance(target, BinaryField):
+        return 'x'
+    if target.get_internal_type() in INTEGER_TYPES:
+        return 'i'
+    return 's'
+
+
+def integer_bytes(values):
+    integers = array('q', values)
+    if sys.byteorder == 'big':
+        integers.byteswap()
+    return integers.tobytes()
+
+
+def bytes_integers(data, typecode='q'):
+    integers = array(typecode)
+    integers.frombytes(data)
+    if sys.byteorder == 'big':
+        integers.byteswap()
+    return integers
+
+
+def encode_column(kind, nullable, values):
+    """
+    Encode one column of a block.
+
+    :param kind: The kind of the column.
+    :param nullable: Whether the column can hold nulls.
+    :param values: The column's values as the database cursor gives them, one for each row.
+    :return: The compressed column.
+    """
+    parts = []
+    if nullable:
+        parts.append(bytes(value is None for value in values))
+        values = [value for value in values if value is not None]
+
+    if kind in 'idt':
+        # SQLite gives back dates and datetimes as iso formatted strings, in UTC
+        if kind == 'd':
+            values = [(value if isinstance(value, date) else date.fromisoformat(value)).toordinal() for value in values]
+        elif kind == 't':
+            values = [value if isinstance(value, datetime) else datetime.fromisoformat(value) for value in values]
+            values = [(value - (EPOCH if value.tzinfo else NAIVE_EPOCH)) // timedelta(microseconds=1)
+                      for value in values]
+        previous = 0
+        differences = []
+        for value in values:
+            differences.append(value - previous)
+            previous = value
+        parts.append(integer_bytes(differences))
+    elif kind == 'b':
+        parts.append(bytes(values))
+    else:
+        if kind == 'j':
+            values = [value if isinstance(value, str) else json.dumps(value) for value in values]
+        # PostgreSQL gives back binary columns as memoryviews
+        encoded = [bytes(value) if kind == 'x' else str(value).encode() for value in values]
+        lengths = array('I', [len(value) for value in encoded])
+        if sys.byteorder == 'big':
+            lengths.byteswap()
+        parts += [lengths.tobytes(), b''.join(encoded)]
+    return zlib.compress(b''.join(UINT32.pack(len(part)) + part for part in parts))
+
+
+def decode_column(kind, nullable, data, count):
+    """
+    Decode one column of a block, the reverse of encode_column.
+
+    :param kind: The kind of the column.
+    :param nullable: Whether the column can hold nulls.
+    :param data: The compressed column.
+    :param count: The number of rows in the block.
+    :return: The column's values, one for each row.
+    """
+    data = zlib.decompress(data)
+    parts = []
+    position = 0
+    while position < len(data):
+        length = UINT32.unpack_from(data, position)[0]
+        parts.append(data[position + 4:position + 4 + length])
+        position += 4 + length
+
+    nulls = parts.pop(0) if nullable else bytes(count)
+    if kind in 'idt':
+        values = []
+        previous = 0
+        for difference in bytes_integers(parts[0]):
+            previous += difference
+            values.append(previous)
+        if kind == 'd':
+            values = [date.fromordinal(value) for value in values]
+        elif kind == 't':
+            epoch = EPOCH if settings.USE_TZ else NAIVE_EPOCH
+            values = [epoch + timedelta(microseconds=value) for value in values]
+    elif kind == 'b':
+        values = [bool(value) for value in parts[0]]
+    else:
+        values = []
+        position = 0
+        for length in bytes_integers(parts[0], 'I'):
+            value = parts[1][position:position + length]
+            values.append(value if kind == 'x' else value.decode())
+            position += length
+        if kind == 'j':
+            values = [json.loads(value) for value in values]
+
+    if not any(nulls):
+        return values
+    values = iter(values)
+    return [None if null else next(values) for null in nulls]
+
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise SnapshotError("The snapshot ends part way through")
+    return data
+
+
+def read_uint32(f):
+    return UINT32.unpack(read_exactly(f, 4))[0]
+
+
+def dump_snapshot(f, block_size=BLOCK_SIZE):
+    """
+    Write every gameboard table to a snapshot. Tables are read through a server side cursor a block at a time, so the
+    memory used only depends on the block size.
+
+    Every table is read in a single transaction, which on PostgreSQL is REPEATABLE READ, so that all of them are read
+    as they were at the same moment, and links in the snapshot never point at rows written after their table was read.
+    When called inside a transaction that transaction is used as it is.
+
+    :param f: A file opened for writing bytes.
+    :param block_size: The most rows in a block.
+    :return: A dictionary of table label to the number of rows written.
+    """
+    using = router.db_for_read(Player)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    f.write(SNAPSHOT_MAGIC + struct.pack('<H', SNAPSHOT_VERSION))
+    counts = {}
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor == 'postgresql':
+            # Must come before the transaction's first query
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        for model in snapshot_models():
+            fields = model._meta.concrete_fields
+            columns = [(field.attname, column_kind(field), field.null) for field in fields]
+            header = json.dumps({'table': model._meta.label_lower, 'columns': columns}).encode()
+            f.write(UINT32.pack(len(header)) + header)
+
+            counts[model._meta.label_lower] = 0
+            # Read straight from the cursor, as the ORM's conversions (datetimes especially) take most of the time
+            with connection.chunked_cursor() as cursor:
+                cursor.execute("SELECT {} FROM {} ORDER BY {}".format(
+                    ', '.join(quote(field.column) for field in fields),
+                    quote(model._meta.db_table),
+                    quote(model._meta.pk.column),
+                ))
+                while True:
+                    block = cursor.fetchmany(block_size)
+                    if not block:
+                        break
+                    write_block(f, columns, block)
+                    counts[model._meta.label_lower] += len(block)
+            f.write(UINT32.pack(0))
+    f.write(UINT32.pack(0))
+    return counts
+
+
+def write_block(f, columns, block):
+    f.write(UINT32.pack(len(block)))
+    for (name, kind, nullable), values in zip(columns, zip(*block)):
+        encoded = encode_column(kind, nullable, values)
+        f.write(UINT32.pack(len(encoded)) + encoded)
+
+
+def restore_snapshot(f):
+    """
+    Restore a snapshot into a database with no gameboard data, in a single transaction. Blocks are loaded one at a
+    time (with COPY on PostgreSQL), so the memory used only depends on the block size the snapshot was written with.
+
+    Rows keep their ids, and every id sequence is moved past the restored ids afterwards. API tokens are not part of a
+    snapshot, so every player is given a new one.
+
+    :param f: A file opened for reading bytes.
+    :return: A dictionary of table label to the number of rows restored.
+    """
+    if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        raise SnapshotError("This is not a gameboard snapshot")
+    version = struct.unpack('<H', read_exactly(f, 2))[0]
+    if version > SNAPSHOT_VERSION:
+        raise SnapshotError("Snapshot version {} is newer than this gameboard can read".format(version))
+
+    models = {model._meta.label_lower: model for model in snapshot_models()}
+    for model in models.values():
+        if model._base_manager.exists():
+            raise SnapshotError("{} already has data, snapshots can only be restored into an empty database".format(
+                model._meta.label
+            ))
+
+    using = router.db_for_write(Player)
+    connection = connections[using]
+    counts = {}
+    with transaction.atomic(using=using):
+        while True:
+            header_length = read_uint32(f)
+            if header_length == 0:
+                break
+            header = json.loads(read_exactly(f, header_length))
+            model = models.get(header['table'])
+            if model is None:
+                raise SnapshotError("Unknown table {}".format(header['table']))
+            try:
+                fields = [model._meta.get_field(name) for name, kind, nullable in header['columns']]
+            except FieldDoesNotExist as e:
+                raise SnapshotError("{} has changed since the snapshot was made: {}".format(model._meta.label, e))
+            counts[header['table']] = 0
+
+            while True:
+                count = read_uint32(f)
+                if count == 0:
+                    break
+                values = [
+                    decode_column(kind, nullable, read_exactly(f, read_uint32(f)), count)
+                    for name, kind, nullable in header['columns']
+                ]
+                insert_columns(model, fields, [kind for name, kind, nullable in header['columns']], values, using)
+                counts[header['table']] += count
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(models.values())):
+                cursor.execute(sql)
+        Token.objects.bulk_create([Token(user=player, key=Token.generate_key()) for player in Player.objects.filter(
+            auth_token__isnull=True
+        ).only('pk')])
+    return counts
+
+
+def insert_columns(model, fields, kinds, values, using):
+    """
+    Insert a block of decoded columns, exactly as given, into a model's table. With COPY (whenever the imports use it,
+    see copy_enabled) a column's values are all written out as text in one go, as converting them for the database one
+    by one takes longer than the database takes to load them.
+
+    :param model: The model of the table.
+    :param fields: The field of each column.
+    :param kinds: The kind of each column.
+    :param values: A list of the decoded values of each column.
+    :param using: The alias of the database.
+    :return: None
+    """
+    connection = connections[using]
+    if copy_enabled(using):
+        columns = [copy_column(field, kind, column, connection) for field, kind, column in zip(fields, kinds, values)]
+        copy_text(model, [field.attname for field in fields], io.StringIO(
+            ''.join('\t'.join(row) + '\n' for row in zip(*columns))
+        ), using)
+        return
+
+    # Ints and strings are already what the database expects
+    values = [
+        column if kind in 'is' and not field.get_internal_type() == 'DecimalField'
+        else [field.get_db_prep_save(value, connection) for value in column]
+        for field, kind, column in zip(fields, kinds, values)
+    ]
+    rows = list(zip(*values))
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany("INSERT INTO {} ({}) VALUES ({})".format(
+            quote(model._meta.db_table),
+            ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        ), rows)
+
+
+def copy_column(field, kind, values, connection):
+    """
+    Write one decoded column in COPY's text format (see copy_value).
+
+    :param field: The column's field.
+    :param kind: The kind of the column.
+    :param values: The column's values.
+    :param connection: The database connection the column is loaded through.
+    :return: A list of the values as COPY text.
+    """
+    if kind in 'idt':
+        # The text of ints, dates, and datetimes is already what COPY reads, and never needs escaping
+        return ['\\N' if value is None else str(value) for value in values]
+    if kind == 'b':
+        return ['\\N' if value is None else 't' if value else 'f' for value in values]
+    if kind == 's' and not field.get_internal_type() == 'DecimalField':
+        return [copy_value(value) for value in values]
+    return [copy_value(field.get_db_prep_save(value, connection)) for value in values]
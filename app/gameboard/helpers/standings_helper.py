@@ -0,0 +1,383 @@
+"""
+Live standings
+
+Team scores of tournaments, kept up to date in memory and pushed to every watcher as Server-Sent Events. A tournament is
+loaded into the hub when its first watcher connects, and dropped when its last watcher leaves. Each result that comes
+in only recomputes the points of the rounds it changed, once, however many watchers there are.
+
+Changes are caught through signals, which only fire in the process making the change. Each loaded tournament also
+checks its bracket's updated_at every LIVE_STANDINGS_POLL_SECONDS, so changes made by other worker processes are still
+picked up (by reloading the tournament). Every change to a tournament's standings touches its bracket's updated_at.
+
+Events are numbered with the revision of the bracket they were sent for, its updated_at in microseconds, which is the
+same in every process. A watcher reconnecting to another process (which sends the last revision it saw) is only sent
+what it missed when that process sent the same revision, and otherwise gets the full standings.
+
+Every open stream holds the thread serving it until the stream ends, after at most LIVE_STANDINGS_MAX_SECONDS. The
+server must run threaded workers (runserver is threaded, gunicorn needs --worker-class gthread with enough --threads
+for every watcher plus normal requests), as a synchronous worker can't serve anything else while a watcher is
+connected.
+"""
+import calendar
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from gameboard.helpers.bracket_helper import round_ranks
+from gameboard.models import Bracket, BracketMatch, PlayerRank, Round, Team, Tournament
+
+# Points for each placement in a match
+# TODO make scoring customizable
+TOURNAMENT_SCORING = {
+    1: 9,
+    2: 7,
+    3: 5,
+    4: 3,
+}
+
+# How many past deltas each tournament keeps, so reconnecting watchers can catch up without a full reload
+DELTA_HISTORY = 100
+
+
+def bracket_revision(updated_at):
+    """
+    :param updated_at: When a bracket was last changed.
+    :return: The revision of the bracket's standings, as microseconds since 1970.
+    """
+    return calendar.timegm(updated_at.utctimetuple()) * 1000000 + updated_at.microsecond
+
+
+def team_points(ranks, team_by_players):
+    """
+    Work out how many points each team scored in a round.
+
+    :param ranks: A list of (player id, rank) tuples of the round.
+    :param team_by_players: A dictionary of player id to their team's name.
+    :return: A dictionary of team name to the points they scored. Teams that scored nothing are left out.
+    """
+    points = {}
+    for player_id, rank in ranks:
+        team = team_by_players.get(player_id)
+        # Players without a team, and placements without points, don't count
+        if team is not None and rank in TOURNAMENT_SCORING:
+            points[team] = points.get(team, 0) + TOURNAMENT_SCORING[rank]
+    return points
+
+
+class TournamentStandings:
+    """
+    The scores of one tournament, along with which rounds they came from, so that a changed round only needs its own
+    points recomputing.
+
+    Deltas are counted by sequence within this process, which is what its watchers wait on, as one commit can send
+    several deltas with the same revision.
+    """
+    def __init__(self, tournament_pk):
+        self.pk = tournament_pk
+        self.condition = threading.Condition()
+        self.watchers = 0
+        self.sequence = 0
+        # (sequence, delta) tuples
+        self.history = deque(maxlen=DELTA_HISTORY)
+        self.checked = time.monotonic()
+        self.load()
+
+    def load(self):
+        """
+        Compute the scores from scratch.
+        """
+        tournament = Tournament.objects.select_related('bracket').get(pk=self.pk)
+        self.bracket_pk = tournament.bracket_id
+        self.updated_at = tournament.bracket.updated_at
+        self.revision = bracket_revision(self.updated_at)
+        self.team_by_players = dict(Team.players.through.objects.filter(
+            team__teams=tournament.bracket_id
+        ).values_list('player_id', 'team__name'))
+        # Bracket match id to its round id, and the points scored in each round
+        self.match_rounds = dict(BracketMatch.objects.filter(
+            matches=tournament.bracket_id
+        ).values_list('pk', 'round_id'))
+        ranks = round_ranks(set(self.match_rounds.values()))
+        self.round_points = {
+            round_id: team_points(ranks.get(round_id, []), self.team_by_players)
+            for round_id in set(self.match_rounds.values())
+        }
+        self.scores = {name: 0 for name in Team.objects.filter(teams=tournament.bracket_id).values_list(
+            'name', flat=True)}
+        for round_id in self.match_rounds.values():
+            for team, points in self.round_points.get(round_id, {}).items():
+                self.scores[team] += points
+
+    def snapshot(self):
+        return {'tournament': self.pk, 'revision': self.revision, 'scoring': dict(self.scores)}
+
+    def publish(self, old_scores):
+        """
+        Send out the teams whose scores differ from before, if any.
+
+        :param old_scores: The scores before the change.
+        :return: None
+        """
+        changes = {team: score for team, score in self.scores.items() if old_scores.get(team) != score}
+        removed = [team for team in old_scores if team not in self.scores]
+        if not changes and not removed:
+            return
+        # The change has been committed, so the bracket has the revision it was made in. updated_at is left alone, so
+        # changes committed by other processes meanwhile are still reloaded
+        updated_at = Bracket.objects.filter(pk=self.bracket_pk).values_list('updated_at', flat=True).first()
+        if updated_at is not None:
+            self.revision = bracket_revision(updated_at)
+        self.sequence += 1
+        self.history.append((self.sequence, {
+            'tournament': self.pk, 'revision': self.revision, 'scoring': changes, 'removed': removed,
+        }))
+        self.condition.notify_all()
+
+    def reload(self):
+        with self.condition:
+            old_scores = dict(self.scores)
+            try:
+                self.load()
+            except Tournament.DoesNotExist:
+                # Watchers of a deleted tournament keep the last standings until they disconnect
+                return
+            self.publish(old_scores)
+
+    def update_rounds(self, round_ids):
+        """
+        Recompute the points of some rounds, which had their ranks changed.
+
+        :param round_ids: The ids of the rounds.
+        :return: None
+        """
+        with self.condition:
+            round_ids = [round_id for round_id in round_ids if round_id in self.round_points]
+            if not round_ids:
+                return
+            ranks = round_ranks(round_ids)
+            old_scores = dict(self.scores)
+            for round_id in round_ids:
+                uses = sum(1 for match_round in self.match_rounds.values() if match_round == round_id)
+                new_points = team_points(ranks.get(round_id, []), self.team_by_players)
+                for team, points in self.round_points.get(round_id, {}).items():
+                    self.scores[team] -= points * uses
+                for team, points in new_points.items():
+                    self.scores[team] += points * uses
+                self.round_points[round_id] = new_points
+            self.publish(old_scores)
+
+    def update_matches(self):
+        """
+        Pick up matches which were added to (or removed from) the bracket, recomputing only their rounds.
+        """
+        with self.condition:
+            match_rounds = dict(BracketMatch.objects.filter(matches=self.bracket_pk).values_list('pk', 'round_id'))
+            added = {pk: round_id for pk, round_id in match_rounds.items() if self.match_rounds.get(pk) != round_id}
+            removed = {pk: round_id for pk, round_id in self.match_rounds.items() if match_rounds.get(pk) != round_id}
+            if not added and not removed:
+                return
+            missing = set(added.values()) - set(self.round_points)
+            ranks = round_ranks(missing)
+            for round_id in missing:
+                self.round_points[round_id] = team_points(ranks.get(round_id, []), self.team_by_players)
+            old_scores = dict(self.scores)
+            for round_id in removed.values():
+                for team, points in self.round_points.get(round_id, {}).items():
+                    self.scores[team] -= points
+            for round_id in added.values():
+                for team, points in self.round_points.get(round_id, {}).items():
+                    self.scores[team] += points
+            self.match_rounds = match_rounds
+            self.round_points = {round_id: self.round_points[round_id] for round_id in set(match_rounds.values())}
+            self.publish(old_scores)
+
+    def events_since(self, revision):
+        """
+        Get the events a reconnecting watcher needs to catch up.
+
+        :param revision: The last revision the watcher has, or None if it has nothing.
+        :return: A list of (event name, data) tuples.
+        """
+        if revision == self.revision:
+            return []
+        if revision is not None and any(delta['revision'] == revision for sequence, delta in self.history):
+            return [('delta', delta) for sequence, delta in self.history if delta['revision'] > revision]
+        return [('standings', self.snapshot())]
+
+    def events_after(self, sequence):
+        """
+        Get the events a connected watcher hasn't been sent yet.
+
+        :param sequence: The sequence the watcher has been sent up to.
+        :return: A list of (event name, data) tuples.
+        """
+        if self.history and self.history[0][0] > sequence + 1:
+            return [('standings', self.snapshot())]
+        return [('delta', delta) for delta_sequence, delta in self.history if delta_sequence > sequence]
+
+
+class StandingsHub:
+    """
+    Every tournament being watched in this process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tournaments = {}
+
+    def watch(self, tournament_pk):
+        with self.lock:
+            standings = self.tournaments.get(tournament_pk)
+            if standings is None:
+                standings = self.tournaments[tournament_pk] = TournamentStandings(tournament_pk)
+            standings.watchers += 1
+            return standings
+
+    def unwatch(self, standings):
+        with self.lock:
+            standings.watchers -= 1
+            if standings.watchers <= 0:
+                self.tournaments.pop(standings.pk, None)
+
+    def loaded(self, bracket_pks=None):
+        """
+        :param bracket_pks: Only get the tournaments of these brackets.
+        :return: A list of the TournamentStandings being watched.
+        """
+        with self.lock:
+            return [standings for standings in self.tournaments.values()
+                    if bracket_pks is None or standings.bracket_pk in bracket_pks]
+
+    def check(self, standings):
+        """
+        Reload a tournament if its bracket was changed by another process. Only one watcher checks each interval.
+        """
+        with standings.condition:
+            if time.monotonic() - standings.checked < getattr(settings, 'LIVE_STANDINGS_POLL_SECONDS', 5):
+                return
+            standings.checked = time.monotonic()
+            updated_at = Bracket.objects.filter(pk=standings.bracket_pk).values_list('updated_at', flat=True).first()
+            if updated_at != standings.updated_at:
+                standings.reload()
+
+    def stream(self, tournament_pk, last_revision=None):
+        """
+        Watch a tournament's standings, as Server-Sent Events. The first event is either the full standings, or the
+        deltas missed since last_revision. After that a delta event is sent whenever a team's score changes, holding
+        the new scores of the teams which changed. Comments are sent while nothing happens, to keep the connection
+        open. The stream ends after LIVE_STANDINGS_MAX_SECONDS (so it doesn't tie up a worker thread for long, see the
+        module docstring), and browsers reconnect on their own, sending the last revision they saw.
+
+        :param tournament_pk: The id of the tournament.
+        :param last_revision: The revision the watcher already has.
+        :return: A generator of the event stream's text.
+        """
+        standings = self.watch(tournament_pk)
+        try:
+            poll = getattr(settings, 'LIVE_STANDINGS_POLL_SECONDS', 5)
+            deadline = time.monotonic() + getattr(settings, 'LIVE_STANDINGS_MAX_SECONDS', 60)
+            yield 'retry: {}\n\n'.format(poll * 1000)
+            with standings.condition:
+                events = standings.events_since(last_revision)
+                sequence = standings.sequence
+            while True:
+                for event, data in events:
+                    yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(data['revision'], event, json.dumps(data))
+                if time.monotonic() >= deadline:
+                    return
+                with standings.condition:
+                    standings.condition.wait_for(lambda: standings.sequence != sequence, timeout=poll)
+                    events = standings.events_after(sequence)
+                    sequence = standings.sequence
+                if not events:
+                    yield ': keep-alive\n\n'
+                    self.check(standings)
+                    with standings.condition:
+                        events = standings.events_after(sequence)
+                        sequence = standings.sequence
+        finally:
+            self.unwatch(standings)
+
+
+hub = StandingsHub()
+
+
+def find_standings(tournament):
+    """
+    Compute a tournament's team scores. Watched tournaments are read from the hub instead.
+
+    :param tournament: The tournament.
+    :return: A dictionary of team name to their score.
+    """
+    for standings in hub.loaded([tournament.bracket_id]):
+        if standings.pk == tournament.pk:
+            with standings.condition:
+                return dict(standings.scores)
+    return TournamentStandings(tournament.pk).scores
+
+
+def after_commit(function):
+    """
+    Run a hub update once the change is committed, and only when something is being watched.
+    """
+    if hub.tournaments:
+        transaction.on_commit(function)
+
+
+@receiver(m2m_changed, sender=Bracket.matches.through)
+@receiver(m2m_changed, sender=Bracket.teams.through)
+@receiver(m2m_changed, sender=Team.players.through)
+@receiver(m2m_changed, sender=Round.players.through)
+def publish_m2m_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Update the watched tournaments when a bracket's matches, a round's ranks, or the teams change.
+    """
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    # The brackets (or rounds) which changed, or None when clearing from the reverse side, which doesn't say
+    changed = [instance.pk] if not reverse else (list(pk_set) if pk_set else None)
+    if sender is Bracket.matches.through:
+        after_commit(lambda: [standings.update_matches() for standings in hub.loaded(changed)])
+    elif sender is Round.players.through:
+        after_commit(lambda: [standings.update_rounds(changed or list(standings.round_points))
+                              for standings in hub.loaded()])
+    else:
+        # Teams rarely change, so the tournaments are simply reloaded
+        after_commit(lambda: [standings.reload() for standings in hub.loaded()])
+
+
+@receiver(post_save, sender=PlayerRank)
+def publish_rank_change(sender, instance, created, **kwargs):
+    """
+    Update the watched tournaments when a rank changes. New ranks are caught once they are added to their round.
+    """
+    if created:
+        return
+
+    def update():
+        rounds = list(Round.objects.filter(players=instance.pk).values_list('pk', flat=True))
+        for standings in hub.loaded():
+            standings.update_rounds(rounds)
+    after_commit(update)
+
+
+@receiver(post_delete, sender=PlayerRank)
+def publish_rank_delete(sender, instance, **kwargs):
+    """
+    The round of a deleted rank can't be found any more, so every round of the watched tournaments is recomputed.
+    """
+    after_commit(lambda: [standings.update_rounds(list(standings.round_points)) for standings in hub.loaded()])
+
+
+@receiver(post_save, sender=BracketMatch)
+@receiver(post_delete, sender=BracketMatch)
+def publish_match_change(sender, instance, **kwargs):
+    """
+    Update the watched tournaments when a match is moved to another round, or deleted.
+    """
+    after_commit(lambda: [standings.update_matches() for standings in hub.loaded()])
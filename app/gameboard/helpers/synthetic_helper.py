@@ -0,0 +1,204 @@
+import itertools
+import math
+import random
+import secrets
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from gameboard.helpers.membership_helper import forget_memberships
+from gameboard.models import Game, Group, Player, PlayerRank, Round
+
+
+class SyntheticData:
+    """
+    Generates a realistic looking (but entirely made up) dataset, at whatever scale is needed to measure performance.
+
+    Every player is given a hidden skill, and every game a amount of luck. The ranks of a round come from sorting the
+    players' skill plus some luck based noise, so better players win more often, but not every time. Popular games and
+    active players are picked more often than others, and a small amount of rounds have players that did not finish.
+    Everything is written with bulk inserts, in batches that each have their own transaction.
+    """
+    # Fraction of player ranks that are a did not finish (null rank)
+    dnf_rate = 0.02
+    # Fraction of games which keep track of scores
+    scored_game_rate = 0.5
+
+    def __init__(self, groups=1, players=20, games=50, years=3, rounds_per_day=3.0, batch_size=5000, seed=None,
+                 prefix=None, log=None):
+        """
+        :param groups: The number of groups to create.
+        :param players: The number of players in each group.
+        :param games: The number of games (shared by all groups).
+        :param years: How many years of history to create, ending today.
+        :param rounds_per_day: The average number of rounds each group plays a day.
+        :param batch_size: How many rounds to insert per transaction.
+        :param seed: A seed for the random generator, for a repeatable dataset.
+        :param prefix: Put at the start of all usernames and group names, defaults to a random string so that
+                       generating more data never collides with previous runs.
+        :param log: A function to call with progress messages.
+        """
+        self.groups = groups
+        self.players = players
+        self.games = games
+        self.years = years
+        self.rounds_per_day = rounds_per_day
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.prefix = prefix if prefix is not None else 'synthetic-{}'.format(secrets.token_hex(3))
+        self.log = log if log else (lambda message: None)
+
+    def generate(self):
+        """
+        Create all of the data.
+
+        :return: A dictionary containing the number of rows created for each model.
+        """
+        counts = {'groups': 0, 'players': 0, 'games': 0, 'rounds': 0, 'player_ranks': 0}
+
+        games = self.create_games()
+        counts['games'] = len(games)
+        for group_number in range(self.groups):
+            group, players = self.create_group(group_number)
+            counts['groups'] += 1
+            counts['players'] += len(players)
+            rounds, ranks = self.create_rounds(group, players, games)
+            counts['rounds'] += rounds
+            counts['player_ranks'] += ranks
+            self.log("Group {} done: {} rounds, {} player ranks".format(group.name, rounds, ranks))
+        return counts
+
+    def create_games(self):
+        """
+        Creates the games, re-using any with the same name from a previous run.
+
+        :return: A list of (game id, minimum players, maximum players, luck, scored, popularity) tuples.
+        """
+        names = ['Synthetic Game {}'.format(number) for number in range(1, self.games + 1)]
+        existing = set(Game.objects.filter(name__in=names).values_list('name', flat=True))
+        Game.objects.bulk_create([
+            Game(name=name, description='Generated for performance testing') for name in names if name not in existing
+        ])
+
+        games = []
+        for rank, (name, pk) in enumerate(Game.objects.filter(name__in=names).order_by('pk').values_list('name', 'pk')):
+            min_players = self.random.choice([1, 2, 2, 3])
+            max_players = min_players + self.random.choice([0, 1, 2, 3, 4])
+            games.append((
+                pk,
+                min_players,
+                max_players,
+                self.random.uniform(0.3, 2.0),
+                self.random.random() < self.scored_game_rate,
+                # Zipf like popularity, a few games are played far more than the rest
+                1.0 / (rank + 1),
+            ))
+        return games
+
+    def create_group(self, group_number):
+        """
+        Creates a group and all of its players.
+
+        :param group_number: Which group this is, used for naming.
+        :return: The group, and a list of (player id, skill, activity) tuples.
+        """
+        group = Group.objects.create(name='{} group {}'.format(self.prefix, group_number + 1))
+        password = make_password('password')
+        players = Player.objects.bulk_create([
+            Player(
+                username='{}-{}-{}'.format(self.prefix, group_number + 1, number + 1),
+                first_name='Player {}'.format(number + 1),
+                password=password,
+                date_of_birth=date(2000, 1, 1),
+                primary_group=group,
+            ) for number in range(self.players)
+        ], batch_size=self.batch_size)
+        # bulk_create skips the post_save signal which would normally make these
+        Token.objects.bulk_create([Token(user=player, key=Token.generate_key()) for player in players])
+
+        Group.players.through.objects.bulk_create([
+            Group.players.through(group_id=group.pk, player_id=player.pk) for player in players
+        ])
+        Group.admins.through.objects.bulk_create([Group.admins.through(group_id=group.pk, player_id=players[0].pk)])
+        # bulk_create skips the m2m_changed signal which would normally clear these
+        forget_memberships([player.pk for player in players])
+
+        return group, [(player.pk, self.random.gauss(0, 1), self.random.paretovariate(1.5)) for player in players]
+
+    def create_rounds(self, group, players, games):
+        """
+        Creates the group's history of rounds, along with the rank of every player in them.
+
+        :param group: The group playing the rounds.
+        :param players: The group's players, as given by create_group.
+        :param games: All the games, as given by create_games.
+        :return: The number of rounds, and the number of player ranks created.
+        """
+        days = int(self.years * 365)
+        total_rounds = int(days * self.rounds_per_day)
+        first_day = date.today() - timedelta(days=days)
+        game_weights = list(itertools.accumulate(game[5] for game in games))
+        player_weights = list(itertools.accumulate(player[2] for player in players))
+
+        rounds_created = 0
+        ranks_created = 0
+        while rounds_created < total_rounds:
+            batch = []
+            for _ in range(min(self.batch_size, total_rounds - rounds_created)):
+                game = self.random.choices(games, cum_weights=game_weights)[0]
+                played_on = first_day + timedelta(days=self.random.randrange(days))
+                batch.append((game, played_on, self.pick_players(players, player_weights, game)))
+
+            with transaction.atomic():
+                rounds = Round.objects.bulk_create([
+                    Round(game_id=game[0], date=played_on, group=group) for game, played_on, playing in batch
+                ])
+                ranks = []
+                for (game, played_on, playing), game_round in zip(batch, rounds):
+                    for player_rank in self.rank_players(game, playing):
+                        ranks.append((game_round.pk, player_rank))
+                PlayerRank.objects.bulk_create([player_rank for round_id, player_rank in ranks])
+                Round.players.through.objects.bulk_create([
+                    Round.players.through(round_id=round_id, playerrank_id=player_rank.pk)
+                    for round_id, player_rank in ranks
+                ])
+
+            rounds_created += len(rounds)
+            ranks_created += len(ranks)
+            self.log("{}: {}/{} rounds".format(group.name, rounds_created, total_rounds))
+        return rounds_created, ranks_created
+
+    def pick_players(self, players, player_weights, game):
+        """
+        Pick who played a round, more active players being more likely to be picked.
+
+        :return: A list of the (player id, skill, activity) tuples of the players in the round.
+        """
+        count = min(len(players), self.random.randint(game[1], game[2]))
+        playing = {}
+        while len(playing) < count:
+            player = self.random.choices(players, cum_weights=player_weights)[0]
+            playing[player[0]] = player
+        return list(playing.values())
+
+    def rank_players(self, game, playing):
+        """
+        Rank the players of a round by their skill plus some luck. Solo games are either won or lost.
+
+        :return: A list of unsaved PlayerRanks.
+        """
+        luck = game[3]
+        performances = sorted(
+            ((player[1] + self.random.gauss(0, luck), player[0]) for player in playing),
+            reverse=True,
+        )
+        ranks = []
+        for place, (performance, player_id) in enumerate(performances, start=1):
+            if len(performances) == 1 and performance <= 0:
+                place = None  # Solo games are either won, or not placed at all
+            rank = None if self.random.random() < self.dnf_rate else place
+            score = max(0, int(math.floor(50 + performance * 15))) if game[4] and rank is not None else None
+            ranks.append(PlayerRank(player_id=player_id, rank=rank, score=score))
+        return ranks
@@ -0,0 +1,184 @@
+import bisect
+import random
+import re
+
+from django.db import transaction
+
+from gameboard.helpers.bracket_helper import BracketError, is_finalized
+from gameboard.models import Bracket, Team
+from gameboard.queries.find import find_team_strengths
+
+COLOR_PATTERN = re.compile(r'^[0-9A-Fa-f]{6}$')
+
+
+class TeamError(Exception):
+    """
+    Raised when teams can't be made, because they are incomplete or hold players who can't join them.
+    """
+    pass
+
+
+def balance_teams(strengths, team_count, max_passes=None):
+    """
+    Split players into teams whose total strengths are as even as possible, with team sizes differing by at most one.
+
+    Players are first dealt out strongest first, each to the weakest team which still has room. Then the strongest
+    and weakest teams repeatedly swap the pair of players which brings their totals closest together, until no swap
+    helps. Both steps are quick enough for pools of hundreds of players.
+
+    :param strengths: A dictionary of player id to their strength.
+    :param team_count: How many teams to make.
+    :param max_passes: The most swaps to try, defaults to the number of players.
+    :return: A list of teams, each a list of player ids, strongest player first.
+    """
+    if team_count < 1:
+        raise ValueError("There must be at least one team")
+    players = sorted(strengths, key=lambda player: (-strengths[player], player))
+    small_size, large_teams = divmod(len(players), team_count)
+
+    teams = [[] for _ in range(team_count)]
+    totals = [0.0] * team_count
+    for player in players:
+        full_large = sum(1 for team in teams if len(team) > small_size)
+        open_teams = [index for index, team in enumerate(teams)
+                      if len(team) < small_size or (len(team) == small_size and full_large < large_teams)]
+        index = min(open_teams, key=lambda index: (totals[index], len(teams[index])))
+        teams[index].append(player)
+        totals[index] += strengths[player]
+
+    for _ in range(max_passes if max_passes is not None else len(players)):
+        strongest = max(range(team_count), key=lambda index: totals[index])
+        weakest = min(range(team_count), key=lambda index: totals[index])
+        if not improve(teams[strongest], teams[weakest], strengths):
+            break
+        totals[strongest] = sum(strengths[player] for player in teams[strongest])
+        totals[weakest] = sum(strengths[player] for player in teams[weakest])
+
+    return [sorted(team, key=lambda player: (-strengths[player], player)) for team in teams]
+
+
+def improve(strong, weak, strengths):
+    """
+    Swap the pair of players between two teams which brings their totals closest together.
+
+    :param strong: The player ids of the team with the higher total (changed in place).
+    :param weak: The player ids of the team with the lower total (changed in place).
+    :param strengths: A dictionary of player id to their strength.
+    :return: Whether a swap was made.
+    """
+    gap = sum(strengths[player] for player in strong) - sum(strengths[player] for player in weak)
+    weak_by_strength = sorted(weak, key=lambda player: strengths[player])
+    weak_strengths = [strengths[player] for player in weak_by_strength]
+
+    best = None
+    for strong_index, player in enumerate(strong):
+        # The ideal partner is weaker by half the gap, so look either side of that
+        target = strengths[player] - gap / 2
+        position = bisect.bisect_left(weak_strengths, target)
+        for weak_index in (position - 1, position):
+            if 0 <= weak_index < len(weak_strengths):
+                difference = strengths[player] - weak_strengths[weak_index]
+                new_gap = abs(gap - 2 * difference)
+                if 0 < difference and new_gap < gap - 1e-9 and (best is None or new_gap < best[0]):
+                    best = (new_gap, strong_index, weak.index(weak_by_strength[weak_index]))
+    if best is None:
+        return False
+    new_gap, strong_index, weak_index = best
+    strong[strong_index], weak[weak_index] = weak[weak_index], strong[strong_index]
+    return True
+
+
+def random_color():
+    return ''.join(random.choice('ABCDEF0123456789') for _ in range(6))
+
+
+def create_teams(tournament, teams):
+    """
+    Create several teams for a tournament at once, in a single transaction. Every player is checked against the
+    tournament's group, and the teams it already has, in one query each, and each team's players are added together
+    with one insert.
+
+    :param tournament: The tournament to add the teams to.
+    :param teams: A list of dictionaries, each with a 'name', 'playerIds', and optionally a 'color' (a random one is
+                  picked otherwise).
+    :return: A list of the new teams, in the order given.
+    """
+    if not teams:
+        raise TeamError("Please enter at least one team")
+    names = set()
+    seen = set()
+    team_players = []
+    for number, team in enumerate(teams, start=1):
+        name = team.get('name') if isinstance(team, dict) else None
+        if not isinstance(name, str) or not name.strip() or len(name) > Team._meta.get_field('name').max_length:
+            raise TeamError("Team {} needs a name of at most {} characters".format(
+                number, Team._meta.get_field('name').max_length,
+            ))
+        if name in names:
+            raise TeamError("There is more than one team named '{}'".format(name))
+        names.add(name)
+        if team.get('color') is not None and not COLOR_PATTERN.match(str(team['color'])):
+            raise TeamError("{}'s color must be six hex digits".format(name))
+        player_ids = team.get('playerIds')
+        if not isinstance(player_ids, list) or not player_ids:
+            raise TeamError("{} needs at least one player".format(name))
+        try:
+            player_ids = {int(player_id) for player_id in player_ids}
+        except (TypeError, ValueError):
+            raise TeamError("{} has an invalid player id".format(name))
+        if seen & player_ids:
+            raise TeamError("A player can only be on one team")
+        seen |= player_ids
+        team_players.append(player_ids)
+
+    members = set(tournament.group.players.filter(id__in=seen).values_list('id', flat=True))
+    if members != seen:
+        raise TeamError("Players {} aren't in the tournament's group".format(sorted(seen - members)))
+
+    with transaction.atomic():
+        # Locked like every other change to the bracket, so it can't be finalized meanwhile
+        bracket = Bracket.objects.select_for_update().get(pk=tournament.bracket_id)
+        if is_finalized(bracket):
+            raise TeamError("Teams can't be added once the tournament has been finalized")
+        taken = set(Team.players.through.objects.filter(
+            team__teams=tournament.bracket_id, player_id__in=seen,
+        ).values_list('player_id', flat=True))
+        if taken:
+            raise TeamError("Players {} are already on a team in this tournament".format(sorted(taken)))
+        if Team.objects.filter(teams=tournament.bracket_id, name__in=names).exists():
+            raise TeamError("The tournament already has a team with one of those names")
+
+        created = Team.objects.bulk_create([
+            Team(name=team['name'], color=team.get('color') or random_color()) for team in teams
+        ])
+        Team.players.through.objects.bulk_create([
+            Team.players.through(team_id=team.pk, player_id=player_id)
+            for team, player_ids in zip(created, team_players) for player_id in sorted(player_ids)
+        ])
+        # Added through the bracket, so its layout and any live standings are updated
+        tournament.bracket.teams.add(*created)
+    return created
+
+
+def seed_bracket(bracket):
+    """
+    Seed a bracket's teams by strength (see find_team_strengths), strongest first, and save the order on the bracket
+    so its layout keeps the strongest teams apart for as long as possible. Seeds can only change before any matches
+    are added, as they decide who plays whom.
+
+    :param bracket: The bracket.
+    :return: A list of (team id, strength) tuples, in seeded order.
+    """
+    with transaction.atomic():
+        bracket = Bracket.objects.select_for_update().get(pk=bracket.pk)
+        if is_finalized(bracket):
+            raise BracketError("Teams can't be seeded once the tournament has been finalized")
+        if bracket.matches.exists():
+            raise BracketError("Teams can't be seeded once a bracket has matches")
+        strengths = find_team_strengths(list(bracket.teams.values_list('pk', flat=True)))
+        seeds = sorted(strengths, key=lambda team: (-strengths[team], team))
+        bracket.seeds = seeds
+        # The layout is rebuilt in seeded order the next time it is needed
+        bracket.layout = None
+        bracket.save(update_fields=['seeds', 'layout', 'updated_at'])
+    return [(team, strengths[team]) for team in seeds]
@@ -0,0 +1,82 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+
+from gameboard.helpers.benchmark_helper import Benchmark, BENCHMARK_SIZES, compare, load_results
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the query layer and api endpoints against seeded test databases of several sizes, and writes " \
+           "the wall time, query count and peak memory of each case as json."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='small,medium',
+                            help="Comma separated dataset sizes, from: {}".format(', '.join(BENCHMARK_SIZES)))
+        parser.add_argument('--repeat', type=int, default=3, help="How many times each case is timed")
+        parser.add_argument('--seed', type=int, default=1, help="Seed for the synthetic datasets")
+        parser.add_argument('--output', default='benchmark.json', help="Where to write the results")
+        parser.add_argument('--compare', default=None, help="Results of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()]
+        for size in sizes:
+            if size not in BENCHMARK_SIZES:
+                self.stderr.write("Unknown size '{}'".format(size))
+                return
+
+        # Never seed the real database, everything is run against a throwaway test database
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = Benchmark(
+                sizes=sizes,
+                repeat=options['repeat'],
+                seed=options['seed'],
+                log=lambda message: self.stdout.write(message) if options['verbosity'] > 1 else None,
+            ).run()
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], mode='w') as f:
+            json.dump(results, f, indent=2)
+
+        if options['compare']:
+            self.write_comparison(compare(load_results(options['compare']), results))
+        else:
+            self.write_results(results)
+        self.stdout.write(self.style.SUCCESS("Results written to {}".format(options['output'])))
+
+    def write_results(self, results):
+        self.stdout.write("{:<8} {:<28} {:>12} {:>8} {:>12}".format('size', 'case', 'time (ms)', 'queries', 'peak (kb)'))
+        for result in results['results']:
+            if 'error' in result:
+                self.stdout.write("{:<8} {:<28} {}".format(result['size'], result['case'], result['error']))
+            elif 'rows_per_second' in result:
+                self.stdout.write("{:<8} {:<28} {:>12} {:>8} {:>12}  {} rows, {} rows a second".format(
+                    result['size'], result['case'], result['wall_time_ms'], result['queries'], '-',
+                    result['rows'], result['rows_per_second'],
+                ))
+            else:
+                self.stdout.write("{:<8} {:<28} {:>12} {:>8} {:>12}".format(
+                    result['size'], result['case'], result['wall_time_ms'], result['queries'],
+                    result['peak_memory_kb'],
+                ))
+
+    def write_comparison(self, rows):
+        self.stdout.write("{:<8} {:<28} {:>22} {:>14} {:>22}".format(
+            'size', 'case', 'time (ms)', 'queries', 'peak (kb)'
+        ))
+        for row in rows:
+            columns = []
+            for key in ['wall_time_ms', 'queries', 'peak_memory_kb']:
+                old, new = row[key]
+                if old is None or new is None:
+                    columns.append('-')
+                elif old == 0:
+                    columns.append('{} -> {}'.format(old, new))
+                else:
+                    columns.append('{} -> {} ({:+.0f}%)'.format(old, new, (new - old) / old * 100))
+            self.stdout.write("{:<8} {:<28} {:>22} {:>14} {:>22}".format(row['size'], row['case'], *columns))
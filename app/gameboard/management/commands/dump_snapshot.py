@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gameboard.helpers.snapshot_helper import dump_snapshot, BLOCK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Writes every gameboard table to a compact binary snapshot, which restore_snapshot can load."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Where to write the snapshot")
+        parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="Rows held in memory at once")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with open(options['path'], mode='wb') as f:
+            counts = dump_snapshot(f, block_size=options['block_size'])
+            size = f.tell()
+
+        if options['verbosity'] > 1:
+            for table, count in counts.items():
+                self.stdout.write("{}: {} rows".format(table, count))
+        self.stdout.write(self.style.SUCCESS("Wrote {} rows ({:.1f} MB) in {:.1f}s".format(
+            sum(counts.values()), size / 1024 / 1024, time.perf_counter() - start,
+        )))
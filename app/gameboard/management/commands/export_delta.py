@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from gameboard.helpers.delta_helper import export_delta
+from gameboard.models import Group
+
+
+class Command(BaseCommand):
+    help = "Exports everything in a group which changed since a watermark, as json which import_delta can replay."
+
+    def add_arguments(self, parser):
+        parser.add_argument('group', type=int, help="The id of the group to export")
+        parser.add_argument('--since', help="The watermark of the last delta, leave out to export everything")
+        parser.add_argument('--output', help="Where to write the delta, defaults to standard out")
+
+    def handle(self, *args, **options):
+        group = Group.objects.filter(pk=options['group']).first()
+        if group is None:
+            raise CommandError("There is no group with the id {}".format(options['group']))
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError("'{}' is not a valid timestamp".format(options['since']))
+
+        delta = export_delta(group, since)
+        if options['output']:
+            with open(options['output'], mode='w') as f:
+                json.dump(delta, f)
+            self.stdout.write(self.style.SUCCESS(
+                "Exported {} rounds, {} deletions. Next watermark: {}".format(
+                    len(delta['rounds']), sum(len(ids) for ids in delta['deleted'].values()), delta['watermark'],
+                )
+            ))
+        else:
+            self.stdout.write(json.dumps(delta))
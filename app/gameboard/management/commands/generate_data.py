@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gameboard.helpers.synthetic_helper import SyntheticData
+
+
+class Command(BaseCommand):
+    help = "Generates a synthetic dataset (groups, players, games, and years of rounds) for performance testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', type=int, default=1, help="Number of groups to create")
+        parser.add_argument('--players', type=int, default=20, help="Number of players in each group")
+        parser.add_argument('--games', type=int, default=50, help="Number of games, shared by all groups")
+        parser.add_argument('--years', type=float, default=3, help="Years of history for each group")
+        parser.add_argument('--rounds-per-day', type=float, default=3.0,
+                            help="Average number of rounds a group plays each day")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rounds inserted per transaction")
+        parser.add_argument('--seed', type=int, default=None, help="Seed for a repeatable dataset")
+        parser.add_argument('--prefix', default=None, help="Prefix for usernames and group names")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = SyntheticData(
+            groups=options['groups'],
+            players=options['players'],
+            games=options['games'],
+            years=options['years'],
+            rounds_per_day=options['rounds_per_day'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+            log=lambda message: self.stdout.write(message) if options['verbosity'] > 1 else None,
+        ).generate()
+        duration = time.perf_counter() - start
+
+        rows = counts['rounds'] + counts['player_ranks']
+        self.stdout.write(self.style.SUCCESS(
+            "Created {groups} groups, {players} players, {games} games, {rounds} rounds and {player_ranks} player "
+            "ranks".format(**counts)
+        ))
+        self.stdout.write("Took {:.1f}s ({:.0f} rounds and ranks a second)".format(duration, rows / max(duration, 1e-9)))
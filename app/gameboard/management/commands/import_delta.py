@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gameboard.helpers.delta_helper import DeltaError, apply_delta
+from gameboard.management.commands.import_scores import get_group
+
+
+class Command(BaseCommand):
+    help = "Replays a delta written by export_delta into a group, which must already exist."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The delta to replay")
+        parser.add_argument('--group', required=True, help="The id or name of the group to replay into")
+
+    def handle(self, *args, **options):
+        group = get_group(options['group'])
+        with open(options['path']) as f:
+            delta = json.load(f)
+
+        try:
+            stats = apply_delta(group, delta, claim_players=True)
+        except DeltaError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            "Replayed {rounds} rounds, {player_ranks} player ranks, {teams} teams, {brackets} brackets, "
+            "{tournaments} tournaments, and {deleted} deletions".format(**stats)
+        ))
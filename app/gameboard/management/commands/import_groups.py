@@ -0,0 +1,53 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from gameboard.helpers.parallel_import_helper import ParallelImportScores
+from gameboard.management.commands.import_scores import get_or_create_group
+
+
+class Command(BaseCommand):
+    help = "Imports many score csvs at once, each into its own group (creating any groups which don't exist)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('imports', nargs='+', metavar='PATH[=GROUP]',
+                            help="A score csv, and the id or name of the group to import it into. The group defaults "
+                                 "to the file's name")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Processes parsing files")
+        parser.add_argument('--writers', type=int, default=2, help="Files loaded into the database at once")
+        parser.add_argument('--format-version', type=int, default=2,
+                            help="Version of the csv format, 1 has no score columns")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rounds written per transaction")
+        parser.add_argument('--skip-existing', action='store_true',
+                            help="Only import rounds each group doesn't already have")
+
+    def handle(self, *args, **options):
+        imports = []
+        for argument in options['imports']:
+            path, _, group = argument.rpartition('=') if '=' in argument else (argument, '', '')
+            if not os.path.isfile(path):
+                raise CommandError("There is no file at {}".format(path))
+            imports.append((path, get_or_create_group(group or os.path.splitext(os.path.basename(path))[0])))
+
+        writers = options['writers']
+        if connection.vendor == 'sqlite' and writers > 1:
+            # SQLite locks the whole database for every write, so more writers only wait on each other
+            self.stderr.write("SQLite only allows one writer at a time, using one writer")
+            writers = 1
+
+        results = ParallelImportScores(
+            imports, version=options['format_version'], chunk_size=options['chunk_size'],
+            skip_existing=options['skip_existing'], workers=options['workers'], writers=writers,
+            log=self.stdout.write if options['verbosity'] > 1 else None, claim_players=True,
+        ).run()
+
+        for result in results:
+            if 'rounds' not in result:
+                self.stderr.write("{path} was not imported: {error}".format(**result))
+                continue
+            for line, message in result['errors']:
+                self.stderr.write("{} line {}: {}".format(result['path'], line, message))
+            self.stdout.write(self.style.SUCCESS(
+                "Imported {rounds} rounds into {group} from {path}, skipped {skipped} existing rounds".format(**result)
+            ))
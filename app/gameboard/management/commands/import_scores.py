@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gameboard.helpers.import_helper import BulkImportScores
+from gameboard.models import Group
+
+
+class Command(BaseCommand):
+    help = "Imports a score csv into a group, creating the group if it doesn't exist."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The score csv to import")
+        parser.add_argument('--group', required=True, help="The id or name of the group to import into")
+        parser.add_argument('--format-version', type=int, default=2,
+                            help="Version of the csv format, 1 has no score columns")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rounds written per transaction")
+        parser.add_argument('--skip-existing', action='store_true',
+                            help="Only import rounds the group doesn't already have, so a file can be imported again")
+
+    def handle(self, *args, **options):
+        group = get_or_create_group(options['group'])
+
+        def progress(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write("{rows} rows, {rounds} rounds ({rows_per_second:.0f} rows a second)".format(**stats))
+
+        stats = BulkImportScores(
+            group, version=options['format_version'], chunk_size=options['chunk_size'],
+            skip_existing=options['skip_existing'], progress=progress, claim_players=True,
+        ).import_file(options['path'])
+
+        for line, message in stats['errors']:
+            self.stderr.write("Line {}: {}".format(line, message))
+        self.stdout.write(self.style.SUCCESS(
+            "Imported {rounds} rounds and {player_ranks} player ranks from {rows} rows in {seconds:.1f}s "
+            "({rows_per_second:.0f} rows a second), skipped {skipped} existing rounds".format(**stats)
+        ))
+
+
+def get_group(identifier):
+    """
+    Find a group by its id or name.
+
+    :param identifier: A group id, or name.
+    :return: The group.
+    """
+    group = Group.objects.filter(pk=int(identifier)).first() if identifier.isdigit() else \
+        Group.objects.filter(name=identifier).first()
+    if group is None:
+        raise CommandError("There is no group {}".format(identifier))
+    return group
+
+
+def get_or_create_group(identifier):
+    """
+    Find a group by its id or name, creating a group with that name if there isn't one.
+
+    :param identifier: A group id, or name.
+    :return: The group.
+    """
+    if identifier.isdigit():
+        group = Group.objects.filter(pk=int(identifier)).first()
+        if group is None:
+            raise CommandError("There is no group with the id {}".format(identifier))
+        return group
+    group = Group.objects.filter(name=identifier).first()
+    return group if group else Group.objects.create(name=identifier)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from gameboard.helpers.pivot_helper import PivotScores
+
+
+class Command(BaseCommand):
+    help = "Converts a wide score csv (a line per player) into the score csv format (a line per round) for importing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="The wide csv to convert")
+        parser.add_argument('destination', help="Where to write the converted csv")
+        parser.add_argument('--run-size', type=int, default=100000,
+                            help="Cells held in memory at once, before being sorted and written to a temporary file")
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write("{cells} cells in {runs} runs ({cells_per_second:.0f} cells a second)".format(**stats))
+
+        stats = PivotScores(run_size=options['run_size'], progress=progress).pivot_file(
+            options['source'], options['destination'],
+        )
+
+        for line, message in stats['errors']:
+            self.stderr.write("Line {}: {}".format(line, message))
+        self.stdout.write(self.style.SUCCESS(
+            "Converted {cells} cells from {players} players into {rounds} rounds in {seconds:.1f}s "
+            "({cells_per_second:.0f} cells a second)".format(**stats)
+        ))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from gameboard.helpers.snapshot_helper import restore_snapshot, SnapshotError
+
+
+class Command(BaseCommand):
+    help = "Restores a snapshot written by dump_snapshot into an empty database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The snapshot to restore")
+        parser.add_argument('--flush', action='store_true',
+                            help="Delete everything in the database first (this can't be undone!)")
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+
+        start = time.perf_counter()
+        try:
+            with open(options['path'], mode='rb') as f:
+                counts = restore_snapshot(f)
+        except SnapshotError as e:
+            raise CommandError(str(e))
+
+        if options['verbosity'] > 1:
+            for table, count in counts.items():
+                self.stdout.write("{}: {} rows".format(table, count))
+        self.stdout.write(self.style.SUCCESS("Restored {} rows in {:.1f}s".format(
+            sum(counts.values()), time.perf_counter() - start,
+        )))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gameboard.helpers.import_helper import wipe_group
+from gameboard.models import Group
+
+
+class Command(BaseCommand):
+    help = "Deletes all of a group's rounds, player ranks, and bracket matches, leaving every other group untouched."
+
+    def add_arguments(self, parser):
+        parser.add_argument('group', type=int, help="The id of the group to wipe")
+
+    def handle(self, *args, **options):
+        group = Group.objects.filter(pk=options['group']).first()
+        if group is None:
+            raise CommandError("There is no group with the id {}".format(options['group']))
+
+        deleted = wipe_group(group)
+        self.stdout.write(self.style.SUCCESS("Wiped {}: {}".format(
+            group.name, ', '.join('{} {}'.format(count, table.replace('_', ' ')) for table, count in deleted.items())
+        )))
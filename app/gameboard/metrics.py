@@ -0,0 +1,243 @@
+"""
+Metrics
+
+Per route request metrics (latency histograms, request, error, and query counts). Each worker process keeps its own
+numbers in memory and regularly writes them to METRICS_DIR, so that whichever worker answers /metrics can add up the
+numbers from every process. The files of workers which have exited are removed as the numbers are added up, so each
+host needs its own METRICS_DIR (process ids mean nothing across hosts or containers). A counter drops when its
+worker's file is removed, which Prometheus treats as a counter reset.
+
+/metrics is only served to staff, or to scrapers sending METRICS_TOKEN as a bearer token.
+"""
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from gameboard.profiling import get_profiling_user
+
+# Upper bounds (in seconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Route used for requests which never matched a url
+UNRESOLVED_ROUTE = 'unresolved'
+
+METRICS_PREFIX = 'metrics-'
+METRICS_SUFFIX = '.json'
+
+
+def process_alive(pid):
+    """
+    :param pid: A process id.
+    :return: Whether a process with the id is running on this host.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but as another user
+        return True
+    return True
+
+
+def metrics_allowed(request):
+    """
+    Check whether a request may read the metrics: either it sends METRICS_TOKEN as a bearer token, or it comes from a
+    staff member (by session or JWT, as with profiling).
+
+    :param request: A html request.
+    :return: True if the metrics can be shown.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer {}'.format(token)):
+        return True
+    user = get_profiling_user(request)
+    return user is not None and user.is_staff
+
+
+def empty_route_metrics():
+    """
+    The starting numbers for a route which hasn't been requested yet.
+
+    :return: A dictionary of all tracked values, set to zero.
+    """
+    return {
+        'requests': 0,
+        'errors': 0,
+        'db_queries': 0,
+        'duration_sum': 0.0,
+        'buckets': [0] * len(HISTOGRAM_BUCKETS),
+    }
+
+
+def merge_route_metrics(total, other):
+    """
+    Add the numbers of one route's metrics into another.
+
+    :param total: The route metrics to add to (changed in place).
+    :param other: The route metrics to add.
+    :return: The total
+    """
+    for key in ['requests', 'errors', 'db_queries', 'duration_sum']:
+        total[key] += other[key]
+    total['buckets'] = [a + b for a, b in zip(total['buckets'], other['buckets'])]
+    return total
+
+
+class MetricsStore:
+    """
+    The metrics for this process, with the ability to write them to (and read every process' metrics from) the shared
+    metrics directory.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.last_flush = 0.0
+
+    @property
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'gameboard-metrics'))
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, '{}{}{}'.format(METRICS_PREFIX, os.getpid(), METRICS_SUFFIX))
+
+    def observe(self, route, duration, status_code, db_queries=0):
+        """
+        Record a single finished request.
+
+        :param route: The url name the request resolved to.
+        :param duration: How long the request took, in seconds.
+        :param status_code: The status code of the response.
+        :param db_queries: How many queries the request ran.
+        :return: None
+        """
+        with self.lock:
+            metrics = self.routes.setdefault(route, empty_route_metrics())
+            metrics['requests'] += 1
+            metrics['errors'] += 1 if status_code >= 500 else 0
+            metrics['db_queries'] += db_queries
+            metrics['duration_sum'] += duration
+            for index, bound in enumerate(HISTOGRAM_BUCKETS):
+                if duration <= bound:
+                    metrics['buckets'][index] += 1
+                    break
+
+        if time.monotonic() - self.last_flush > getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+            self.flush()
+
+    def flush(self):
+        """
+        Write this process' metrics to the metrics directory. The file is replaced atomically, so readers never see
+        half of a write.
+
+        :return: None
+        """
+        with self.lock:
+            data = json.dumps(self.routes)
+            self.last_flush = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(self.path, threading.get_ident())
+        with open(temp_path, mode='w') as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
+
+    def collect(self):
+        """
+        Add up the metrics of every running process that has written to the metrics directory, removing the files of
+        processes which have exited.
+
+        :return: A dictionary of route name to route metrics.
+        """
+        self.flush()
+        totals = {}
+        for name in os.listdir(self.directory):
+            if not (name.startswith(METRICS_PREFIX) and name.endswith(METRICS_SUFFIX)):
+                continue
+            try:
+                pid = int(name[len(METRICS_PREFIX):-len(METRICS_SUFFIX)])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not process_alive(pid):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    # Another worker removed it first
+                    pass
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    routes = json.load(f)
+            except (OSError, ValueError):
+                # The process may have been mid-rotation, or the file is not ours, either way skip it
+                continue
+            for route, metrics in routes.items():
+                merge_route_metrics(totals.setdefault(route, empty_route_metrics()), metrics)
+        return totals
+
+
+store = MetricsStore()
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(routes):
+    """
+    Render route metrics in the Prometheus text exposition format.
+
+    :param routes: A dictionary of route name to route metrics, as returned by MetricsStore.collect()
+    :return: The metrics as a string.
+    """
+    lines = [
+        '# HELP gameboard_request_duration_seconds Time taken to respond to requests, by route.',
+        '# TYPE gameboard_request_duration_seconds histogram',
+    ]
+    for route in sorted(routes):
+        metrics = routes[route]
+        label = 'route="{}"'.format(escape_label(route))
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, metrics['buckets']):
+            cumulative += count
+            lines.append('gameboard_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(label, bound, cumulative))
+        lines.append('gameboard_request_duration_seconds_bucket{{{},le="+Inf"}} {}'.format(label, metrics['requests']))
+        lines.append('gameboard_request_duration_seconds_sum{{{}}} {}'.format(label, metrics['duration_sum']))
+        lines.append('gameboard_request_duration_seconds_count{{{}}} {}'.format(label, metrics['requests']))
+
+    counters = [
+        ('gameboard_requests_total', 'requests', 'Number of requests, by route.'),
+        ('gameboard_request_errors_total', 'errors', 'Number of requests which failed with a 5xx status, by route.'),
+        ('gameboard_db_queries_total', 'db_queries', 'Number of database queries run, by route.'),
+    ]
+    for name, key, description in counters:
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} counter'.format(name))
+        for route in sorted(routes):
+            lines.append('{}{{route="{}"}} {}'.format(name, escape_label(route), routes[route][key]))
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """
+    Times every request and records it against the url name it resolved to. This should come before
+    QueryBudgetMiddleware in MIDDLEWARE, so the query count of the request is known when it finishes.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.url_name if resolver_match and resolver_match.url_name else UNRESOLVED_ROUTE
+        store.observe(route, duration, response.status_code, getattr(request, 'db_queries', 0))
+        return response
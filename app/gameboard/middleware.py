@@ -0,0 +1,125 @@
+"""
+Middleware
+
+Request wide hooks which watch how the rest of the app behaves, without changing what the views return.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Collapses "IN (%s, %s, %s)" style placeholder lists, so the same query over a different number of ids has one shape
+PLACEHOLDER_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+# Collapses bare numbers and quoted strings, for raw sql which was not parametrized
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised when a route runs more queries than its budget allows, and QUERY_BUDGET_RAISE is turned on.
+    """
+    pass
+
+
+def normalize_sql(sql):
+    """
+    Reduce a sql statement to its shape, so that the same query run with different parameters is counted together.
+
+    :param sql: The sql statement as given to the database cursor.
+    :return: A string representing the statement with all of its values removed.
+    """
+    sql = PLACEHOLDER_LIST.sub('(%s...)', sql)
+    return LITERALS.sub('?', sql)
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper which counts every query, the time spent running them, and how often each shape of query
+    was repeated.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[normalize_sql(sql)] += 1
+
+    def repeated(self, threshold):
+        """
+        Find all query shapes that were run at least threshold times, which almost always means an N+1 loop.
+
+        :param threshold: The number of identical query shapes before they are flagged.
+        :return: A list of (sql shape, count) tuples, the most repeated first.
+        """
+        return [(sql, count) for sql, count in self.shapes.most_common() if count >= threshold]
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the queries and database time of every request, and reports them back in the X-DB-Queries and X-DB-Time
+    headers. Routes can be given a query budget through QUERY_BUDGETS (keyed on url name), with QUERY_BUDGET_DEFAULT
+    used for every other route. Going over budget, or repeating one query shape QUERY_REPEAT_THRESHOLD times, logs a
+    warning, or raises QueryBudgetExceeded when QUERY_BUDGET_RAISE is set (so tests can fail on N+1 queries).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        # Let any other middleware (such as metrics) use what was recorded
+        request.db_queries = recorder.count
+        request.db_time = recorder.duration
+
+        response['X-DB-Queries'] = str(recorder.count)
+        response['X-DB-Time'] = '{0:.2f}ms'.format(recorder.duration * 1000)
+
+        self.check_budget(request, recorder)
+        return response
+
+    @staticmethod
+    def check_budget(request, recorder):
+        """
+        Compare what a request did against its configured budget, and warn (or raise) if it did too much.
+
+        :param request: The finished request, which has been resolved to a route.
+        :param recorder: The QueryRecorder which watched the request.
+        :return: None
+        """
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.url_name if resolver_match else None
+        if route is None:
+            return
+
+        problems = []
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(route, getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+        if budget is not None and recorder.count > budget:
+            problems.append("{} queries run, budget is {}".format(recorder.count, budget))
+
+        threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', None)
+        if threshold:
+            for sql, count in recorder.repeated(threshold):
+                problems.append("possible N+1, {} repeats of: {}".format(count, sql))
+
+        if problems:
+            message = "Route '{}' ({}): {}".format(route, request.path, "; ".join(problems))
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
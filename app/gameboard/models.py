@@ -1,7 +1,7 @@
 from enum import Enum
 
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -81,6 +81,8 @@ class PlayerRank(models.Model):
     player = models.ForeignKey(AUTH_USER_MODEL, related_name='game_player', on_delete=models.CASCADE)
     rank = models.IntegerField(null=True, validators=[validate_rank_more_than_zero])
     score = models.IntegerField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         if self.score:
@@ -98,6 +100,15 @@ class Round(models.Model):
     # TODO rename this to player_ranks?
     players = models.ManyToManyField(PlayerRank, related_name='game_players')
     group = models.ForeignKey(Group, on_delete=models.CASCADE)
+    # Hash of the date, game, and ranks of an imported round, so re-imports can skip rounds they already added
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'content_hash']),
+        ]
 
     def winners(self):
         player_ids = self.players.filter(rank__exact=1).values_list('player_id', flat=True)
@@ -118,10 +129,11 @@ class Round(models.Model):
 class BracketMatch(models.Model):
     """
     When a bracket is played, its individual matches can be tracked by their corresponding match number.
-    These matches correspond to a round, which tracks the actual outcome.
+    These matches correspond to a round, which tracks the actual outcome. Scheduled matches which haven't been played
+    yet have no round.
     """
     match = models.IntegerField(null=False)
-    round = models.ForeignKey(Round, on_delete=models.CASCADE)
+    round = models.ForeignKey(Round, null=True, blank=True, on_delete=models.CASCADE)
 
     def __str__(self):
         return str("{}: {}".format(self.match, self.round))
@@ -135,6 +147,8 @@ class Team(models.Model):
     name = models.CharField(max_length=50)
     color = models.CharField(max_length=6)
     players = models.ManyToManyField(AUTH_USER_MODEL, related_name='game_players')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return str("{}: {}".format(self.name, self.players.all()))
@@ -144,6 +158,7 @@ class BracketType(Enum):
     SINGLE_ELIMINATION = 'Single Elimination'
     DOUBLE_ELIMINATION = 'Double Elimination'
     ROUND_ROBIN = 'Round Robin'
+    SWISS = 'Swiss'
 
 
 class Bracket(models.Model):
@@ -154,6 +169,12 @@ class Bracket(models.Model):
     type = models.CharField(BracketType, max_length=50)
     matches = models.ManyToManyField(BracketMatch, related_name='matches')
     teams = models.ManyToManyField(Team, related_name='teams')
+    # Every match the bracket will have and who has advanced, see bracket_helper. Null until it is first needed.
+    layout = models.JSONField(null=True, blank=True)
+    # Team ids, strongest first, see bracket_helper.seed_bracket. Null until the bracket is seeded.
+    seeds = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return str("{}: {}".format(self.type, self.teams.all()))
@@ -167,11 +188,25 @@ class Tournament(models.Model):
     name = models.CharField(max_length=50)
     bracket = models.ForeignKey(Bracket, on_delete=models.CASCADE)
     group = models.ForeignKey(Group, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return str("{}".format(self.name))
 
 
+class TournamentResult(models.Model):
+    """
+    The final bracket, matches, and standings of a finished tournament, frozen when it is finalized so they never need
+    recomputing. The document is zlib compressed json, see result_helper.
+    """
+    tournament = models.OneToOneField(Tournament, related_name='result', on_delete=models.CASCADE)
+    document = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str("Result of {}".format(self.tournament_id))
+
 # TODO use db for statistics
 class StatisticType(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -188,3 +223,194 @@ class Statistic(models.Model):
     player = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
     value = models.DecimalField(decimal_places=2, max_digits=16)
     info = models.ForeignKey(StatisticInfo, on_delete=models.CASCADE)
+
+
+class ImportJob(models.Model):
+    """
+    An uploaded score csv which is waiting to be (or is being) imported into a group in the background. Progress is
+    written back as the import runs, so that the uploader can check on it.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FINISHED, 'Finished'), (FAILED, 'Failed')]
+
+    scores = models.FileField(upload_to='imports/')
+    version = models.IntegerField(default=2)
+    # Skip rounds which were already imported, rather than adding them again
+    skip_existing = models.BooleanField(default=False)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE)
+    created_by = models.ForeignKey(AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=20, choices=STATUSES, default=QUEUED)
+    total_rows = models.IntegerField(null=True)
+    rows_processed = models.IntegerField(default=0)
+    rounds_created = models.IntegerField(default=0)
+    rounds_skipped = models.IntegerField(default=0)
+    # A list of [line number, message] pairs for lines that could not be imported
+    errors = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def eta(self):
+        """
+        Estimate how long until the import finishes, from how fast it has gone so far.
+
+        :return: The estimated number of seconds remaining, or None if it can't be estimated yet.
+        """
+        if self.status != self.RUNNING or not self.started_at or not self.total_rows or not self.rows_processed:
+            return None
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        rate = self.rows_processed / elapsed if elapsed > 0 else 0
+        return round((self.total_rows - self.rows_processed) / rate, 1) if rate else None
+
+    def __str__(self):
+        return str("{}: {} ({})".format(self.group, self.scores.name, self.status))
+
+
+class Tombstone(models.Model):
+    """
+    Left behind when a round, team, bracket, or tournament is deleted, so that delta exports (which only contain what
+    changed since a watermark) can pass deletions on as well.
+    """
+    # The model_name of the deleted object's model, such as 'round'
+    model = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    # Null when the deleted object was not part of any group
+    group = models.ForeignKey(Group, null=True, on_delete=models.CASCADE)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return str("{} {} ({})".format(self.model, self.object_id, self.deleted_at))
+
+
+@receiver(pre_delete, sender=Round)
+@receiver(pre_delete, sender=Team)
+@receiver(pre_delete, sender=Bracket)
+@receiver(pre_delete, sender=Tournament)
+def create_tombstone(sender, instance, **kwargs):
+    """
+    Leave a tombstone for a deleted object. This runs before the delete, because teams and brackets can only be traced
+    back to a group through tournaments, which may be deleted along with them.
+    """
+    if isinstance(instance, (Round, Tournament)):
+        group_id = instance.group_id
+    elif isinstance(instance, Bracket):
+        group_id = Tournament.objects.filter(bracket=instance).values_list('group_id', flat=True).first()
+    else:
+        group_id = Tournament.objects.filter(bracket__teams=instance).values_list('group_id', flat=True).first()
+    Tombstone.objects.create(model=sender._meta.model_name, object_id=instance.pk, group_id=group_id)
+
+
+@receiver(pre_delete, sender=PlayerRank)
+def touch_player_rank_rounds(sender, instance, **kwargs):
+    """
+    A round has changed when one of its player ranks is deleted, and its content hash no longer matches its ranks.
+    """
+    Round.objects.filter(players=instance).update(updated_at=timezone.now(), content_hash=None)
+
+
+@receiver(post_save, sender=PlayerRank)
+def clear_player_rank_hashes(sender, instance, created, **kwargs):
+    """
+    A round's content hash covers its ranks, so is cleared when one of them is edited (see hash_rounds).
+    """
+    if not created:
+        Round.objects.filter(players=instance).exclude(content_hash=None).update(content_hash=None)
+
+
+def reset_round_brackets(rounds):
+    """
+    Reset the layouts of the brackets with matches played in some rounds, as the winners are worked out from the ranks
+    of those rounds (see bracket_helper).
+
+    :param rounds: A queryset of the rounds.
+    :return: None
+    """
+    Bracket.objects.filter(matches__round__in=rounds).update(updated_at=timezone.now(), layout=None)
+
+
+@receiver(post_save, sender=PlayerRank)
+@receiver(pre_delete, sender=PlayerRank)
+def reset_player_rank_brackets(sender, instance, created=False, **kwargs):
+    """
+    A bracket's results may change when a rank of a round one of its matches was played in is edited or deleted.
+    """
+    if not created:
+        reset_round_brackets(Round.objects.filter(players=instance))
+
+
+@receiver(post_save, sender=BracketMatch)
+@receiver(pre_delete, sender=BracketMatch)
+def touch_match_brackets(sender, instance, created=False, **kwargs):
+    """
+    A bracket has changed when one of its matches is moved to another round, or deleted.
+    """
+    if not created:
+        Bracket.objects.filter(matches=instance).update(updated_at=timezone.now(), layout=None)
+
+
+@receiver(post_save, sender=Team)
+@receiver(m2m_changed, sender=Team.players.through)
+def touch_team_brackets(sender, instance, created=False, action='post_save', reverse=False, pk_set=None, **kwargs):
+    """
+    A bracket's standings change when one of its teams is renamed, or has its players changed, so mark the bracket as
+    changed for the live standings of other processes to see (see standings_helper).
+    """
+    if created or action not in ['post_save', 'post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        Bracket.objects.filter(teams=instance.pk).update(updated_at=timezone.now())
+    elif pk_set:
+        Bracket.objects.filter(teams__in=pk_set).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Round.players.through)
+@receiver(m2m_changed, sender=Team.players.through)
+@receiver(m2m_changed, sender=Bracket.teams.through)
+@receiver(m2m_changed, sender=Bracket.matches.through)
+def touch_on_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Adding to (or removing from) a many to many field doesn't save the object it belongs to, so mark it as changed.
+    """
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        type(instance).objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+    elif pk_set:
+        # Clearing from the reverse side doesn't say which objects were changed, so only adds and removes are caught
+        model.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Round.players.through)
+def clear_round_hashes(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    A round's content hash no longer matches, and the results of its bracket matches may change, once player ranks are
+    added to or removed from it.
+    """
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        rounds = Round.objects.filter(pk=instance.pk)
+    elif pk_set:
+        rounds = Round.objects.filter(pk__in=pk_set)
+    else:
+        return
+    rounds.update(content_hash=None)
+    reset_round_brackets(rounds)
+
+
+@receiver(m2m_changed, sender=Bracket.teams.through)
+@receiver(m2m_changed, sender=Bracket.matches.through)
+def reset_bracket_layout(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    A bracket's layout is rebuilt the next time it is needed when its teams or matches change. The bracket helper saves
+    the layout again after adding a match itself.
+    """
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        Bracket.objects.filter(pk=instance.pk).update(layout=None)
+    elif pk_set:
+        Bracket.objects.filter(pk__in=pk_set).update(layout=None)
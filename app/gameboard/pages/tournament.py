@@ -6,10 +6,11 @@ from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 
+from gameboard.helpers.membership_helper import is_member
+from gameboard.helpers.standings_helper import TOURNAMENT_SCORING
 from gameboard.models import Bracket, Tournament, BracketType, Team, BracketRound
 from gameboard.queries.find import find_tournaments
-from gameboard.queries.search import search_tournament_by_id, search_player_by_id, search_round_by_id, \
-    search_groups_by_player
+from gameboard.queries.search import search_tournament_by_id, search_player_by_id, search_round_by_id
 from gameboard.utils import get_user_info
 
 
@@ -27,7 +28,8 @@ def all_tournaments(request):
     # Setup dictionary with data to be returned with render
     data = dict()
     data['player'] = gb_user
-    data['tournaments'] = find_tournaments(gb_user)
+    data['tournaments'], data['next'] = find_tournaments(gb_user.primary_group, TOURNAMENT_SCORING,
+                                                         before=request.GET.get('before'))
     # Get data for this tournament
     return render(request, "tournament.html", data)
 
@@ -193,8 +195,8 @@ def player_can_add_to(player, item_with_group):
     """
     Check if a player is part of the group that this item is in.
 
-    :param player:
-    :param item_with_group:
-    :return:
+    :param player: The player, whose groups are loaded once (see membership_helper).
+    :param item_with_group: Anything with a group, such as a tournament or round.
+    :return: Whether the player is in the item's group.
     """
-    return search_groups_by_player(player).filter(id=item_with_group.group.id).first() is not None
+    return is_member(player, item_with_group.group_id)
@@ -1,5 +1,8 @@
 from rest_framework import permissions
 
+from gameboard.helpers.membership_helper import is_admin, is_member
+from gameboard.models import Group
+
 
 class IsDeveloper(permissions.BasePermission):
     """
@@ -39,3 +42,49 @@ class IsAuthenticatedOrCreate(permissions.IsAuthenticated):
         if request.method == 'POST':
             return True
         return super(IsAuthenticatedOrCreate, self).has_permission(request, view)
+
+
+def object_group_id(obj):
+    """
+    :param obj: A model instance.
+    :return: The id of the group the object belongs to, or None if it doesn't belong to one.
+    """
+    if isinstance(obj, Group):
+        return obj.pk
+    return getattr(obj, 'group_id', None)
+
+
+class IsGroupMember(permissions.BasePermission):
+    """
+    Only allow players of a group to see or change what is in it, and only its admins to change the group itself.
+    Admins can see the group itself without playing in it. Objects which don't belong to a group are left to the other
+    permissions.
+    """
+    admin_methods = ("PUT", "PATCH", "DELETE")
+
+    def has_permission(self, request, view):
+        if request.method == 'POST' and request.data.get('group') is not None:
+            try:
+                return is_member(request.user, int(request.data['group']))
+            except (TypeError, ValueError):
+                return False
+        return True
+
+    def has_object_permission(self, request, view, obj):
+        group_id = object_group_id(obj)
+        if group_id is None:
+            return True
+        if isinstance(obj, Group) and request.method in self.admin_methods:
+            return is_admin(request.user, group_id)
+        if isinstance(obj, Group) and request.method in permissions.SAFE_METHODS:
+            return is_member(request.user, group_id) or is_admin(request.user, group_id)
+        if request.method in permissions.SAFE_METHODS:
+            return is_member(request.user, group_id)
+        # Moving an object to another group needs membership of both
+        new_group = request.data.get('group')
+        try:
+            new_group = int(new_group) if new_group is not None else group_id
+        except (TypeError, ValueError):
+            return False
+        return is_member(request.user, group_id) and is_member(request.user, new_group)
+
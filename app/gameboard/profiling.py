@@ -0,0 +1,163 @@
+"""
+Profiling
+
+Opt in profiling of single requests. Staff can send the X-Profile header (or a ?profile=1 query parameter) with any
+request, and the view will be run under cProfile. The profile is saved to PROFILE_DIR, tagged with the route and user,
+and only the newest PROFILE_MAX_FILES profiles are kept.
+"""
+import cProfile
+import os
+import pstats
+import re
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+PROFILE_EXTENSION = '.prof'
+# Anything that isn't safe to put in a file name gets replaced
+UNSAFE_CHARACTERS = re.compile(r'[^A-Za-z0-9-]+')
+PROFILE_NAME = re.compile(r'^[A-Za-z0-9_-]+\.prof$')
+
+
+def profile_directory():
+    return getattr(settings, 'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'gameboard-profiles'))
+
+
+def get_profiling_user(request):
+    """
+    Get the user asking for a profile. Session users are known by the time middleware runs, but api users send a JWT
+    which is normally only read once the view runs, so try that too.
+
+    :param request: A html request.
+    :return: The user, or None if they could not be authenticated.
+    """
+    if request.user.is_authenticated:
+        return request.user
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return authenticated[0] if authenticated else None
+
+
+def wants_profile(request):
+    """
+    Check whether this request asked to be profiled.
+
+    :param request: A html request.
+    :return: True if the profile header or query parameter was sent.
+    """
+    return 'HTTP_X_PROFILE' in request.META or request.GET.get('profile') in ['1', 'true']
+
+
+def save_profile(profiler, route, username):
+    """
+    Save a finished profile, then remove the oldest profiles so that at most PROFILE_MAX_FILES are kept.
+
+    :param profiler: The cProfile.Profile which ran the view.
+    :param route: The url name of the view that was profiled.
+    :param username: The user who asked for the profile.
+    :return: The name of the saved profile.
+    """
+    directory = profile_directory()
+    os.makedirs(directory, exist_ok=True)
+    name = '{}_{}_{}{}'.format(
+        datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+        UNSAFE_CHARACTERS.sub('-', route or 'unresolved'),
+        UNSAFE_CHARACTERS.sub('-', username),
+        PROFILE_EXTENSION,
+    )
+    profiler.dump_stats(os.path.join(directory, name))
+
+    # Rotate, the timestamp prefix means the names sort oldest first
+    profiles = list_profiles()
+    for old_profile in profiles[:max(0, len(profiles) - getattr(settings, 'PROFILE_MAX_FILES', 50))]:
+        try:
+            os.remove(os.path.join(directory, old_profile['name']))
+        except FileNotFoundError:
+            pass  # Another worker already rotated it
+    return name
+
+
+def list_profiles():
+    """
+    List all the saved profiles, oldest first.
+
+    :return: A list of dictionaries with the name, time, route, and user of each profile.
+    """
+    directory = profile_directory()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory)):
+        if not PROFILE_NAME.match(name):
+            continue
+        timestamp, route, username = name[:-len(PROFILE_EXTENSION)].split('_', 2)
+        profiles.append({
+            'name': name,
+            'time': datetime.strptime(timestamp, '%Y%m%d-%H%M%S-%f').isoformat(),
+            'route': route,
+            'user': username,
+        })
+    return profiles
+
+
+def top_functions(name, limit=30, sort='cumulative'):
+    """
+    Read a saved profile and get the functions that took the most time.
+
+    :param name: The name of the profile, as given by list_profiles().
+    :param limit: How many functions to return.
+    :param sort: Either 'cumulative' (time including calls to other functions) or 'total' (time in the function itself)
+    :return: A list of dictionaries describing each function, or None if there is no profile with that name.
+    """
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(profile_directory(), name)
+    if not os.path.isfile(path):
+        return None
+
+    functions = []
+    for (filename, line, function), (primitive_calls, calls, total, cumulative, callers) in \
+            pstats.Stats(path).stats.items():
+        functions.append({
+            'function': function,
+            'file': filename,
+            'line': line,
+            'calls': calls,
+            'primitive_calls': primitive_calls,
+            'total_time': round(total, 6),
+            'cumulative_time': round(cumulative, 6),
+        })
+    key = 'total_time' if sort == 'total' else 'cumulative_time'
+    return sorted(functions, key=lambda f: f[key], reverse=True)[:limit]
+
+
+class ProfilerMiddleware:
+    """
+    Runs the view under cProfile when a staff member asks for it. This should be the last middleware with a
+    process_view, so that all the others have already run before profiling begins.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(settings, 'PROFILER_ENABLED', True) or not wants_profile(request):
+            return None
+        user = get_profiling_user(request)
+        if user is None or not user.is_staff:
+            return None
+
+        profiler = cProfile.Profile()
+        response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+        # Api responses are only serialized when rendered, which is usually a large part of their time
+        if callable(getattr(response, 'render', None)) and not getattr(response, 'is_rendered', True):
+            profiler.runcall(response.render)
+        response['X-Profile-Id'] = save_profile(profiler, request.resolver_match.url_name, user.username)
+        return response
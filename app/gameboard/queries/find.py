@@ -6,13 +6,16 @@ Finders are functions which gather a collection of searches to then create a mor
 from datetime import datetime, timedelta
 from operator import itemgetter
 
-from gameboard.models import Group, Game, Player, Tournament
+from django.db.models import Case, Count, F, IntegerField, JSONField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, JSONObject
+
+from gameboard.models import Bracket, BracketMatch, Group, Game, Player, Team, Tournament
 from gameboard.queries.generate import generate_trophies
 from gameboard.queries.helpers import average_ranks, generate_dates
-from gameboard.queries.search import search_games_by_player, search_ranks_by_player, search_wins_by_player, \
-    search_games_by_player_in_time, search_wins_by_player_in_time, search_ranks_by_player_in_time, \
-    search_wins_by_player_in_time_for_heavy, search_wins_by_player_in_time_that_are_unique, \
-    search_wins_by_player_in_time_for_game
+from gameboard.queries.search import search_games_by_player, search_groups_by_player, search_ranks_by_player, \
+    search_wins_by_player, search_games_by_player_in_time, search_wins_by_player_in_time, \
+    search_ranks_by_player_in_time, search_wins_by_player_in_time_for_heavy, \
+    search_wins_by_player_in_time_that_are_unique, search_wins_by_player_in_time_for_game
 
 
 def find_win_percentage(player):
@@ -104,7 +107,7 @@ def find_groups(player):
     :param player: A Player object, which contains the user info
     :return: A queryset of group objects the player belongs to
     """
-    group = Group.objects.filter(player__user=player.user)
+    group = search_groups_by_player(player)
 
     return group
 
@@ -129,11 +132,7 @@ def find_is_player_admin(group, player):
     :param player: The player object to check against
     :return: A boolean value
     """
-    admins = group.admins.all()
-    for admin in admins:
-        if player.user.username == admin.user.username:
-            return True
-    return False
+    return group.admins.filter(pk=player.pk).exists()
 
 def find_player_status(player):
     """
@@ -253,12 +252,113 @@ def find_statistic(group, type, date_string="all"):
                 #     query_result = 0
 
         if float(query_result) > 0:
-            return_list.append((player.user.username, query_result))
+            return_list.append((player.username, query_result))
 
     return generate_trophies(sorted(return_list, key=itemgetter(1), reverse=True))
 
 
-def find_tournaments(player):
-    print("player", player)
-    print(Tournament.objects.filter(group_id=player.primary_group_id).all())
-    pass
+def find_player_strengths(player_ids, prior_rounds=10):
+    """
+    Rate how strong players are from every round they've played, in a single query. A player's strength is their win
+    rate, pulled towards the average win rate of the players being rated until they've played enough rounds for their
+    own rate to mean much.
+
+    :param player_ids: A list of player ids.
+    :param prior_rounds: How many rounds the average win rate counts as.
+    :return: A dictionary of player id to their strength, between 0 and 1.
+    """
+    counts = list(Player.objects.filter(pk__in=player_ids).annotate(
+        played=Count('game_player'), wins=Count('game_player', filter=Q(game_player__rank=1)),
+    ).values_list('pk', 'played', 'wins'))
+    total_played = sum(played for pk, played, wins in counts)
+    average = sum(wins for pk, played, wins in counts) / total_played if total_played else 0.0
+    return {pk: (wins + prior_rounds * average) / (played + prior_rounds) for pk, played, wins in counts}
+
+
+def find_team_strengths(team_ids, prior_rounds=10):
+    """
+    Rate how strong teams are from every round their players have played, in a single query grouped by team and
+    player. A team's strength is the strength of its strongest player (see find_player_strengths), as a team's best
+    placed player decides its matches (see bracket_helper.match_winner). Teams without players have no strength.
+
+    :param team_ids: A list of team ids.
+    :param prior_rounds: How many rounds the average win rate counts as.
+    :return: A dictionary of team id to its strength.
+    """
+    memberships = Team.players.through.objects.filter(team_id__in=team_ids)
+    counts = list(memberships.values_list('team_id', 'player_id').annotate(
+        played=Count('player__game_player'), wins=Count('player__game_player', filter=Q(player__game_player__rank=1)),
+    ).order_by())
+    total_played = sum(played for team, player, played, wins in counts)
+    average = sum(wins for team, player, played, wins in counts) / total_played if total_played else 0.0
+    strengths = {team_id: 0.0 for team_id in team_ids}
+    for team, player, played, wins in counts:
+        strengths[team] = max(strengths[team], (wins + prior_rounds * average) / (played + prior_rounds))
+    return strengths
+
+
+def count_subquery(queryset, field):
+    """
+    Count the rows of a queryset for each value of a field, for use as an annotation.
+
+    :param queryset: The rows to count, filtered against an OuterRef.
+    :param field: The field the rows are grouped by.
+    :return: An expression of the count, which is 0 when there are no rows.
+    """
+    counts = queryset.order_by().values(field).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def find_tournaments(group, scoring, before=None, limit=25):
+    """
+    List a group's tournaments, newest first, along with a summary of each. Everything comes from a single query, with
+    the summaries as subqueries, and pages are found by id (rather than an offset) so every page is as quick as the
+    first.
+
+    The leader is the team with the most points from the matches played so far.
+
+    :param group: The group object of interest
+    :param scoring: A dictionary of placement to the points it scores (see standings_helper.TOURNAMENT_SCORING).
+    :param before: Only list tournaments older than this tournament id, the next value of the previous page.
+    :param limit: The most tournaments to list.
+    :return: A list of dictionaries, one for each tournament, and the before value of the next page (None if this is
+             the last page).
+    """
+    bracket = OuterRef('bracket_id')
+    points = Sum(Case(
+        *[When(players__game_player__rank=rank, then=Value(score)) for rank, score in scoring.items()],
+        default=Value(0), output_field=IntegerField(),
+    ))
+    # The leader's id, name, and points all come from one row, so its subquery is only run once
+    leaders = Team.objects.filter(
+        teams=bracket, players__game_player__game_players__bracketmatch__matches=bracket,
+    ).values('pk').annotate(points=points).filter(points__gt=0).order_by('-points', 'pk').values(
+        leader=JSONObject(pk='pk', name='name', points='points'),
+    )
+
+    tournaments = Tournament.objects.filter(group=group)
+    if before is not None:
+        tournaments = tournaments.filter(pk__lt=before)
+    tournaments = list(tournaments.annotate(
+        bracket_type=F('bracket__type'),
+        team_count=count_subquery(Bracket.teams.through.objects.filter(bracket_id=bracket), 'bracket_id'),
+        match_count=count_subquery(BracketMatch.objects.filter(matches=bracket), 'matches'),
+        completed_count=count_subquery(BracketMatch.objects.filter(matches=bracket, round__isnull=False), 'matches'),
+        leader=Subquery(leaders[:1], output_field=JSONField()),
+    ).order_by('-pk').values(
+        'pk', 'name', 'created_at', 'bracket_id', 'bracket_type', 'team_count', 'match_count', 'completed_count',
+        'leader',
+    )[:limit + 1])
+
+    next_before = tournaments[limit - 1]['pk'] if len(tournaments) > limit else None
+    return [{
+        'pk': tournament['pk'],
+        'name': tournament['name'],
+        'createdAt': tournament['created_at'],
+        'bracket': tournament['bracket_id'],
+        'bracketType': tournament['bracket_type'],
+        'teamCount': tournament['team_count'],
+        'matchCount': tournament['match_count'],
+        'completedMatchCount': tournament['completed_count'],
+        'leader': tournament['leader'],
+    } for tournament in tournaments[:limit]], next_before
@@ -44,6 +44,8 @@ def get_heavy_game_list():
 
 
 def average_ranks(rounds, return_zero_as_null=False):
+    # Players who did not finish have no rank to average
+    rounds = [rank for rank in rounds if rank is not None]
     if len(rounds) == 0:
         return 'null' if return_zero_as_null else None
     else:
@@ -13,11 +13,11 @@ def find_oldest_date():
 
 
 def search_groups_by_player(player):
-    return Group.objects.filter(player__user=player.user)
+    return Group.objects.filter(players=player)
 
 
 def search_wins_by_player(player):
-    return Round.objects.filter(players__player__user=player.user, players__rank__exact=1)
+    return Round.objects.filter(players__player=player, players__rank__exact=1)
 
 
 def search_wins_by_player_in_time(player, date_start, date_end):
@@ -25,7 +25,7 @@ def search_wins_by_player_in_time(player, date_start, date_end):
 
 
 def search_ranks_by_player(player):
-    return PlayerRank.objects.filter(player__user=player.user)
+    return PlayerRank.objects.filter(player=player)
 
 
 def search_ranks_by_player_in_time(player, date_start, date_end):
@@ -33,7 +33,7 @@ def search_ranks_by_player_in_time(player, date_start, date_end):
 
 
 def search_games_by_player(player):
-    return Round.objects.filter(players__player__user=player.user)
+    return Round.objects.filter(players__player=player)
 
 
 def search_games_by_player_in_time(player, date_start, date_end):
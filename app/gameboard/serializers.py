@@ -75,8 +75,8 @@ class TeamSerializer(serializers.ModelSerializer):
 class BracketSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bracket
-        fields = ['pk', 'type', 'matches', 'teams']
-        read_only_fields = ['pk']
+        fields = ['pk', 'type', 'matches', 'teams', 'layout', 'seeds']
+        read_only_fields = ['pk', 'layout', 'seeds']
 
 
 class TournamentSerializer(serializers.ModelSerializer):
@@ -1,7 +1,45 @@
-from django.test import TestCase
-from gameboard.models import Player, Round, Game, Group, PlayerRank, Team, Bracket, Tournament, BracketRound, \
-    BracketType
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import ResolverMatch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from psycopg2 import Binary
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.tokens import AccessToken
+
+from gameboard.helpers.benchmark_helper import Benchmark, BENCHMARK_SIZES, IMPORT_ROWS, compare
+from gameboard.helpers.membership_helper import find_memberships, is_admin, is_member
+from gameboard.helpers.bracket_helper import BracketError, BYE, add_result, build_layout, find_match, get_layout, \
+    next_match, record_result, schedule_bracket, swiss_pairings, LAYOUT_VERSION
+from gameboard.helpers.delta_helper import DeltaError, export_delta, apply_delta
+from gameboard.helpers.job_helper import STALE_JOB_ERROR, run_import
+from gameboard.helpers.import_helper import BulkImportScores, ScoreImportError, ScoreReader, copy_value, delete_rows, \
+    hash_rounds, round_hash, wipe_group
+from gameboard.helpers.parallel_import_helper import ParallelImportScores
+from gameboard.helpers.pivot_helper import PivotScores
+from gameboard.helpers.projection_helper import project_tournament
+from gameboard.helpers.team_helper import TeamError, balance_teams, create_teams, seed_bracket
+from gameboard.helpers.result_helper import ResultError, decode_document, encode_document, finalize_tournament, \
+    find_result
+from gameboard.helpers.standings_helper import TOURNAMENT_SCORING, bracket_revision, hub as standings_hub
+from gameboard.helpers.snapshot_helper import dump_snapshot, restore_snapshot, snapshot_models, SnapshotError
+from gameboard.queries.find import find_team_strengths, find_tournaments
+from gameboard.middleware import QueryBudgetMiddleware, QueryBudgetExceeded
+from gameboard.models import Player, Round, Game, Group, PlayerRank, Team, Bracket, Tournament, BracketMatch, \
+    BracketType, StatisticType, StatisticInfo, Statistic, ImportJob, TournamentResult
+from decimal import Decimal
 import datetime
+import io
+import json
+import os
+import tempfile
 
 
 class TestGameBoardModels(TestCase):
@@ -90,11 +128,11 @@ class TestGameBoardModels(TestCase):
         rank5.save()
         played4.players.add(rank4)
         played4.players.add(rank5)
-        # Make it a bracket round
-        br1 = BracketRound(match=1, round=played4)
+        # Make it a bracket match
+        br1 = BracketMatch(match=1, round=played4)
         br1.save()
         # Add it to bracket
-        bracket1.rounds.add(br1)
+        bracket1.matches.add(br1)
 
     def test_player(self):
         """
@@ -151,15 +189,16 @@ class TestGameBoardModels(TestCase):
         player1 = Player.objects.get(username="james")
         player2 = Player.objects.get(username="john")
         player3 = Player.objects.get(username="jane")
-        played1 = Round.objects.filter(players__player__username__exact=player1.user.username)
-        played2 = Round.objects.filter(players__player__username__exact=player2.user.username)
-        played3 = Round.objects.filter(players__player__username__exact=player3.user.username)
+        played1 = Round.objects.filter(players__player__username__exact=player1.username)
+        played2 = Round.objects.filter(players__player__username__exact=player2.username)
+        played3 = Round.objects.filter(players__player__username__exact=player3.username)
 
-        self.assertEqual(len(played1), 2)
-        self.assertEqual(len(played2), 2)
+        # James and John also played Catan again, as their tournament match
+        self.assertEqual(len(played1), 3)
+        self.assertEqual(len(played2), 3)
         self.assertEqual(len(played3), 2)
 
-        game_played1 = Round.objects.get(game__name__exact="Catan")
+        game_played1 = Round.objects.filter(game__name__exact="Catan").order_by('pk').first()
         game_played2 = Round.objects.get(game__name__exact="Bananagram")
         game_played3 = Round.objects.get(game__name__exact="Uno")
 
@@ -225,6 +264,1219 @@ class TestGameBoardModels(TestCase):
 
         # TODO(keegan): write actual tests
 
+
+class TestQueryBudgetMiddleware(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ["Catan", "Bananagram", "Uno"]:
+            Game(name=name, description=name).save()
+
+    @staticmethod
+    def run_middleware(view):
+        """
+        Run a view through the middleware, as if it had been resolved to the 'Test Route' url.
+
+        :param view: A function which takes a request and returns a response.
+        :return: The request and response, after the middleware has run.
+        """
+        request = RequestFactory().get('/test/')
+
+        def get_response(request):
+            request.resolver_match = ResolverMatch(view, (), {}, url_name='Test Route')
+            return view(request)
+
+        response = QueryBudgetMiddleware(get_response)(request)
+        return request, response
+
+    def test_headers(self):
+        """
+        Test that the query count and time are reported on the response.
+        :return: None
+        """
+        def view(request):
+            list(Game.objects.all())
+            return HttpResponse()
+
+        request, response = self.run_middleware(view)
+        self.assertEqual(response['X-DB-Queries'], '1')
+        self.assertEqual(request.db_queries, 1)
+        self.assertTrue(response['X-DB-Time'].endswith('ms'))
+
+    @override_settings(QUERY_BUDGETS={'Test Route': 2}, QUERY_BUDGET_RAISE=True, QUERY_REPEAT_THRESHOLD=None)
+    def test_budget(self):
+        """
+        Test that going over a route's budget fails when raising is turned on.
+        :return: None
+        """
+        def view(request):
+            for game in Game.objects.all():
+                Game.objects.filter(name=game.name).exists()
+            return HttpResponse()
+
+        with self.assertRaises(QueryBudgetExceeded):
+            self.run_middleware(view)
+
+    @override_settings(QUERY_BUDGETS={}, QUERY_BUDGET_RAISE=True, QUERY_REPEAT_THRESHOLD=3)
+    def test_repeated_queries(self):
+        """
+        Test that the same query shape repeated in a loop is flagged, but different queries are not.
+        :return: None
+        """
+        def n_plus_one_view(request):
+            for game in Game.objects.all():
+                Game.objects.filter(name=game.name).exists()
+            return HttpResponse()
+
+        def single_view(request):
+            Game.objects.filter(name__in=list(Game.objects.values_list('name', flat=True))).exists()
+            return HttpResponse()
+
+        with self.assertRaises(QueryBudgetExceeded):
+            self.run_middleware(n_plus_one_view)
+        request, response = self.run_middleware(single_view)
+        self.assertEqual(response['X-DB-Queries'], '2')
+
+class TestMetrics(TestCase):
+    def test_metrics_endpoint(self):
+        """
+        Test that requests are recorded against their url name, and exposed in the prometheus format.
+        :return: None
+        """
+        directory = tempfile.mkdtemp()
+        with override_settings(METRICS_DIR=directory, METRICS_TOKEN="scrape"):
+            # A worker which has exited, whose numbers are no longer counted
+            with open(os.path.join(directory, 'metrics-999999999.json'), 'w') as f:
+                json.dump({'Player Info': {'requests': 5, 'errors': 0, 'db_queries': 0, 'duration_sum': 0.0,
+                                           'buckets': [0] * 11}}, f)
+            self.client.get('/player_info/')
+            self.client.get('/player_info/')
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION="Bearer scrape")
+
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('gameboard_requests_total{route="Player Info"} 2', content)
+        self.assertIn('gameboard_request_duration_seconds_bucket{route="Player Info",le="+Inf"} 2', content)
+        self.assertFalse(os.path.exists(os.path.join(directory, 'metrics-999999999.json')))
+
+        self.client.force_login(Player.objects.create(username="metrics staff", is_staff=True))
+        with override_settings(METRICS_DIR=directory):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class TestProfiler(TestCase):
+    def test_profile_capture(self):
+        """
+        Test that staff can capture and view a profile, and that other users can do neither.
+        :return: None
+        """
+        staff = Player.objects.create_user(username="staff", password="password", is_staff=True)
+        Player.objects.create_user(username="regular", password="password")
+
+        with override_settings(PROFILE_DIR=tempfile.mkdtemp(), PROFILE_MAX_FILES=2):
+            self.client.login(username="regular", password="password")
+            response = self.client.get('/metrics', HTTP_X_PROFILE='1')
+            self.assertNotIn('X-Profile-Id', response)
+            self.assertEqual(self.client.get('/profiles/').status_code, 403)
+
+            self.client.force_login(staff)
+            for _ in range(3):
+                response = self.client.get('/metrics?profile=1')
+            profile_id = response['X-Profile-Id']
+
+            profiles = self.client.get('/profiles/').json()['profiles']
+            self.assertEqual(len(profiles), 2)
+            self.assertEqual(profiles[0]['name'], profile_id)
+            self.assertEqual(profiles[0]['route'], 'Metrics')
+            self.assertEqual(profiles[0]['user'], 'staff')
+
+            functions = self.client.get('/profiles/{}/?limit=5'.format(profile_id)).json()['functions']
+            self.assertEqual(len(functions), 5)
+            self.assertEqual(self.client.get('/profiles/missing.prof/').status_code, 404)
+
+            # Api users send a JWT rather than logging in
+            self.client.logout()
+            self.assertEqual(self.client.get('/profiles/').status_code, 401)
+            token = AccessToken.for_user(staff)
+            response = self.client.get('/profiles/', HTTP_AUTHORIZATION='Bearer {}'.format(token))
+            self.assertEqual(len(response.json()['profiles']), 2)
+
+
+class TestSyntheticData(TestCase):
+    def test_generate_data(self):
+        """
+        Test that the generate_data command creates groups of players with a history of ranked rounds.
+        :return: None
+        """
+        out = io.StringIO()
+        call_command('generate_data', players=4, games=3, years=0.05, rounds_per_day=2, seed=1, prefix='smoke',
+                     stdout=out)
+        group = Group.objects.get(name='smoke group 1')
+        self.assertEqual(group.players.count(), 4)
+        self.assertEqual(group.admins.count(), 1)
+        self.assertGreater(Round.objects.filter(group=group).count(), 0)
+        self.assertFalse(Round.objects.filter(group=group, players__isnull=True).exists())
+        self.assertIn("Created 1 groups, 4 players, 3 games", out.getvalue())
+
+
+class TestBenchmark(TestCase):
+    def test_run(self):
+        """
+        Test that every benchmark case runs against a small seeded dataset, and runs can be compared.
+        :return: None
+        """
+        with mock.patch.dict(BENCHMARK_SIZES, {'tiny': {'players': 4, 'games': 3, 'years': 0.05,
+                                                        'rounds_per_day': 2}}), \
+                mock.patch.dict(IMPORT_ROWS, {'tiny': 20}):
+            results = Benchmark(sizes=['tiny'], repeat=1).run()
+
+        cases = {result['case']: result for result in results['results']}
+        self.assertIn('tournament_info', cases)
+        self.assertEqual(cases['import_scores']['rows'], 20)
+        self.assertEqual([result for result in results['results'] if 'error' in result], [])
+        rows = compare(results, results)
+        self.assertEqual(len(rows), len(results['results']))
+        self.assertEqual(rows[0]['queries'][0], rows[0]['queries'][1])
+
+
+class TestBulkImportScores(TestCase):
+    scores = (
+        "Date,Game,Coop,james,james score,jane doe,jane doe score\n"
+        "3/2/22,Catan,,1,10,2,8\n"
+        "3/3/22,Uno,,0,,,\n"
+        "not a date,Uno,,1,,2,\n"
+        ",,,,,,\n"
+    )
+
+    def test_import(self):
+        """
+        Test that a score csv is imported in one pass, creating players and games, and skipping bad lines.
+        :return: None
+        """
+        group = Group.objects.create(name="Import Group")
+        group.players.add(Player.objects.create_user(username="james", password="password"))
+
+        stats = BulkImportScores(group, chunk_size=1).import_reader(ScoreReader(io.StringIO(self.scores)))
+
+        self.assertEqual(stats['rows'], 4)
+        self.assertEqual(stats['rounds'], 2)
+        self.assertEqual(stats['player_ranks'], 3)
+        self.assertEqual(stats['errors'][0][0], 4)
+        self.assertEqual(Player.objects.filter(username__in=["james", "janedoe"]).count(), 2)
+        self.assertEqual(group.players.count(), 2)
+
+        catan = Round.objects.get(group=group, game__name="Catan")
+        self.assertEqual(catan.date, datetime.date(2022, 3, 2))
+        self.assertEqual(sorted(catan.players.values_list('player__username', 'rank', 'score')),
+                         [("james", 1, 10), ("janedoe", 2, 8)])
+        uno = Round.objects.get(group=group, game__name="Uno")
+        self.assertEqual(list(uno.players.values_list('player__username', 'rank', 'score')), [("james", None, None)])
+        jane = Player.objects.get(username="janedoe")
+        self.assertFalse(jane.has_usable_password())
+        self.assertFalse(group.admins.exists())
+
+    def test_outside_players(self):
+        """
+        Test that a csv naming players of other groups is refused, unless the import may claim them.
+        :return: None
+        """
+        outsider = Player.objects.create_user(username="james", password="password")
+        group = Group.objects.create(name="Import Group")
+
+        with self.assertRaises(ScoreImportError):
+            BulkImportScores(group).import_reader(ScoreReader(io.StringIO(self.scores)))
+        self.assertFalse(group.players.exists())
+        self.assertFalse(Round.objects.filter(group=group).exists())
+
+        BulkImportScores(group, claim_players=True).import_reader(ScoreReader(io.StringIO(self.scores)))
+        self.assertEqual(set(group.players.all()), {outsider, Player.objects.get(username="janedoe")})
+        self.assertFalse(group.admins.exists())
+        self.assertTrue(outsider.check_password("password"))
+
+
+    @skipUnless(connection.vendor == 'postgresql', "COPY is only used on PostgreSQL")
+    def test_copy_import(self):
+        """
+        Test that importing with COPY creates exactly what importing with bulk_create does.
+        :return: None
+        """
+        copied = Group.objects.create(name="Copied Group")
+        created = Group.objects.create(name="Created Group")
+        importer = BulkImportScores(copied, chunk_size=1, claim_players=True)
+        self.assertTrue(importer.use_copy)
+        stats = importer.import_reader(ScoreReader(io.StringIO(self.scores)))
+        BulkImportScores(created, use_copy=False, claim_players=True).import_reader(
+            ScoreReader(io.StringIO(self.scores))
+        )
+
+        self.assertEqual((stats['rounds'], stats['player_ranks']), (2, 3))
+        fields = ['game', 'date', 'content_hash', 'players__player', 'players__rank', 'players__score']
+        self.assertEqual(sorted(Round.objects.filter(group=copied).values_list(*fields)),
+                         sorted(Round.objects.filter(group=created).values_list(*fields)))
+        # Ids were taken from the sequences, so saving normally afterwards must not collide
+        Round.objects.create(game=Game.objects.get(name="Uno"), group=copied)
+
+
+    def test_wipe_group(self):
+        """
+        Test that wiping a group removes its rounds, ranks, and matches, but leaves other groups alone.
+        :return: None
+        """
+        group = Group.objects.create(name="Wiped Group")
+        other_group = Group.objects.create(name="Other Group")
+        BulkImportScores(group).import_reader(ScoreReader(io.StringIO(self.scores)))
+        BulkImportScores(other_group, claim_players=True).import_reader(ScoreReader(io.StringIO(self.scores)))
+        bracket = Bracket.objects.create(type=BracketType.ROUND_ROBIN)
+        bracket.matches.add(BracketMatch.objects.create(match=1, round=Round.objects.filter(group=group).first()))
+        Bracket.objects.filter(pk=bracket.pk).update(layout={'version': LAYOUT_VERSION})
+
+        deleted = wipe_group(group)
+
+        self.assertEqual(deleted['rounds'], 2)
+        self.assertEqual(deleted['player_ranks'], 3)
+        self.assertEqual(deleted['bracket_matches'], 1)
+        self.assertFalse(Round.objects.filter(group=group).exists())
+        self.assertEqual(bracket.matches.count(), 0)
+        self.assertEqual(Round.objects.filter(group=other_group).count(), 2)
+        self.assertEqual(PlayerRank.objects.count(), 3)
+        bracket.refresh_from_db()
+        self.assertIsNone(bracket.layout)
+        self.assertEqual(group.players.count(), 2)
+
+
+    def test_reimport(self):
+        """
+        Test that re-importing with skip_existing only adds rounds the group doesn't have, including rounds which were
+        entered before hashing, and rounds really played twice.
+        :return: None
+        """
+        group = Group.objects.create(name="Reimport Group")
+        BulkImportScores(group).import_reader(ScoreReader(io.StringIO(self.scores)))
+        Round.objects.filter(group=group, game__name="Uno").update(content_hash=None)
+
+        stats = BulkImportScores(group, skip_existing=True).import_reader(ScoreReader(io.StringIO(self.scores)))
+        self.assertEqual((stats['rounds'], stats['skipped']), (0, 2))
+
+        grown = self.scores + "3/2/22,Catan,,2,8,1,10\n3/2/22,Catan,,1,10,2,8\n"
+        stats = BulkImportScores(group, skip_existing=True).import_reader(ScoreReader(io.StringIO(grown)))
+        self.assertEqual((stats['rounds'], stats['skipped']), (2, 2))
+        self.assertEqual(Round.objects.filter(group=group).count(), 4)
+
+    def test_rank_edit(self):
+        """
+        Test that editing a round's ranks clears its content hash, so it is hashed again from its new ranks.
+        :return: None
+        """
+        group = Group.objects.create(name="Edited Group")
+        BulkImportScores(group).import_reader(ScoreReader(io.StringIO(self.scores)))
+        catan = Round.objects.get(group=group, game__name="Catan")
+        uno = Round.objects.get(group=group, game__name="Uno")
+        self.assertIsNotNone(catan.content_hash)
+
+        player_rank = catan.players.get(player__username="james")
+        player_rank.rank = 3
+        player_rank.save()
+        uno.players.add(PlayerRank.objects.create(player=Player.objects.get(username="janedoe"), rank=2))
+        self.assertEqual(Round.objects.filter(group=group, content_hash=None).count(), 2)
+
+        hash_rounds(Round.objects.filter(group=group))
+        catan.refresh_from_db()
+        self.assertEqual(catan.content_hash, round_hash(catan.date, "Catan", [("james", 3), ("janedoe", 2)]))
+        stats = BulkImportScores(group, skip_existing=True).import_reader(ScoreReader(io.StringIO(self.scores)))
+        self.assertEqual((stats['rounds'], stats['skipped']), (2, 0))
+
+
+    @override_settings(IMPORT_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+    def test_upload(self):
+        """
+        Test that an uploaded csv is imported as a job, and its progress can be checked.
+        :return: None
+        """
+        group = Group.objects.create(name="Upload Group")
+        player = Player.objects.create_user(username="uploader", password="password", primary_group=group)
+        group.players.add(player)
+        self.client.force_login(player)
+
+        upload = io.BytesIO(self.scores.encode())
+        upload.name = 'scores.csv'
+        self.assertEqual(self.client.post('/import_upload/', {'scores': upload}).status_code, 403)
+
+        group.admins.add(player)
+        upload.seek(0)
+        response = self.client.post('/import_upload/', {'scores': upload})
+        self.assertEqual(response.status_code, 202)
+
+        job = self.client.get('/import_job/{}/'.format(response.json()['job'])).json()['job']
+        self.assertEqual(job['status'], 'finished')
+        self.assertEqual(job['totalRows'], 4)
+        self.assertEqual(job['rowsProcessed'], 4)
+        self.assertEqual(job['roundsCreated'], 2)
+        self.assertEqual(len(job['errors']), 1)
+        self.assertEqual(Round.objects.filter(group=group).count(), 2)
+
+        # A job whose worker exited is marked as failed once it has run for longer than IMPORT_JOB_TIMEOUT
+        hours_ago = timezone.now() - datetime.timedelta(hours=2)
+        lost = ImportJob.objects.create(scores='imports/lost.csv', group=group, created_by=player,
+                                        status=ImportJob.RUNNING)
+        ImportJob.objects.filter(pk=lost.pk).update(created_at=hours_ago, started_at=timezone.now())
+        self.assertEqual(self.client.get('/import_job/{}/'.format(lost.pk)).json()['job']['status'], 'running')
+        ImportJob.objects.filter(pk=lost.pk).update(started_at=hours_ago)
+        job = self.client.get('/import_job/{}/'.format(lost.pk)).json()['job']
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['errors'], [[None, STALE_JOB_ERROR]])
+
+        # A job waiting behind a busy pool is left queued for longer, and one failed meanwhile is never run
+        waiting = ImportJob.objects.create(scores=ContentFile(self.scores, name='waiting.csv'), group=group,
+                                           created_by=player)
+        ImportJob.objects.filter(pk=waiting.pk).update(created_at=hours_ago)
+        self.assertEqual(self.client.get('/import_job/{}/'.format(waiting.pk)).json()['job']['status'], 'queued')
+        ImportJob.objects.filter(pk=waiting.pk).update(status=ImportJob.FAILED)
+        run_import(waiting.pk)
+        waiting.refresh_from_db()
+        self.assertEqual((waiting.status, waiting.rows_processed), (ImportJob.FAILED, 0))
+        self.assertEqual(Round.objects.filter(group=group).count(), 2)
+
+
+    def test_export(self):
+        """
+        Test that a group's rounds are streamed as a csv which imports back to the same rounds.
+        :return: None
+        """
+        group = Group.objects.create(name="Export Group")
+        BulkImportScores(group).import_reader(ScoreReader(io.StringIO(self.scores)))
+        self.client.force_login(Player.objects.create_user(username="outsider", password="password"))
+        self.assertEqual(self.client.get('/export/{}/'.format(group.pk)).status_code, 401)
+
+        self.client.force_login(Player.objects.get(username="james"))
+        cache.clear()
+        self.client.get('/export/{}/'.format(group.pk))
+        # The group's players are only checked once, later requests use the cached memberships
+        with self.assertNumQueries(5):
+            response = self.client.get('/export/{}/'.format(group.pk))
+            exported = b''.join(response.streaming_content).decode()
+
+        self.assertEqual(exported.splitlines()[0], "Date,Game,Coop,james,james score,janedoe,janedoe score")
+        reimported = Group.objects.create(name="Reimported Group")
+        reimported.players.add(*group.players.all())
+        BulkImportScores(reimported).import_reader(ScoreReader(io.StringIO(exported)))
+        for game_round in Round.objects.filter(group=group):
+            copy = Round.objects.get(group=reimported, game=game_round.game, date=game_round.date)
+            self.assertEqual(sorted(game_round.players.values_list('player', 'rank', 'score')),
+                             sorted(copy.players.values_list('player', 'rank', 'score')))
+
+
+class TestDeltaExport(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create(name="Delta Group")
+        BulkImportScores(self.group).import_reader(ScoreReader(io.StringIO(TestBulkImportScores.scores)))
+        bracket = Bracket.objects.create(type=BracketType.ROUND_ROBIN)
+        team = Team.objects.create(name="Team 1", color="000000")
+        team.players.add(Player.objects.get(username="james"))
+        bracket.teams.add(team)
+        bracket.matches.add(BracketMatch.objects.create(match=1, round=Round.objects.filter(group=self.group).first()))
+        Tournament.objects.create(name="Delta Tournament", bracket=bracket, group=self.group)
+
+    @override_settings(DELTA_WATERMARK_LAG=0)
+    def test_delta(self):
+        """
+        Test that a delta only contains what changed since the watermark, including deletions.
+        :return: None
+        """
+        watermark = parse_datetime(export_delta(self.group)['watermark'])
+        empty = export_delta(self.group, watermark)
+        self.assertEqual((empty['rounds'], empty['teams'], empty['brackets'], empty['deleted']), ([], [], [], {}))
+
+        catan = Round.objects.get(group=self.group, game__name="Catan")
+        player_rank = catan.players.get(player__username="james")
+        player_rank.score = 12
+        player_rank.save()
+        uno = Round.objects.get(group=self.group, game__name="Uno")
+        uno_pk = uno.pk
+        uno.delete()
+
+        delta = export_delta(self.group, watermark)
+        self.assertEqual([game_round['pk'] for game_round in delta['rounds']], [catan.pk])
+        self.assertIn({'player': 'james', 'rank': 1, 'score': 12}, delta['rounds'][0]['ranks'])
+        self.assertEqual(delta['deleted'], {'round': [uno_pk]})
+        self.assertEqual(delta['tournaments'], [])
+
+    def test_replay(self):
+        """
+        Test that replaying a full delta after a wipe brings the group back, and replaying it again changes nothing.
+        :return: None
+        """
+        seeds = list(Bracket.objects.get().teams.values_list('pk', flat=True))
+        Bracket.objects.update(seeds=seeds)
+        delta = json.loads(json.dumps(export_delta(self.group)))
+        expected = sorted(Round.objects.filter(group=self.group).values_list('pk', 'game', 'date', 'players__rank'))
+        Tournament.objects.all().delete()
+        wipe_group(self.group)
+        Team.objects.all().delete()
+        self.assertFalse(Round.objects.filter(group=self.group).exists())
+
+        for _ in range(2):
+            stats = apply_delta(self.group, delta)
+            self.assertEqual(stats['rounds'], 2)
+            self.assertEqual(
+                sorted(Round.objects.filter(group=self.group).values_list('pk', 'game', 'date', 'players__rank')),
+                expected,
+            )
+            self.assertEqual(PlayerRank.objects.count(), 3)
+            tournament = Tournament.objects.get(group=self.group)
+            self.assertEqual(tournament.bracket.matches.get().match, 1)
+            self.assertEqual(tournament.bracket.seeds, seeds)
+            self.assertEqual(list(tournament.bracket.teams.get().players.values_list('username', flat=True)), ["james"])
+
+    def test_other_group(self):
+        """
+        Test that a delta of one group can't be replayed into another, which would move the first group's objects.
+        :return: None
+        """
+        other = Group.objects.create(name="Other Delta Group")
+        other.players.add(*self.group.players.all())
+        rounds = sorted(Round.objects.filter(group=self.group).values_list('pk', flat=True))
+
+        with self.assertRaises(DeltaError):
+            apply_delta(other, export_delta(self.group))
+        self.assertEqual(sorted(Round.objects.filter(group=self.group).values_list('pk', flat=True)), rounds)
+        self.assertEqual(Tournament.objects.get().group, self.group)
+
+        with self.assertRaises(CommandError):
+            call_command('import_delta', os.devnull, group="Missing Group")
+        self.assertFalse(Group.objects.filter(name="Missing Group").exists())
+
+
+class TestPivotScores(TestCase):
+    def test_pivot(self):
+        """
+        Test that a wide csv (a line per player) is turned into a line per round, across several sorted runs.
+        :return: None
+        """
+        wide = (
+            "james,James,Catan,1,10,3/2/22,Uno,2,,3/3/22\n"
+            ",,,,,,,,,\n"
+            "jane,Jane,Uno,1,,3/3/22,Catan,2.0,8,3/2/22,Chess,No Show,,3/4/22,Chess,x,,3/5/22\n"
+        )
+        directory = tempfile.mkdtemp()
+        source = os.path.join(directory, 'wide.csv')
+        destination = os.path.join(directory, 'long.csv')
+        with open(source, mode='w') as f:
+            f.write(wide)
+
+        stats = PivotScores(run_size=2).pivot_file(source, destination)
+
+        self.assertEqual((stats['players'], stats['cells'], stats['rounds'], stats['runs']), (2, 4, 2, 2))
+        self.assertEqual(stats['errors'], [(3, "Invalid rank 'x' for Chess")])
+        with open(destination, newline='') as f:
+            self.assertEqual(f.read().splitlines(), [
+                "Date,Game,Coop,james,james_scores,jane,jane_scores",
+                "3/2/22,Catan,,1,10,2,8",
+                "3/3/22,Uno,,2,,1,",
+            ])
+            f.seek(0)
+            self.assertEqual(len(list(ScoreReader(f))), 2)
+
+
+class TestParallelImportScores(TestCase):
+    def test_import_groups(self):
+        """
+        Test that several csvs are each imported into their own group, and unreadable files are reported.
+        :return: None
+        """
+        directory = tempfile.mkdtemp()
+        paths = [os.path.join(directory, name) for name in ['first.csv', 'second.csv', 'missing.csv']]
+        for path in paths[:2]:
+            with open(path, mode='w') as f:
+                f.write(TestBulkImportScores.scores + "3/4/22,Chess,,,,,\n")
+        groups = [Group.objects.create(name=name) for name in ['First', 'Second', 'Missing']]
+
+        results = ParallelImportScores(list(zip(paths, groups)), workers=0, writers=0, claim_players=True).run()
+
+        self.assertEqual([result.get('rounds') for result in results], [2, 2, None])
+        self.assertEqual([line for line, message in results[0]['errors']], [4, 6])
+        self.assertIn('FileNotFoundError', results[2]['error'])
+        self.assertEqual(Round.objects.filter(group__in=groups[:2]).count(), 4)
+        self.assertEqual(Player.objects.filter(username="janedoe").count(), 1)
+
+
+class TestMemberships(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.player = Player.objects.create(username="member")
+        self.group = Group.objects.create(name="Member Group")
+        self.other = Group.objects.create(name="Other Group")
+        self.group.players.add(self.player)
+
+    def test_cache(self):
+        """
+        Test that memberships are loaded once, and loaded again after they change.
+        :return: None
+        """
+        with self.assertNumQueries(2):
+            self.assertTrue(is_member(self.player, self.group.pk))
+            self.assertFalse(is_member(self.player, self.other.pk))
+            self.assertFalse(is_admin(self.player, self.group.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_member(self.player, self.group.pk))
+            # Another request's user comes from the cache
+            self.assertEqual(find_memberships(Player(pk=self.player.pk)), (frozenset([self.group.pk]), frozenset()))
+
+        self.other.admins.add(self.player)
+        self.player.players.add(self.other)
+        player = Player.objects.get(pk=self.player.pk)
+        self.assertEqual(find_memberships(player), (frozenset([self.group.pk, self.other.pk]),
+                                                    frozenset([self.other.pk])))
+        self.other.players.clear()
+        self.assertFalse(is_member(Player.objects.get(pk=self.player.pk), self.other.pk))
+
+    def test_bulk_memberships(self):
+        """
+        Test that imports, which add players without signals, still clear the memberships they change.
+        :return: None
+        """
+        self.assertFalse(is_member(self.player, self.other.pk))
+        BulkImportScores(self.other, claim_players=True).import_reader(ScoreReader(io.StringIO(
+            "Date,Game,Coop,member,member score\n3/2/22,Catan,,1,10\n"
+        )))
+        self.assertTrue(is_member(Player.objects.get(pk=self.player.pk), self.other.pk))
+
+    def test_viewsets(self):
+        """
+        Test that players only see their own groups' tournaments, and only admins change a group.
+        :return: None
+        """
+        tournaments = [Tournament.objects.create(name=group.name, group=group, bracket=Bracket.objects.create(
+            type=BracketType.ROUND_ROBIN,
+        )) for group in (self.group, self.other)]
+        self.client.force_login(self.player)
+        self.assertEqual([tournament['pk'] for tournament in self.client.get('/tournament/').json()],
+                         [tournaments[0].pk])
+        self.assertEqual(self.client.get('/tournament/{}/'.format(tournaments[1].pk)).status_code, 404)
+        self.assertEqual(self.client.patch('/group/{}/'.format(self.group.pk), {'name': "Renamed"},
+                                           content_type='application/json').status_code, 403)
+        self.assertEqual(self.client.patch('/tournament/{}/'.format(tournaments[0].pk), {'group': self.other.pk},
+                                           content_type='application/json').status_code, 403)
+
+        # Brackets, their teams and matches, and ranks belong to the group of their tournament or round
+        game = Game.objects.create(name="Member Game")
+        for tournament in tournaments:
+            team = Team.objects.create(name=tournament.name, color="000000")
+            tournament.bracket.teams.add(team)
+            game_round = Round.objects.create(game=game, group=tournament.group)
+            game_round.players.add(PlayerRank.objects.create(player=self.player, rank=1))
+            tournament.bracket.matches.add(BracketMatch.objects.create(match=1, round=game_round))
+        for url, model in [('/bracket/', Bracket), ('/team/', Team), ('/bracket_match/', BracketMatch),
+                           ('/player_rank/', PlayerRank)]:
+            own, other = model.objects.order_by('pk')
+            self.assertEqual([item['pk'] for item in self.client.get(url).json()], [own.pk])
+            self.assertEqual(self.client.get('{}{}/'.format(url, other.pk)).status_code, 404)
+
+        # Admins of a group can see and change it even if they don't play in it, but not what is in it
+        self.other.admins.add(self.player)
+        self.assertEqual(sorted(group['pk'] for group in self.client.get('/group/').json()),
+                         [self.group.pk, self.other.pk])
+        self.assertEqual(self.client.get('/group/{}/'.format(self.other.pk)).json()['name'], "Other Group")
+        self.assertEqual(self.client.patch('/group/{}/'.format(self.other.pk), {'name': "Renamed"},
+                                           content_type='application/json').status_code, 200)
+        self.assertEqual(self.client.get('/tournament/{}/'.format(tournaments[1].pk)).status_code, 404)
+
+
+class TestBrackets(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create(name="Bracket Group")
+        self.game = Game.objects.create(name="Chess")
+        self.teams = []
+        for number in range(1, 5):
+            team = Team.objects.create(name="Team {}".format(number), color="000000")
+            team.players.add(Player.objects.create(username="bracket{}".format(number)))
+            self.teams.append(team.pk)
+
+    def create_bracket(self, bracket_type, team_count):
+        bracket = Bracket.objects.create(type=bracket_type)
+        bracket.teams.add(*self.teams[:team_count])
+        return bracket
+
+    def play(self, *teams):
+        """
+        Create a round where the players of the given teams placed in the order given.
+        """
+        game_round = Round.objects.create(game=self.game, date="2022-03-02", group=self.group)
+        for rank, team in enumerate(teams, start=1):
+            game_round.players.add(PlayerRank.objects.create(player=Team.objects.get(pk=team).players.get(), rank=rank))
+        return game_round
+
+    def test_single_elimination(self):
+        """
+        Test that byes go to the best seeds, and winners move on until there is a champion.
+        :return: None
+        """
+        first, second, third, fourth = self.teams
+        bracket = self.create_bracket(BracketType.SINGLE_ELIMINATION, 3)
+        layout = get_layout(bracket)
+        self.assertEqual([match['teams'] for match in layout['matches']], [
+            [first, BYE], [second, third], [first, None],
+        ])
+        self.assertEqual(next_match(layout, first)['match'], 3)
+
+        with self.assertRaises(BracketError):
+            add_result(bracket, 3, self.play(first, second))
+        add_result(bracket, 2, self.play(third, second))
+        bracket.refresh_from_db()
+        self.assertEqual(bracket.layout['matches'][2]['teams'], [first, third])
+        self.assertIsNone(next_match(bracket.layout, second))
+        add_result(bracket, 3, self.play(third, first))
+        bracket.refresh_from_db()
+        self.assertEqual(bracket.layout['champion'], third)
+
+        # A reset layout is rebuilt from the bracket's matches
+        bracket.teams.add(fourth)
+        bracket.refresh_from_db()
+        self.assertIsNone(bracket.layout)
+        layout = get_layout(bracket)
+        self.assertEqual(layout['matches'][0]['teams'], [first, fourth])
+        self.assertEqual(layout['matches'][1]['winner'], third)
+        self.assertEqual(layout['errors'], [[3, "Match 3 is still waiting for its teams"]])
+
+    def test_double_elimination(self):
+        """
+        Test that teams drop into the losers bracket, and are only out after losing twice.
+        :return: None
+        """
+        first, second, third, fourth = self.teams
+        layout = build_layout(self.create_bracket(BracketType.DOUBLE_ELIMINATION, 4))
+        self.assertEqual([(match['stage'], match['round']) for match in layout['matches']], [
+            ('winners', 1), ('winners', 1), ('winners', 2), ('losers', 1), ('losers', 2), ('final', 1), ('final', 2),
+        ])
+        self.assertEqual(layout['matches'][3]['feeders'], [[1, 'loser'], [2, 'loser']])
+        self.assertEqual(layout['matches'][4]['feeders'], [[4, 'winner'], [3, 'loser']])
+        self.assertEqual(layout['reset'], 7)
+
+        for number, winner in [(1, first), (2, second), (3, first), (4, fourth), (5, second)]:
+            record_result(layout, find_match(layout, number), winner)
+        self.assertEqual(layout['matches'][5]['teams'], [first, second])
+        self.assertEqual(layout['next'], {str(first): 6, str(second): 6, str(third): None, str(fourth): None})
+        # The losers bracket's team winning the final forces the reset
+        record_result(layout, find_match(layout, 6), second)
+        self.assertIsNone(layout['champion'])
+        self.assertEqual(layout['matches'][6]['teams'], [second, first])
+        self.assertEqual(layout['next'], {str(first): 7, str(second): 7, str(third): None, str(fourth): None})
+        record_result(layout, find_match(layout, 7), first)
+        self.assertEqual(layout['champion'], first)
+        self.assertEqual(layout['wins'][str(first)], 3)
+
+    def test_bracket_reset(self):
+        """
+        Test that the reset isn't played when the winners bracket's team wins the final, and that its placeholder is
+        removed.
+        :return: None
+        """
+        first, second = self.teams[:2]
+        bracket = self.create_bracket(BracketType.DOUBLE_ELIMINATION, 2)
+        schedule_bracket(bracket)
+        self.assertEqual(sorted(bracket.matches.values_list('match', flat=True)), [1, 2, 3])
+
+        add_result(bracket, 1, self.play(first, second))
+        final = self.play(first, second)
+        add_result(bracket, 2, final)
+        bracket.refresh_from_db()
+        self.assertEqual(bracket.layout['champion'], first)
+        self.assertEqual(bracket.layout['matches'][2]['winner'], first)
+        self.assertIsNone(bracket.layout['matches'][2]['result'])
+        self.assertEqual(bracket.layout['next'], {str(first): None, str(second): None})
+        self.assertEqual(sorted(bracket.matches.values_list('match', flat=True)), [1, 2])
+        with self.assertRaises(BracketError):
+            add_result(bracket, 3, self.play(second, first))
+
+        # Changing the final's ranks rebuilds the layout, which now needs the reset
+        player_rank = final.players.get(rank=1)
+        player_rank.rank = 3
+        player_rank.save()
+        bracket.refresh_from_db()
+        self.assertIsNone(bracket.layout)
+        layout = get_layout(bracket)
+        self.assertIsNone(layout['champion'])
+        self.assertEqual(layout['next'], {str(first): 3, str(second): 3})
+
+    def test_round_robin(self):
+        """
+        Test that every team plays every other team once, a round at a time.
+        :return: None
+        """
+        first, second, third, fourth = self.teams
+        bracket = self.create_bracket(BracketType.ROUND_ROBIN, 3)
+        layout = get_layout(bracket)
+        self.assertEqual([(match['round'], match['teams']) for match in layout['matches']], [
+            (1, [second, third]), (2, [first, third]), (3, [first, second]),
+        ])
+        self.assertEqual(next_match(layout, first)['match'], 2)
+
+        bracket_match, match = add_result(bracket, 2, self.play(first, third))
+        self.assertEqual(match['winner'], first)
+        bracket.refresh_from_db()
+        self.assertEqual(next_match(bracket.layout, first)['match'], 3)
+        self.assertEqual(next_match(bracket.layout, third)['match'], 1)
+        with self.assertRaises(BracketError):
+            add_result(bracket, 2, self.play(first, third))
+
+    def test_swiss(self):
+        """
+        Test that Swiss rounds are paired as results come in, without rematches, and scheduled ahead of time.
+        :return: None
+        """
+        for number in range(5, 8):
+            team = Team.objects.create(name="Team {}".format(number), color="000000")
+            team.players.add(Player.objects.create(username="bracket{}".format(number)))
+            self.teams.append(team.pk)
+        bracket = self.create_bracket(BracketType.SWISS, 7)
+        scheduled, layout = schedule_bracket(bracket)
+        self.assertEqual(scheduled, 3)
+        self.assertEqual(layout['swiss_rounds'], 3)
+        # The last seed sits out the first round, and the rest are paired top half against bottom half
+        self.assertEqual([match['teams'] for match in layout['matches']], [
+            [self.teams[6], BYE], [self.teams[0], self.teams[3]], [self.teams[1], self.teams[4]],
+            [self.teams[2], self.teams[5]],
+        ])
+
+        for number in range(2, 5):
+            teams = layout['matches'][number - 1]['teams']
+            add_result(bracket, number, self.play(*teams))
+        bracket.refresh_from_db()
+        layout = bracket.layout
+        self.assertEqual(len(layout['matches']), 8)
+        self.assertEqual(bracket.matches.filter(round__isnull=True).count(), 3)
+        for match in layout['matches'][4:]:
+            self.assertEqual(match['round'], 2)
+            self.assertNotIn(match['teams'][1], layout['opponents'][str(match['teams'][0])][:1])
+        # Teams that sat out the first round don't sit out again
+        self.assertNotEqual(layout['matches'][4]['teams'][0], self.teams[6])
+
+    def test_match_endpoints(self):
+        """
+        Test that only the group's players can schedule a bracket and add matches to it, with rounds from the group, and
+        that filling in a scheduled match marks the bracket as changed.
+        :return: None
+        """
+        cache.clear()
+        first, second = self.teams[:2]
+        tournament = Tournament.objects.create(name="Endpoint Tournament", group=self.group,
+                                               bracket=self.create_bracket(BracketType.SINGLE_ELIMINATION, 2))
+        player = Team.objects.get(pk=first).players.get()
+        self.client.force_login(player)
+        self.assertEqual(self.client.post('/schedule_bracket/', {'tournament': tournament.pk},
+                                          content_type='application/json').status_code, 401)
+
+        self.group.players.add(player)
+        response = self.client.post('/schedule_bracket/', {'tournament': tournament.pk},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['scheduled'], 1)
+        updated_at = Bracket.objects.get(pk=tournament.bracket_id).updated_at
+
+        game_round = self.play(second, first)
+        game_round.group = Group.objects.create(name="Other Bracket Group")
+        game_round.save()
+        data = {'tournament': tournament.pk, 'match': 1, 'round': [game_round.pk]}
+        self.assertEqual(self.client.post('/add_match/', data, content_type='application/json').status_code, 401)
+
+        data['round'] = [self.play(second, first).pk]
+        response = self.client.post('/add_match/', data, content_type='application/json')
+        self.assertEqual(response.json()['match']['winner'], second)
+        bracket = Bracket.objects.get(pk=tournament.bracket_id)
+        self.assertEqual(bracket.layout['champion'], second)
+        self.assertGreater(bracket.updated_at, updated_at)
+
+    def test_large_schedules(self):
+        """
+        Test that large leagues are laid out quickly, and Swiss pairings avoid rematches whenever they can.
+        :return: None
+        """
+        bracket = Bracket.objects.create(type=BracketType.ROUND_ROBIN)
+        start = datetime.datetime.now()
+        layout = build_layout(bracket, seeds=range(1, 101))
+        self.assertLess((datetime.datetime.now() - start).total_seconds(), 1)
+        self.assertEqual(len(layout['matches']), 4950)
+        self.assertEqual({len(schedule) for schedule in layout['schedule'].values()}, {99})
+
+        teams = list(range(1000))
+        # Everyone has already played their neighbours, which is who they would be paired with first
+        opponents = {team: {team - 1, team + 1, team ^ 1} for team in teams}
+        start = datetime.datetime.now()
+        pairs = swiss_pairings(teams, opponents)
+        self.assertLess((datetime.datetime.now() - start).total_seconds(), 1)
+        self.assertEqual(sorted(team for pair in pairs for team in pair), teams)
+        self.assertFalse([pair for pair in pairs if pair[1] in opponents[pair[0]]])
+
+
+    def test_seeding(self):
+        """
+        Test that the strongest teams are seeded first and kept apart, and seeds are fixed once matches are played.
+        :return: None
+        """
+        first, second, third, fourth = self.teams
+        self.play(fourth, first)
+        self.play(fourth, first)
+        self.play(third, second)
+        bracket = self.create_bracket(BracketType.SINGLE_ELIMINATION, 4)
+        with self.assertNumQueries(8):
+            seeds = seed_bracket(bracket)
+        self.assertEqual([team for team, strength in seeds], [fourth, third, second, first])
+
+        bracket.refresh_from_db()
+        self.assertEqual(bracket.seeds, [fourth, third, second, first])
+        layout = get_layout(bracket)
+        self.assertEqual([match['teams'] for match in layout['matches'][:2]], [[fourth, first], [third, second]])
+        add_result(bracket, 1, self.play(first, fourth))
+        with self.assertRaises(BracketError):
+            seed_bracket(bracket)
+
+        # A team is as strong as its strongest player
+        pair = Team.objects.create(name="Pair", color="000000")
+        pair.players.add(*Player.objects.filter(game_players__in=[first, fourth]))
+        strengths = find_team_strengths([first, fourth, pair.pk])
+        self.assertEqual(strengths[pair.pk], max(strengths[first], strengths[fourth]))
+
+    def test_finalize(self):
+        """
+        Test that a finished tournament's results are frozen, and read back without touching the live rows.
+        :return: None
+        """
+        cache.clear()
+        first, second, third, fourth = self.teams
+        player = Player.objects.get(username="bracket1")
+        self.group.players.add(player)
+        tournament = Tournament.objects.create(name="Final", group=self.group, bracket=self.create_bracket(
+            BracketType.SINGLE_ELIMINATION, 2,
+        ))
+        self.client.force_login(player)
+        # Finalizing can't be undone, so members who aren't admins can't
+        response = self.client.post('/finalize_tournament/', {'tournament': tournament.pk},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.group.admins.add(player)
+        response = self.client.post('/finalize_tournament/', {'tournament': tournament.pk},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        add_result(tournament.bracket, 1, self.play(second, first))
+        live = self.client.get('/tournament_info/{}/'.format(tournament.pk)).json()
+        self.assertFalse(live['finalized'])
+        result = self.client.post('/finalize_tournament/', {'tournament': tournament.pk},
+                                  content_type='application/json').json()['result']
+        self.assertEqual(result['champion'], second)
+        self.assertEqual(result['scoring'], {"Team 1": 7, "Team 2": 9})
+        with self.assertRaises(ResultError):
+            finalize_tournament(tournament)
+
+        # The bracket can't change after it has been frozen
+        bracket = Bracket.objects.get(pk=tournament.bracket_id)
+        for change in (lambda: add_result(bracket, 1, self.play(first, second)),
+                       lambda: schedule_bracket(bracket), lambda: seed_bracket(bracket)):
+            with self.assertRaises(BracketError):
+                change()
+        with self.assertRaises(TeamError):
+            create_teams(tournament, [{'name': "Late Team", 'playerIds': [player.pk]}])
+        self.assertFalse(Team.objects.filter(name="Late Team").exists())
+        self.assertEqual(get_layout(Bracket.objects.get(pk=bracket.pk)), result['layout'])
+
+        # Later changes to the live rows don't change the results
+        PlayerRank.objects.all().delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(find_result(tournament.pk), result)
+        frozen = self.client.get('/tournament_info/{}/'.format(tournament.pk)).json()
+        self.assertTrue(frozen['finalized'])
+        self.assertEqual(frozen['tournament'], live['tournament'])
+        self.assertEqual(self.client.get('/tournament_stats/{}/'.format(tournament.pk)).json()['scoring'],
+                         result['scoring'])
+        # Ids from urls share the cached result, so it is forgotten with the tournament
+        with self.assertNumQueries(0):
+            self.assertEqual(find_result('0{}'.format(tournament.pk)), result)
+        self.assertIsNone(find_result('final'))
+        tournament.delete()
+        self.assertIsNone(find_result(tournament.pk))
+        self.assertIsNone(find_result('0{}'.format(tournament.pk)))
+
+    def test_group_tournaments(self):
+        """
+        Test that a group's tournaments are listed a page at a time, with their summaries from a single query.
+        :return: None
+        """
+        first, second, third, fourth = self.teams
+        player = Player.objects.get(username="bracket1")
+        self.group.players.add(player)
+        tournaments = [Tournament.objects.create(
+            name="Cup {}".format(number), group=self.group,
+            bracket=self.create_bracket(BracketType.SINGLE_ELIMINATION, 4),
+        ) for number in range(3)]
+        bracket = tournaments[0].bracket
+        add_result(bracket, 1, self.play(fourth, first))
+
+        with self.assertNumQueries(1):
+            listed, before = find_tournaments(self.group, TOURNAMENT_SCORING, limit=2)
+        self.assertEqual([tournament['name'] for tournament in listed], ["Cup 2", "Cup 1"])
+        self.assertEqual(listed[0]['teamCount'], 4)
+        self.assertEqual(listed[0]['completedMatchCount'], 0)
+        self.assertIsNone(listed[0]['leader'])
+
+        self.client.force_login(player)
+        response = self.client.get('/group_tournaments/{}/?limit=2&before={}'.format(self.group.pk, before)).json()
+        self.assertIsNone(response['next'])
+        self.assertEqual(len(response['tournaments']), 1)
+        self.assertEqual(response['tournaments'][0]['bracketType'], Bracket.objects.get(pk=bracket.pk).type)
+        self.assertEqual(response['tournaments'][0]['matchCount'], 1)
+        self.assertEqual(response['tournaments'][0]['completedMatchCount'], 1)
+        self.assertEqual(response['tournaments'][0]['leader'], {'pk': fourth, 'name': "Team 4", 'points': 9})
+        self.assertEqual(self.client.get('/group_tournaments/0/').status_code, 401)
+
+class TestBalanceTeams(TestCase):
+    def test_balance(self):
+        """
+        Test that a large pool is split into even sized teams with close total strengths.
+        :return: None
+        """
+        strengths = {player: (player * 37 % 101) / 100 for player in range(1, 121)}
+        start = datetime.datetime.now()
+        teams = balance_teams(strengths, 7)
+        self.assertLess((datetime.datetime.now() - start).total_seconds(), 1)
+        self.assertEqual(sorted(len(team) for team in teams), [17] * 6 + [18])
+        self.assertEqual(sorted(player for team in teams for player in team), list(strengths))
+        totals = [sum(strengths[player] for player in team) for team in teams]
+        self.assertLess(max(totals) - min(totals), 0.05)
+
+    def test_endpoint(self):
+        """
+        Test that teams are made from a group's players, using their wins.
+        :return: None
+        """
+        group = Group.objects.create(name="Balance Group")
+        BulkImportScores(group).import_reader(ScoreReader(io.StringIO(TestBulkImportScores.scores)))
+        player = Player.objects.get(username="james")
+        player.primary_group = group
+        player.save()
+        self.client.force_login(player)
+
+        response = self.client.post('/balance_teams/', {'teams': 2}, content_type='application/json').json()
+        self.assertEqual([[member['username'] for member in team['players']] for team in response['teams']],
+                         [['james'], ['janedoe']])
+        self.assertGreater(response['teams'][0]['strength'], response['teams'][1]['strength'])
+        for player_ids in [[player.pk, 0], [player.pk, "james"], [[player.pk]], player.pk]:
+            response = self.client.post('/balance_teams/', {'teams': 2, 'playerIds': player_ids},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+
+    def test_create_teams(self):
+        """
+        Test that several teams are made for a tournament at once, or none are if any player can't join.
+        :return: None
+        """
+        group = Group.objects.create(name="Team Group")
+        players = [Player.objects.create(username="teammate{}".format(number)) for number in range(6)]
+        group.players.add(*players)
+        outsider = Player.objects.create(username="outsider")
+        tournament = Tournament.objects.create(name="Cup", group=group, bracket=Bracket.objects.create(
+            type=BracketType.ROUND_ROBIN,
+        ))
+        self.client.force_login(players[0])
+
+        teams = [{'name': "Team {}".format(number), 'playerIds': [player.pk for player in players[number::3]]}
+                 for number in range(3)]
+        with self.assertNumQueries(13):
+            create_teams(tournament, teams)
+        self.assertEqual(sorted(tournament.bracket.teams.values_list('name', flat=True)),
+                         ["Team 0", "Team 1", "Team 2"])
+        self.assertEqual(Team.objects.get(name="Team 1").players.count(), 2)
+
+        # Nobody can be on two teams in a tournament, and everyone must be in its group
+        for player in (players[0], outsider):
+            response = self.client.post('/create_teams/', {'tournament': tournament.pk, 'teams': [
+                {'name': "Team 3", 'color': "FF0000", 'playerIds': [player.pk]},
+            ]}, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Team.objects.filter(name="Team 3").exists())
+
+        tournament.bracket.teams.clear()
+        response = self.client.post('/create_teams/', {'tournament': tournament.pk, 'teams': [
+            {'name': "Team 3", 'color': "FF0000", 'playerIds': [players[0].pk, players[1].pk]},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['teams'][0]['players'], [players[0].pk, players[1].pk])
+
+class TestProjections(TestCase):
+    def test_projection(self):
+        """
+        Test that a 16 team bracket is projected quickly, favours the stronger team, and is cached.
+        :return: None
+        """
+        group = Group.objects.create(name="Projection Group")
+        games = [Game.objects.create(name="Projection Game {}".format(number)) for number in range(3)]
+        bracket = Bracket.objects.create(type=BracketType.SINGLE_ELIMINATION)
+        players = []
+        for number in range(16):
+            team = Team.objects.create(name="Team {}".format(number), color="000000")
+            players.append(Player.objects.create(username="projection{}".format(number)))
+            team.players.add(players[-1])
+            bracket.teams.add(team)
+        # The first player always wins, everyone else places at random
+        for number in range(40):
+            game_round = Round.objects.create(game=games[number % 3], date="2022-03-02", group=group)
+            ranked = [players[0]] + [players[(number + offset) % 15 + 1] for offset in range(3)]
+            game_round.players.add(*[PlayerRank.objects.create(player=player, rank=rank)
+                                     for rank, player in enumerate(ranked, start=1)])
+        tournament = Tournament.objects.create(name="Projection Tournament", bracket=bracket, group=group)
+        tournament = Tournament.objects.select_related('bracket').get(pk=tournament.pk)
+
+        start = datetime.datetime.now()
+        projection = project_tournament(tournament, seed=1)
+        self.assertLess((datetime.datetime.now() - start).total_seconds(), 1)
+        self.assertEqual(projection['simulations'], 20000)
+        probabilities = [team['winProbability'] for team in projection['teams']]
+        self.assertAlmostEqual(sum(probabilities), 1, places=2)
+        self.assertEqual(max(probabilities), probabilities[0])
+        self.assertGreater(probabilities[0], 0.5)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(project_tournament(Tournament.objects.select_related('bracket').get(pk=tournament.pk),
+                                                seed=1), projection)
+        # Only the group's players can see the tournament's projection and bracket
+        urls = ['/tournament_projection/{}/', '/bracket_layout/{}/', '/bracket_next_match/{{}}/{}/'.format(team.pk)]
+        for url in urls:
+            self.assertEqual(self.client.get(url.format(tournament.pk)).status_code, 401)
+        group.players.add(players[0])
+        self.client.force_login(players[0])
+        response = self.client.get('/tournament_projection/{}/'.format(tournament.pk)).json()
+        self.assertEqual(len(response['projection']['teams']), 16)
+        self.assertEqual(len(self.client.get(urls[1].format(tournament.pk)).json()['layout']['matches']), 15)
+        self.assertEqual(self.client.get(urls[2].format(tournament.pk)).json()['match']['round'], 1)
+
+
+@override_settings(LIVE_STANDINGS_POLL_SECONDS=0.1)
+class TestLiveStandings(TestCase):
+    def test_stream(self):
+        """
+        Test that watchers get the full standings, then only the scores which change as results come in.
+        :return: None
+        """
+        group = Group.objects.create(name="Live Group")
+        BulkImportScores(group).import_reader(ScoreReader(io.StringIO(TestBulkImportScores.scores)))
+        bracket = Bracket.objects.create(type=BracketType.ROUND_ROBIN)
+        for name, usernames in [("Red", ["james", "keegan"]), ("Blue", ["janedoe"])]:
+            team = Team.objects.create(name=name, color="000000")
+            team.players.add(*Player.objects.filter(username__in=usernames))
+            bracket.teams.add(team)
+        tournament = Tournament.objects.create(name="Live Tournament", bracket=bracket, group=group)
+        first_round, second_round = Round.objects.filter(group=group).order_by('pk')
+
+        def event(stream):
+            lines = next(stream).splitlines()
+            self.assertEqual(lines[0], 'id: {}'.format(json.loads(lines[2][len('data: '):])['revision']))
+            return lines[1][len('event: '):], json.loads(lines[2][len('data: '):])
+
+        def revision():
+            return bracket_revision(Bracket.objects.get(pk=bracket.pk).updated_at)
+
+        stream = standings_hub.stream(tournament.pk)
+        self.assertTrue(next(stream).startswith('retry:'))
+        self.assertEqual(event(stream), ('standings', {
+            'tournament': tournament.pk, 'revision': revision(), 'scoring': {'Red': 0, 'Blue': 0},
+        }))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bracket.matches.add(BracketMatch.objects.create(match=1, round=first_round))
+        name, delta = event(stream)
+        self.assertEqual((name, delta['revision']), ('delta', revision()))
+        scores = self.client.get('/tournament_stats/{}/'.format(tournament.pk)).json()['scoring']
+        self.assertEqual(delta['scoring'], {team: score for team, score in scores.items() if score})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            player_rank = first_round.players.get(player__username="janedoe")
+            player_rank.rank = 4
+            player_rank.save()
+        self.assertEqual(event(stream), ('delta', {
+            'tournament': tournament.pk, 'revision': revision(), 'scoring': {'Blue': 3}, 'removed': [],
+        }))
+        self.assertGreater(revision(), delta['revision'])
+
+        # Reconnecting watchers only get what they missed, and a revision this process never sent (such as one from
+        # another process) gets the full standings
+        missed = standings_hub.stream(tournament.pk, last_revision=delta['revision'])
+        next(missed)
+        self.assertEqual(event(missed)[1]['revision'], revision())
+        missed.close()
+        unknown = standings_hub.stream(tournament.pk, last_revision=delta['revision'] - 1)
+        next(unknown)
+        self.assertEqual(event(unknown)[0], 'standings')
+        unknown.close()
+
+        # Changing a team's players is seen by other processes, through its bracket
+        updated = revision()
+        Team.objects.get(name="Blue").players.add(Player.objects.get(username="james"))
+        self.assertGreater(revision(), updated)
+        stream.close()
+        self.assertEqual(standings_hub.tournaments, {})
+
+        # Only the group's players can watch
+        self.assertEqual(self.client.get('/tournament_standings/{}/'.format(tournament.pk)).status_code, 401)
+        self.client.force_login(Player.objects.get(username="james"))
+        response = self.client.get('/tournament_standings/{}/'.format(tournament.pk))
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+
+class TestSnapshots(TestCase):
+    def test_round_trip(self):
+        """
+        Test that restoring a snapshot brings back every row of every table exactly, across several blocks, whether it
+        is loaded with COPY or not.
+        :return: None
+        """
+        group = Group.objects.create(name="Snapshot Group")
+        BulkImportScores(group).import_reader(ScoreReader(io.StringIO(TestBulkImportScores.scores)))
+        Benchmark.create_tournament(group, team_count=2, match_count=2)
+        Round.objects.filter(group=group).first().delete()
+        statistic_type = StatisticType.objects.create(name="Wins", unit="wins")
+        info = StatisticInfo.objects.create(date=datetime.date(2022, 3, 2), type=statistic_type, group=group)
+        Statistic.objects.create(player=Player.objects.get(username="james"), value=Decimal("12.50"), info=info)
+        ImportJob.objects.create(scores="imports/scores.csv", group=group, errors=[[4, "Invalid date 'é'"]])
+        document = {'champion': 1, 'bytes': list(range(256)), 'name': "é\t\\"}
+        TournamentResult.objects.create(tournament=Tournament.objects.first(), document=encode_document(document))
+
+        def everything():
+            return {model: list(model._base_manager.order_by('pk').values_list()) for model in snapshot_models()}
+        before = everything()
+        snapshot = io.BytesIO()
+        counts = dump_snapshot(snapshot, block_size=2)
+        self.assertEqual(counts['gameboard.round_players'], 1)
+
+        for use_copy in [True, False]:
+            with self.subTest(use_copy=use_copy), override_settings(IMPORT_USE_COPY=use_copy):
+                Token.objects.all().delete()
+                for model in reversed(snapshot_models()):
+                    delete_rows(model._base_manager.all(), model._base_manager.db)
+                snapshot.seek(0)
+                self.assertEqual(restore_snapshot(snapshot), counts)
+
+                self.assertEqual(everything(), before)
+                self.assertEqual(decode_document(TournamentResult.objects.get().document), document)
+                self.assertEqual(Token.objects.count(), Player.objects.count())
+        snapshot.seek(0)
+        with self.assertRaises(SnapshotError):
+            restore_snapshot(snapshot)
+
+
+    def test_copy_binary(self):
+        """
+        Test that binary values are written for COPY in bytea's hex format, however the database driver wraps them.
+        :return: None
+        """
+        document = {'champion': 1, 'name': "é\t\\"}
+        data = encode_document(document)
+        for value in [data, memoryview(data), Binary(data)]:
+            text = copy_value(value)
+            self.assertEqual(text, '\\\\x' + data.hex())
+            # COPY unescapes the backslash, then bytea reads the hex
+            self.assertEqual(decode_document(bytes.fromhex(text.replace('\\\\', '\\')[len('\\x'):])), document)
+        self.assertEqual(copy_value("a\tb\\c"), "a\\tb\\\\c")
+
+
 # class TestMenuServeFunctions(StaticLiveServerTestCase):
 #     """
 #
@@ -21,17 +21,38 @@ urlpatterns = [
 
     # Import/Export
     path('import/', import_scores, name="import"),
+    path('import_upload/', views.import_upload, name="Import Upload"),
+    path('import_job/<slug:pk>/', views.import_job, name="Import Job"),
     path('export/', export_scores, name="export"),
+    path('export/<slug:pk>/', views.export_group_scores, name="Export Group"),
+    path('export_delta/<slug:pk>/', views.export_group_delta, name="Export Group Delta"),
+
+    # Request metrics, for Prometheus to scrape
+    path('metrics', views.metrics, name='Metrics'),
+
+    # Captured request profiles, for staff
+    path('profiles/', views.profiles, name='Profiles'),
+    path('profiles/<str:name>/', views.profile_info, name='Profile Info'),
 
     # Info gathering for
     path('player_info/', views.player_info, name='Player Info'),
     path('add_round_info/', views.add_round_info, name='Add Round Info'),
+    path('group_tournaments/<slug:pk>/', views.group_tournaments, name='Group Tournaments'),
     path('tournament_info/<slug:pk>/', views.tournament_info, name='Tournament Info'),
+    path('finalize_tournament/', views.finalize_tournament, name='Finalize Tournament'),
     path('tournament_stats/<slug:pk>/', views.tournament_stats, name='Tournament Stats'),
+    path('tournament_projection/<slug:pk>/', views.tournament_projection, name='Tournament Projection'),
+    path('tournament_standings/<slug:pk>/', views.tournament_standings, name='Tournament Standings'),
+    path('bracket_layout/<slug:pk>/', views.bracket_layout, name='Bracket Layout'),
+    path('bracket_next_match/<slug:pk>/<int:team>/', views.bracket_next_match, name='Bracket Next Match'),
 
     # Post routes
     path('add_round/', views.add_round, name='Add Round'),
     path('add_match/', views.add_match, name='Add Round'),
+    path('schedule_bracket/', views.schedule_bracket, name='Schedule Bracket'),
+    path('seed_bracket/', views.seed_bracket, name='Seed Bracket'),
+    path('create_teams/', views.create_teams, name='Create Teams'),
+    path('balance_teams/', views.balance_teams, name='Balance Teams'),
 
     # Signing in and registering urls
     path('set-csrf/', views.set_csrf_token, name='Set-CSRF'),
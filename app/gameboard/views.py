@@ -1,13 +1,27 @@
+import csv
 import json
 
 from django.contrib.auth import login, authenticate, logout
-from django.http import JsonResponse
+from django.db.models import Prefetch
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_POST, require_GET
 
-from gameboard.helpers.import_helper import ImportScores, ExportScores
-from gameboard.models import Player, Round, Game, PlayerRank, Tournament, BracketMatch
-from gameboard.serializers import GroupSerializer
+from gameboard import metrics as gameboard_metrics, profiling
+from gameboard.forms import ImportScoresForm
+from gameboard.helpers import bracket_helper, result_helper, team_helper
+from gameboard.helpers.bracket_helper import BracketError, add_result, get_layout, next_match
+from gameboard.helpers.delta_helper import export_delta
+from gameboard.helpers.import_helper import ImportScores, ExportScores, export_rows
+from gameboard.helpers.job_helper import fail_stale_jobs, queue_import
+from gameboard.helpers.membership_helper import is_admin, is_member
+from gameboard.helpers.projection_helper import project_tournament
+from gameboard.helpers.result_helper import find_result, tournament_data
+from gameboard.helpers.standings_helper import TOURNAMENT_SCORING, find_standings, hub as standings_hub
+from gameboard.models import Player, Round, Game, PlayerRank, Tournament, ImportJob, Group, Team
+from gameboard.queries.find import find_player_strengths, find_tournaments
+from gameboard.serializers import GroupSerializer, TeamSerializer
 
 
 def import_scores(request):
@@ -22,6 +36,84 @@ def import_scores(request):
     return JsonResponse({"detail": "Success"})
 
 
+@require_POST
+def import_upload(request):
+    """
+    Uploads a score csv to be imported into the user's group by a background worker. See dataset.csv as an example.
+    Only the group's admins can import into it.
+
+    :param request: The user's request, with the csv as the 'scores' file, and optionally its format 'version', and
+                    'skip_existing' to only import rounds the group doesn't already have.
+    :return: A JSON response containing the id of the import job, which can be used to check on its progress.
+    """
+    if not request.user.is_authenticated or request.user.primary_group is None:
+        return JsonResponse({
+            "errors": {
+                "__all__": "User is not authenticated"
+            }
+        }, status=401)
+    if not is_admin(request.user, request.user.primary_group_id):
+        return JsonResponse({
+            "errors": {
+                "__all__": "Only the group's admins can import scores"
+            }
+        }, status=403)
+
+    form = ImportScoresForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+
+    job = ImportJob(
+        scores=form.cleaned_data['scores'],
+        version=form.cleaned_data['version'] or 2,
+        skip_existing=form.cleaned_data['skip_existing'],
+        group=request.user.primary_group,
+        created_by=request.user,
+    )
+    job.save()
+    queue_import(job)
+
+    return JsonResponse({
+        "detail": "Success",
+        "job": job.pk,
+    }, status=202)
+
+
+@require_GET
+def import_job(request, pk):
+    """
+    Gets the progress of an import job.
+
+    :param request: The user's request.
+    :param pk: The id of the import job.
+    :return: A JSON response containing the status, rows processed, errors, and an estimate of the time remaining.
+    """
+    # Jobs lost to a restart are only noticed when checked on, see job_helper
+    fail_stale_jobs(ImportJob.objects.filter(pk=pk))
+    job = ImportJob.objects.filter(pk=pk).first()
+    if job is None or not request.user.is_authenticated or \
+            (job.created_by_id != request.user.pk and not is_member(request.user, job.group_id)):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+
+    return JsonResponse({
+        "detail": "Success",
+        "job": {
+            "pk": job.pk,
+            "status": job.status,
+            "group": job.group_id,
+            "totalRows": job.total_rows,
+            "rowsProcessed": job.rows_processed,
+            "roundsCreated": job.rounds_created,
+            "roundsSkipped": job.rounds_skipped,
+            "errors": job.errors,
+            "etaSeconds": job.eta(),
+            "createdAt": job.created_at,
+            "startedAt": job.started_at,
+            "finishedAt": job.finished_at,
+        }
+    })
+
+
 def export_scores(request):
     """
     Exports the data to a standard format that can be imported again later.
@@ -34,57 +126,258 @@ def export_scores(request):
     return JsonResponse({"detail": "Success"})
 
 
+class Echo:
+    """
+    A file-like object which hands back whatever is written to it, so a csv writer can produce lines to stream.
+    """
+    def write(self, value):
+        return value
+
+
+@require_GET
+def export_group_scores(request, pk):
+    """
+    Streams all of a group's rounds to the client as a score csv, which can be imported again later.
+
+    :param request: The user's request.
+    :param pk: The id of the group to export.
+    :return: A streaming csv response.
+    """
+    group = Group.objects.filter(pk=pk).first()
+    if group is None or not is_member(request.user, group.pk):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(line) for line in export_rows(group)), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="group-{}-scores.csv"'.format(group.pk)
+    return response
+
+
+@require_GET
+def export_group_delta(request, pk):
+    """
+    Gets everything in a group which changed since a watermark (see gameboard/helpers/delta_helper.py), so backups and
+    syncs only need to fetch what changed.
+
+    :param request: The user's request, which can contain a since parameter, the watermark of the last delta fetched.
+                    Leaving it out gets everything.
+    :param pk: The id of the group to export.
+    :return: A JSON response containing the delta.
+    """
+    group = Group.objects.filter(pk=pk).first()
+    if group is None or not is_member(request.user, group.pk):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+
+    since = request.GET.get('since')
+    if since:
+        try:
+            since = parse_datetime(since)
+        except ValueError:
+            since = None
+        if since is None:
+            return JsonResponse({
+                "errors": {
+                    "since": "Please enter a valid timestamp"
+                }
+            }, status=400)
+    return JsonResponse({
+        "detail": "Success",
+        "delta": export_delta(group, since),
+    })
+
+
+@require_GET
+def metrics(request):
+    """
+    Exposes the request metrics of every worker process, in a format Prometheus can scrape. Staff, or scrapers sending
+    METRICS_TOKEN as a bearer token, only.
+
+    :param request: The user's request.
+    :return: The metrics as plain text.
+    """
+    if not gameboard_metrics.metrics_allowed(request):
+        return JsonResponse({"detail": "Staff only"}, status=403)
+    return HttpResponse(
+        gameboard_metrics.render_prometheus(gameboard_metrics.store.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+def staff_only(request):
+    """
+    Check a request comes from staff, authenticating the same way as the profiler (by session, or by JWT).
+
+    :param request: The user's request.
+    :return: None if the user is staff, otherwise the response to send instead.
+    """
+    user = profiling.get_profiling_user(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided"}, status=401)
+    if not user.is_staff:
+        return JsonResponse({"detail": "Staff only"}, status=403)
+    return None
+
+
+@require_GET
+def profiles(request):
+    """
+    Lists all of the request profiles that have been captured (see gameboard/profiling.py). Staff only.
+
+    :param request: The user's request.
+    :return: A JSON response containing the saved profiles, newest first.
+    """
+    denied = staff_only(request)
+    if denied is not None:
+        return denied
+    return JsonResponse({
+        "detail": "Success",
+        "profiles": list(reversed(profiling.list_profiles())),
+    })
+
+
+@require_GET
+def profile_info(request, name):
+    """
+    Gets the functions which took the most time in a captured profile. Staff only.
+
+    :param request: The user's request, which can contain a limit and sort ('cumulative' or 'total') parameter.
+    :param name: The name of the profile.
+    :return: A JSON response containing the top functions of the profile.
+    """
+    denied = staff_only(request)
+    if denied is not None:
+        return denied
+    try:
+        limit = int(request.GET.get('limit', 30))
+    except ValueError:
+        limit = 30
+    functions = profiling.top_functions(name, limit=limit, sort=request.GET.get('sort', 'cumulative'))
+    if functions is None:
+        return JsonResponse({"detail": "Invalid identifier"}, status=404)
+    return JsonResponse({
+        "detail": "Success",
+        "name": name,
+        "functions": functions,
+    })
+
+
+@require_GET
+def group_tournaments(request, pk):
+    """
+    Lists a group's tournaments, newest first, with each one's bracket type, team and match counts, and current leader.
+
+    :param request: The user's request, which can contain a limit (at most 100) and before parameter, the next value of
+                    the previous page.
+    :param pk: The id of the group.
+    :return: A JSON response containing a page of tournaments, and the before value of the next page (null if this is
+             the last page).
+    """
+    group = Group.objects.filter(pk=pk).first()
+    if group is None or not is_member(request.user, group.pk):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        limit = min(max(int(request.GET.get('limit', 25)), 1), 100)
+        before = int(request.GET['before']) if request.GET.get('before') else None
+    except ValueError:
+        return JsonResponse({
+            "errors": {
+                "__all__": "Please enter a valid limit and before"
+            }
+        }, status=400)
+    tournaments, next_before = find_tournaments(group, TOURNAMENT_SCORING, before=before, limit=limit)
+    return JsonResponse({
+        "detail": "Success",
+        "tournaments": tournaments,
+        "next": next_before,
+    })
+
+
 @require_GET
 def tournament_stats(request, pk):
     # TODO check that we can access this stuff
-    tournament_query = Tournament.objects.filter(pk=pk)
-    if len(tournament_query) > 0:
-        tournament = tournament_query.first()
-        # Get all the stats associated with this tournament.
-        # Get current scores
-        # This can be calculated by assigning point values to every 1, 2, 3, and 4 placement
-        # TODO make scoring customizable. For now go 9, 7, 5, 3 respectively
-        scoring = {
-            1: 9,
-            2: 7,
-            3: 5,
-            4: 3,
-        }
-        scores_by_team = {}  # key: team pk, value: cumulative score
-        team_by_players = {}  # key: player pk, value: team pk
-        # For each team, get all players.
-        for team in tournament.bracket.teams.all():
-            team_name = team.name
-            scores_by_team[team_name] = 0
-            for team_player in team.players.all():
-                team_by_players[team_player.pk] = team_name
-
-        # Go through all matches in bracket, find each player that played, find their associated team, and add ranking
-        for match in tournament.bracket.matches.all():
-            for player_rank in match.round.players.all():
-                try:
-                    players_team = team_by_players[player_rank.player.pk]
-                    if players_team is not None and player_rank.rank is not None:
-                        scores_by_team[players_team] += scoring[player_rank.rank]
-                except KeyError:
-                    # Player doesn't have a team
-                    pass
-
-        # Get current weighted scores
-        # TODO ask kevin how this is calculated
+    result = find_result(pk)
+    if result is not None:
+        # Finalized tournaments keep their final scores
+        return JsonResponse({
+            "detail": "Success",
+            "scoring": result['scoring'],
+        })
+    tournament = Tournament.objects.filter(pk=pk).first()
+    if tournament is not None:
+        # Get current scores, from the live standings if anyone is watching them (see standings_helper)
+        # TODO ask kevin how weighted scores are calculated
         return JsonResponse({
             "detail": "Success",
-            "scoring": scores_by_team,
+            "scoring": find_standings(tournament),
         })
     return JsonResponse(
         {"detail": "Invalid identifier"},
         status=401,
     )
 
+
+@require_GET
+def tournament_projection(request, pk):
+    """
+    Gets how likely each team is to win a tournament, from simulating its remaining matches (see
+    gameboard/helpers/projection_helper.py).
+
+    :param request: The user's request.
+    :param pk: The id of the tournament.
+    :return: A JSON response containing the projection.
+    """
+    tournament = Tournament.objects.filter(pk=pk).select_related('bracket').first()
+    if tournament is None or not is_member(request.user, tournament.group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        projection = project_tournament(tournament)
+    except BracketError as e:
+        return JsonResponse({
+            "errors": {
+                "__all__": str(e)
+            }
+        }, status=400)
+    return JsonResponse({
+        "detail": "Success",
+        "projection": projection,
+    })
+
+
+@require_GET
+def tournament_standings(request, pk):
+    """
+    Streams a tournament's team scores as Server-Sent Events, sending only the scores which changed as results come in
+    (see gameboard/helpers/standings_helper.py).
+
+    :param request: The user's request. Reconnecting clients send the Last-Event-ID header (or a revision parameter),
+                    and are sent only what they missed.
+    :param pk: The id of the tournament.
+    :return: An event stream.
+    """
+    group_id = Tournament.objects.filter(pk=pk).values_list('group_id', flat=True).first()
+    if group_id is None or not is_member(request.user, group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        last_revision = int(request.headers.get('Last-Event-ID') or request.GET.get('revision'))
+    except (TypeError, ValueError):
+        last_revision = None
+
+    response = StreamingHttpResponse(standings_hub.stream(int(pk), last_revision), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @require_POST
 def add_match(request):
+    """
+    Adds the round a bracket match was played in to a tournament, moving the winning team on through the bracket.
+
+    :param request: The user's request, containing the match number, round, and tournament.
+    :return: A JSON response containing the tournament's id and the match from the bracket's layout.
+    """
     data = json.loads(request.body)
-    print(data)
     round_pk = data.get('round')[0]
     match = data.get('match')
     tournament_pk = data.get('tournament')
@@ -96,14 +389,178 @@ def add_match(request):
         }, status=400)
 
     round = Round.objects.filter(pk=round_pk).first()
-    match = BracketMatch(match=match, round=round)
-    match.save()
-    tournament = Tournament.objects.filter(pk=tournament_pk).first()
-    tournament.bracket.rounds.add(match)
+    tournament = Tournament.objects.filter(pk=tournament_pk).select_related('bracket').first()
+    # The round must have been played by the tournament's group
+    if round is None or tournament is None or round.group_id != tournament.group_id or \
+            not is_member(request.user, tournament.group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        bracket_match, layout_match = add_result(tournament.bracket, int(match), round)
+    except BracketError as e:
+        return JsonResponse({
+            "errors": {
+                "__all__": str(e)
+            }
+        }, status=400)
 
     return JsonResponse({
         "detail": "Success",
         "pk": tournament_pk,
+        "match": layout_match,
+    })
+
+
+@require_POST
+def schedule_bracket(request):
+    """
+    Schedules every match of a tournament's bracket up front (see gameboard/helpers/bracket_helper.py), so each match
+    can be filled in with the round it was played in as results come in.
+
+    :param request: The user's request, containing the tournament.
+    :return: A JSON response containing how many matches were scheduled, and the bracket's layout.
+    """
+    data = json.loads(request.body)
+    tournament = Tournament.objects.filter(pk=data.get('tournament')).select_related('bracket').first()
+    if tournament is None or not is_member(request.user, tournament.group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        scheduled, layout = bracket_helper.schedule_bracket(tournament.bracket)
+    except BracketError as e:
+        return JsonResponse({
+            "errors": {
+                "__all__": str(e)
+            }
+        }, status=400)
+    return JsonResponse({
+        "detail": "Success",
+        "scheduled": scheduled,
+        "layout": layout,
+    })
+
+
+@require_POST
+def create_teams(request):
+    """
+    Creates several teams for a tournament at once (see gameboard/helpers/team_helper.py). Either every team is
+    created, or none are.
+
+    :param request: The user's request, containing the tournament, and a list of teams each with a name, playerIds, and
+                    optionally a color.
+    :return: A JSON response containing the new teams.
+    """
+    data = json.loads(request.body)
+    tournament = Tournament.objects.filter(pk=data.get('tournament')).select_related('bracket', 'group').first()
+    if tournament is None or not is_member(request.user, tournament.group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        teams = team_helper.create_teams(tournament, data.get('teams'))
+    except team_helper.TeamError as e:
+        return JsonResponse({
+            "errors": {
+                "teams": str(e)
+            }
+        }, status=400)
+    return JsonResponse({
+        "detail": "Success",
+        "teams": TeamSerializer(Team.objects.filter(pk__in=[team.pk for team in teams]).order_by('pk').prefetch_related(
+            Prefetch('players', queryset=Player.objects.order_by('pk'))
+        ), many=True).data,
+    }, status=201)
+
+
+@require_POST
+def seed_bracket(request):
+    """
+    Seeds the teams of a tournament's bracket by their players' past results (see gameboard/helpers/team_helper.py),
+    so the strongest teams meet as late as possible.
+
+    :param request: The user's request, containing the tournament.
+    :return: A JSON response containing each team and its strength, in seeded order.
+    """
+    data = json.loads(request.body)
+    tournament = Tournament.objects.filter(pk=data.get('tournament')).select_related('bracket').first()
+    if tournament is None or not is_member(request.user, tournament.group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        seeds = team_helper.seed_bracket(tournament.bracket)
+    except BracketError as e:
+        return JsonResponse({
+            "errors": {
+                "__all__": str(e)
+            }
+        }, status=400)
+    return JsonResponse({
+        "detail": "Success",
+        "seeds": [{
+            "pk": team,
+            "seed": seed,
+            "strength": round(strength, 4),
+        } for seed, (team, strength) in enumerate(seeds, start=1)],
+    })
+
+
+@require_POST
+def balance_teams(request):
+    """
+    Splits players from the user's group into teams whose historical strengths are as even as possible (see
+    gameboard/helpers/team_helper.py). Nothing is saved, the teams are only suggested.
+
+    :param request: The user's request, containing the number of 'teams' to make, and optionally the 'playerIds' to
+                    split up (defaults to everyone in the group).
+    :return: A JSON response containing each team's players, their strengths, and the team's total strength.
+    """
+    if not request.user.is_authenticated or request.user.primary_group is None:
+        return JsonResponse({
+            "errors": {
+                "__all__": "User is not authenticated"
+            }
+        }, status=401)
+    data = json.loads(request.body)
+    players = request.user.primary_group.players.all()
+    player_ids = data.get('playerIds')
+    if player_ids is not None:
+        valid = isinstance(player_ids, list)
+        try:
+            player_ids = {int(player_id) for player_id in player_ids} if valid else None
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            return JsonResponse({
+                "errors": {
+                    "playerIds": "Please enter a list of player ids"
+                }
+            }, status=400)
+        players = players.filter(pk__in=player_ids)
+    usernames = dict(players.values_list('pk', 'username'))
+    if player_ids is not None and len(usernames) != len(player_ids):
+        return JsonResponse({
+            "errors": {
+                "playerIds": "Every player must be in your group"
+            }
+        }, status=400)
+    try:
+        team_count = int(data.get('teams'))
+    except (TypeError, ValueError):
+        team_count = 0
+    if not 1 <= team_count <= len(usernames):
+        return JsonResponse({
+            "errors": {
+                "teams": "Please enter between 1 and {} teams".format(len(usernames))
+            }
+        }, status=400)
+
+    strengths = find_player_strengths(list(usernames))
+    teams = team_helper.balance_teams(strengths, team_count)
+    return JsonResponse({
+        "detail": "Success",
+        "teams": [{
+            "strength": round(sum(strengths[player] for player in team), 4),
+            "players": [{
+                "pk": player,
+                "username": usernames[player],
+                "strength": round(strengths[player], 4),
+            } for player in team],
+        } for team in teams],
     })
 
 
@@ -191,84 +648,109 @@ def add_round_info(request):
 @require_GET
 def tournament_info(request, pk):
     # TODO check that we can access this stuff
-    tournament_query = Tournament.objects.filter(pk=pk)
-    if len(tournament_query) > 0:
-        # Get basic tournament info
-        tournament = tournament_query.first()
-        bracket = tournament.bracket
-
-        # For every team, get their information
-        bracket_teams = []
-        for team in bracket.teams.all():
-            # Gather all player info
-            team_players = []
-            for team_player in team.players.all():
-                team_players.append({
-                    'pk': team_player.pk,
-                    'username': team_player.username,
-                })
-
-            bracket_teams.append({
-                'pk': team.pk,
-                'name': team.name,
-                'color': team.color,
-                'players': team_players,
-            })
-
-        # For every match, gather information
-        bracket_matches = []
-        for match in bracket.matches.all():
-            game_round = match.round
-
-            # Gather round info
-            round_ranks = []
-            for player_rank in game_round.players.all():
-                round_ranks.append({
-                    'pk': player_rank.pk,
-                    'player': {
-                        'pk': player_rank.player.pk,
-                        'username': player_rank.player.username,
-                    },
-                    'rank': player_rank.rank,
-                    'score': player_rank.score,
-                })
-
-            bracket_matches.append({
-                'pk': match.pk,
-                'match': match.match,
-                'round': {
-                    'pk': game_round.pk,
-                    'game': {
-                        'pk': game_round.game.pk,
-                        'name': game_round.game.name,
-                    },
-                    'date': game_round.date,
-                    'players': round_ranks,
-                }
-            })
-
-        # Append it all to the return object
-        data = {
+    # Finalized tournaments are read from their frozen results (see result_helper)
+    result = find_result(pk)
+    if result is not None:
+        return JsonResponse({
             'detail': 'Success',
-            'tournament': {
-                'pk': tournament.pk,
-                'name': tournament.name,
-                'group': tournament.group.pk,
-                'bracket': {
-                    'pk': bracket.pk,
-                    'type': bracket.type,
-                    'teams': bracket_teams,
-                    'matches': bracket_matches,
-                }
-            }
-        }
-        return JsonResponse(data)
+            'finalized': True,
+            'tournament': result['tournament'],
+        })
+    tournament = Tournament.objects.filter(pk=pk).select_related('bracket').first()
+    if tournament is not None:
+        return JsonResponse({
+            'detail': 'Success',
+            'finalized': False,
+            'tournament': tournament_data(tournament),
+        })
     return JsonResponse(
         {"detail": "Invalid identifier"},
         status=401,
     )
 
 
+@require_POST
+def finalize_tournament(request):
+    """
+    Freezes a finished tournament's bracket, matches, and standings (see gameboard/helpers/result_helper.py), so they
+    are read as they were from then on.
+
+    :param request: The user's request, containing the tournament. Finalizing can't be undone, so only the group's
+                    admins can.
+    :return: A JSON response containing the frozen results.
+    """
+    data = json.loads(request.body)
+    tournament = Tournament.objects.filter(pk=data.get('tournament')).first()
+    if tournament is None or not is_admin(request.user, tournament.group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        result = result_helper.finalize_tournament(tournament)
+    except (BracketError, result_helper.ResultError) as e:
+        return JsonResponse({
+            "errors": {
+                "__all__": str(e)
+            }
+        }, status=400)
+    return JsonResponse({
+        "detail": "Success",
+        "result": result,
+    }, status=201)
+
+
+@require_GET
+def bracket_layout(request, pk):
+    """
+    Gets every match of a tournament's bracket, who is playing in each, and where the winners and losers go next (see
+    gameboard/helpers/bracket_helper.py).
+
+    :param request: The user's request.
+    :param pk: The id of the tournament.
+    :return: A JSON response containing the layout.
+    """
+    tournament = Tournament.objects.filter(pk=pk).select_related('bracket').first()
+    if tournament is None or not is_member(request.user, tournament.group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        layout = get_layout(tournament.bracket)
+    except BracketError as e:
+        return JsonResponse({
+            "errors": {
+                "__all__": str(e)
+            }
+        }, status=400)
+    return JsonResponse({
+        "detail": "Success",
+        "layout": layout,
+    })
+
+
+@require_GET
+def bracket_next_match(request, pk, team):
+    """
+    Gets the next match a team plays in a tournament.
+
+    :param request: The user's request.
+    :param pk: The id of the tournament.
+    :param team: The id of the team.
+    :return: A JSON response containing the match, or null if the team has no more matches.
+    """
+    tournament = Tournament.objects.filter(pk=pk).select_related('bracket').first()
+    if tournament is None or not is_member(request.user, tournament.group_id):
+        return JsonResponse({"detail": "Invalid identifier"}, status=401)
+    try:
+        layout = get_layout(tournament.bracket)
+    except BracketError as e:
+        return JsonResponse({
+            "errors": {
+                "__all__": str(e)
+            }
+        }, status=400)
+    return JsonResponse({
+        "detail": "Success",
+        "match": next_match(layout, team),
+    })
+
+
 @require_GET
 def player_info(request):
     if request.user.is_authenticated:
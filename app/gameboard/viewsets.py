@@ -1,8 +1,11 @@
+from django.db.models import Q
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 
+from gameboard.helpers.membership_helper import find_memberships
 from gameboard.models import Player, Round, Game, Group, PlayerRank, Team, Bracket, Tournament, \
     BracketMatch
+from gameboard.permissions import IsGroupMember
 from gameboard.serializers import GroupSerializer, PlayerSerializer, GameSerializer, \
     PlayerRankSerializer, RoundSerializer, TeamSerializer, BracketSerializer, \
     TournamentSerializer, BracketMatchSerializer
@@ -32,7 +35,11 @@ class GroupViewSet(viewsets.ModelViewSet):
     """
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsGroupMember]
+
+    def get_queryset(self):
+        groups, admin_groups = find_memberships(self.request.user)
+        return super().get_queryset().filter(pk__in=groups | admin_groups)
 
 
 class PlayerRankViewSet(viewsets.ModelViewSet):
@@ -43,6 +50,12 @@ class PlayerRankViewSet(viewsets.ModelViewSet):
     serializer_class = PlayerRankSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        # Ranks belong to the group of the round they were placed in
+        return super().get_queryset().filter(
+            game_players__group_id__in=find_memberships(self.request.user)[0],
+        ).distinct()
+
 
 class RoundViewSet(viewsets.ModelViewSet):
     """
@@ -50,7 +63,10 @@ class RoundViewSet(viewsets.ModelViewSet):
     """
     queryset = Round.objects.all()
     serializer_class = RoundSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsGroupMember]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(group_id__in=find_memberships(self.request.user)[0])
 
 
 class BracketMatchViewSet(viewsets.ModelViewSet):
@@ -61,6 +77,12 @@ class BracketMatchViewSet(viewsets.ModelViewSet):
     serializer_class = BracketMatchSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        groups = find_memberships(self.request.user)[0]
+        return super().get_queryset().filter(
+            Q(matches__tournament__group_id__in=groups) | Q(round__group_id__in=groups)
+        ).distinct()
+
 
 class TeamViewSet(viewsets.ModelViewSet):
     """
@@ -70,6 +92,12 @@ class TeamViewSet(viewsets.ModelViewSet):
     serializer_class = TeamSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        # Teams belong to the groups of the tournaments they play in, and players can always see their own teams
+        return super().get_queryset().filter(
+            Q(teams__tournament__group_id__in=find_memberships(self.request.user)[0]) | Q(players=self.request.user)
+        ).distinct()
+
 
 class BracketViewSet(viewsets.ModelViewSet):
     """
@@ -79,6 +107,11 @@ class BracketViewSet(viewsets.ModelViewSet):
     serializer_class = BracketSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            tournament__group_id__in=find_memberships(self.request.user)[0],
+        ).distinct()
+
 
 class TournamentViewSet(viewsets.ModelViewSet):
     """
@@ -86,4 +119,7 @@ class TournamentViewSet(viewsets.ModelViewSet):
     """
     queryset = Tournament.objects.all()
     serializer_class = TournamentSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsGroupMember]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(group_id__in=find_memberships(self.request.user)[0])
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 import datetime
 import os
+import tempfile
 from pathlib import Path
 
 # Fix the css mimetype error from some css editors, if there’s a need for it
@@ -108,8 +109,66 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Per route latency and error metrics, must come before the query budget middleware
+    'gameboard.metrics.MetricsMiddleware',
+    # Counts queries per request, and flags N+1 problems
+    'gameboard.middleware.QueryBudgetMiddleware',
+    # Lets staff profile a single request, keep this last
+    'gameboard.profiling.ProfilerMiddleware',
 ]
 
+# Query budgets per url name (see gameboard/urls.py), any route not listed uses the default (None for no budget)
+QUERY_BUDGETS = {
+    'Tournament Info': 25,
+    'Tournament Stats': 25,
+}
+QUERY_BUDGET_DEFAULT = None
+# How many times the same query shape can repeat in a request before it is flagged as an N+1
+QUERY_REPEAT_THRESHOLD = 10
+# Raise instead of logging a warning when a request goes over budget. Tests can turn this on with override_settings.
+QUERY_BUDGET_RAISE = False
+
+# Where each worker process writes its metrics for /metrics to add up. Must be local to each host, as the files of
+# exited workers are found by process id and removed.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'gameboard-metrics'))
+# Bearer token Prometheus sends to scrape /metrics (staff can always see it)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# How often (in seconds) a worker writes its metrics to METRICS_DIR
+METRICS_FLUSH_INTERVAL = 5
+
+# Staff can profile a request by sending the X-Profile header (or ?profile=1), profiles are saved to PROFILE_DIR
+PROFILER_ENABLED = True
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'gameboard-profiles'))
+# Only keep this many of the newest profiles
+PROFILE_MAX_FILES = 50
+
+# Number of background threads running uploaded imports (0 runs them during the upload request). The threads live in
+# the web process, so jobs are lost when it exits
+IMPORT_WORKERS = 2
+# Jobs still running this many seconds after starting are marked as failed (see job_helper)
+IMPORT_JOB_TIMEOUT = 60 * 60
+# Jobs still queued this many seconds after being uploaded are marked as failed. Jobs wait for a free worker, so this
+# must be longer than the queue takes to drain
+IMPORT_QUEUE_TIMEOUT = 24 * 60 * 60
+# Load imports and snapshots on PostgreSQL with COPY instead of bulk_create. Other databases always use bulk_create
+IMPORT_USE_COPY = True
+
+# Delta exports hold their watermark back this many seconds, to catch changes that were still being committed
+DELTA_WATERMARK_LAG = 60
+
+# How often (in seconds) live standings streams send a keep-alive and check for changes made by other processes
+LIVE_STANDINGS_POLL_SECONDS = 5
+# Live standings streams are closed (and reconnected by the browser) after this many seconds, freeing their worker
+# thread. Each open stream holds a thread, so the server must run threaded workers (see standings_helper)
+LIVE_STANDINGS_MAX_SECONDS = 60
+
+# How many times tournament projections play out the remaining matches, and how long (in seconds) they are cached
+PROJECTION_SIMULATIONS = 20000
+PROJECTION_CACHE_SECONDS = 600
+
+# How long (in seconds) the ids of a player's groups are cached for permission checks
+MEMBERSHIP_CACHE_SECONDS = 60
+
 SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 
 ROOT_URLCONF = 'gameboardapp.urls'